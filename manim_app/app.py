@@ -1,9 +1,12 @@
-from flask import Flask, render_template, send_from_directory, request, jsonify
+from flask import Flask, render_template, request, jsonify
+from werkzeug.security import safe_join
+import mimetypes
 import os
 import argparse
 import socket
 import logging
 from backend.api import api
+from backend.delivery import send_media
 
 # Configure logging
 logging.basicConfig(
@@ -28,6 +31,8 @@ app.register_blueprint(api, url_prefix='/api')
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
 MEDIA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media')
 TEMP_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utils', 'temp')
+# Parts of MEDIA_FOLDER served at /media/: the rest (caches, pins, recordings) is internal
+SERVED_MEDIA_FOLDERS = ('videos', 'images')
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(MEDIA_FOLDER, exist_ok=True)
@@ -40,8 +45,14 @@ def index():
 
 @app.route('/media/<path:filename>')
 def serve_media(filename):
-    """Serve media files"""
-    return send_from_directory(MEDIA_FOLDER, filename)
+    """Serve media files (with byte ranges, ETags and optional proxy hand-off)"""
+    path = safe_join(MEDIA_FOLDER, filename)
+    if path is None or os.path.relpath(path, MEDIA_FOLDER).split(os.sep)[0] not in SERVED_MEDIA_FOLDERS:
+        return jsonify({"error": "Resource not found"}), 404
+    if not os.path.isfile(path):
+        return jsonify({"error": "Resource not found"}), 404
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    return send_media(path, mimetype)
 
 @app.errorhandler(404)
 def page_not_found(e):
@@ -1,10 +1,7 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 import os
-import subprocess
-import uuid
-import time
 import json
-import re
+import time
 from werkzeug.utils import secure_filename
 
 # Create a Blueprint for the backend API
@@ -15,6 +12,10 @@ UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__f
 MEDIA_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'media')
 TEMP_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'utils', 'temp')
 MANIM_TEMPLATE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'utils', 'templates')
+# Seconds between keepalive comments on idle event streams
+EVENT_KEEPALIVE_SECONDS = 15
+# Seconds between job store reads when streaming events of another process's job
+STORE_POLL_SECONDS = 1
 
 # Create necessary directories if they don't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -22,8 +23,18 @@ os.makedirs(MEDIA_FOLDER, exist_ok=True)
 os.makedirs(TEMP_FOLDER, exist_ok=True)
 os.makedirs(MANIM_TEMPLATE_FOLDER, exist_ok=True)
 
-# Import the enhanced text_to_manim_code function
-from backend.text_to_manim import text_to_manim_code
+# Import the job queue that runs code generation and rendering off the request
+from backend.jobs import job_queue, Job, QueueFullError, COMPLETED, RENDERING, FINAL_STATES
+from backend.job_store import job_store
+from backend.batches import batch_runner, batch_status, item_status, BATCH_MAX_ITEMS
+from backend.renderer import QUALITY_TIERS, DEFAULT_QUALITY
+from backend.cache import result_cache
+from backend.scene_cache import scene_cache
+from backend.janitor import pin_job, unpin_job
+from backend.delivery import send_media
+from backend.metrics import registry
+from backend.scheduler import PRIORITY_CLASSES, INTERACTIVE
+from backend.text_to_manim import stream_manim_code, SOURCE_GEMINI
 
 @api.route('/health', methods=['GET'])
 def health_check():
@@ -33,75 +44,338 @@ def health_check():
 @api.route('/generate', methods=['POST'])
 def generate_animation():
     """
-    Generate a Manim animation from text description
+    Queue a Manim animation to be generated from a text description
     
     Expected JSON payload:
     {
-        "description": "Text description of the animation to generate"
+        "description": "Text description of the animation to generate",
+        "quality": "l",  # optional: l, m, h or k
+        "priority": "interactive",  # optional: interactive or batch
+        "deadline_ms": 20000,  # optional: latency budget of the low quality video
+        "rerender": true  # optional: replace a degraded video with a full render (default)
     }
+    
+    Returns 202 with the job ID right away; poll /api/status/<job_id>
+    for progress. Returns 429 when the render queue is full.
+    
+    Renders are scheduled shortest first, interactive ones ahead of
+    batch ones; an X-Client-ID header (else the client's address)
+    identifies the client for fair sharing of the render workers.
+    
+    A low quality video is always rendered first; a higher requested
+    quality is rendered afterwards and listed under "videos" in the status.
+    
+    With a deadline, a low quality video estimated to finish late is
+    rendered at a lower frame rate and resolution, or as its last frame
+    only, as listed under "degradations" in the status; a full render then
+    replaces it unless rerender is false. The 202 carries the plan as it
+    stands when the code is already known. A job rendered as its last
+    frame only has a preview_url and no video_url.
     """
     if not request.json or 'description' not in request.json:
         return jsonify({"error": "Missing description parameter"}), 400
     
     description = request.json['description']
+    quality = request.json.get('quality', DEFAULT_QUALITY)
+    if quality not in QUALITY_TIERS:
+        return jsonify({"error": f"Invalid quality '{quality}', expected one of {', '.join(QUALITY_TIERS)}"}), 400
+    priority = request.json.get('priority', INTERACTIVE)
+    if priority not in PRIORITY_CLASSES:
+        return jsonify({"error": f"Invalid priority '{priority}', expected one of {', '.join(PRIORITY_CLASSES)}"}), 400
+    deadline_ms = request.json.get('deadline_ms')
+    if deadline_ms is not None and (isinstance(deadline_ms, bool) or not isinstance(deadline_ms, (int, float))
+                                    or not deadline_ms > 0):
+        return jsonify({"error": "Invalid deadline_ms, expected a positive number of milliseconds"}), 400
+    rerender = request.json.get('rerender', True)
+    if not isinstance(rerender, bool):
+        return jsonify({"error": "Invalid rerender, expected true or false"}), 400
     
-    # Generate a unique ID for this job
-    job_id = str(uuid.uuid4())
+    # Log the incoming request
+    print(f"Received animation request with description: '{description}'")
     
     try:
-        # Log the incoming request
-        print(f"Received animation request with description: '{description}'")
-        print(f"Generated job ID: {job_id}")
-        
-        # Step 1: Convert description to Manim code
-        manim_code = text_to_manim_code(description, job_id)
-        print(f"Generated Manim code for job {job_id}")
-        
-        # Step 2: Save the code to a temporary Python file
-        script_path = os.path.join(TEMP_FOLDER, f"{job_id}.py")
-        with open(script_path, 'w') as f:
-            f.write(manim_code)
-        print(f"Saved Manim code to {script_path}")
-        
-        # Step 3: Run Manim to generate the animation
-        print(f"Starting Manim execution for job {job_id}")
-        output_path = run_manim(script_path, job_id)
-        
-        if not output_path or not os.path.exists(output_path):
-            error_msg = f"Failed to generate animation for job {job_id}: Output file not found"
-            print(error_msg)
-            return jsonify({"error": error_msg}), 500
-        
-        # Step 4: Return the path to the generated video
-        video_url = f"/api/video/{job_id}"
-        print(f"Animation generated successfully for job {job_id}")
-        print(f"Video URL: {video_url}")
+        job = job_queue.submit(description, quality=quality, priority=priority, client=_client_id(),
+                               deadline_ms=deadline_ms, rerender=rerender)
+        if job.state == COMPLETED:
+            # Served straight from the result cache
+            return jsonify(job.to_dict())
+    except QueueFullError as e:
+        print(f"Rejected animation request: {str(e)}")
+        response = jsonify({"error": str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    
+    response = {
+        "status": job.state,
+        "job_id": job.job_id,
+        "status_url": f"/api/status/{job.job_id}"
+    }
+    if job.deadline_ms is not None:
+        response["deadline_ms"] = job.deadline_ms
+        # Final once a worker picks the job up; until the code is generated it can't be estimated
+        degradations = job_queue.planned_degradations(job)
+        if degradations is not None:
+            response["degradations"] = degradations
+    return jsonify(response), 202
+
+@api.route('/generate/stream', methods=['POST'])
+def generate_animation_stream():
+    """
+    Stream Manim code as Gemini generates it, then queue the render
+    
+    Takes the same JSON payload as /generate and responds with a
+    text/event-stream of these events:
+        code    - {"code": "..."} the code generated so far
+        aborted - {"error": "..."} Gemini output was broken; template code follows
+        job     - the queued (or cached) job, as returned by /api/status
+        error   - {"error": "..."} the job could not be queued
+    """
+    if not request.json or 'description' not in request.json:
+        return jsonify({"error": "Missing description parameter"}), 400
+    
+    description = request.json['description']
+    quality = request.json.get('quality', DEFAULT_QUALITY)
+    if quality not in QUALITY_TIERS:
+        return jsonify({"error": f"Invalid quality '{quality}', expected one of {', '.join(QUALITY_TIERS)}"}), 400
+    print(f"Received streaming animation request with description: '{description}'")
+    client = _client_id()
+    
+    def events():
+        code, source = job_queue.cached_code(description), SOURCE_GEMINI
+        if code is None:
+            for kind, payload in stream_manim_code(description, None):
+                if kind == 'partial':
+                    yield _sse('code', {"code": payload})
+                elif kind == 'aborted':
+                    yield _sse('aborted', {"error": payload})
+                else:
+                    code, source = payload
+        yield _sse('code', {"code": code})
         
-        return jsonify({
-            "status": "success",
-            "job_id": job_id,
-            "video_url": video_url,
-            "code": manim_code
+        try:
+            job = job_queue.submit(description, code=code, source=source, quality=quality, client=client)
+        except QueueFullError as e:
+            print(f"Rejected animation request: {str(e)}")
+            yield _sse('error', {"error": str(e)})
+            return
+        yield _sse('job', job.to_dict())
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Keep nginx from buffering the stream
+    })
+
+@api.route('/generate/batch', methods=['POST'])
+def generate_batch():
+    """
+    Queue many animations at once
+    
+    Expected JSON payload:
+    {
+        "items": [
+            {"description": "A blue circle", "quality": "h"},  # quality optional
+            "A red square"                                      # or just the description
+        ],
+        "quality": "l"  # optional: default for items that don't set one
+    }
+    
+    Returns 202 with the batch ID right away. Items are fed to the render
+    workers as capacity frees up rather than rejected when the queue is
+    full; follow /api/batch/<batch_id>/events for results as they finish,
+    or poll /api/batch/<batch_id>.
+    """
+    if not request.json or not isinstance(request.json.get('items'), list) or not request.json['items']:
+        return jsonify({"error": "Missing items parameter"}), 400
+    
+    raw_items = request.json['items']
+    if len(raw_items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Too many items ({len(raw_items)}), at most {BATCH_MAX_ITEMS} per batch"}), 400
+    default_quality = request.json.get('quality', DEFAULT_QUALITY)
+    
+    items = []
+    for position, item in enumerate(raw_items):
+        if isinstance(item, str):
+            item = {"description": item}
+        description = item.get('description') if isinstance(item, dict) else None
+        if not isinstance(description, str) or not description.strip():
+            return jsonify({"error": f"Missing description for item {position}"}), 400
+        quality = item.get('quality', default_quality)
+        if quality not in QUALITY_TIERS:
+            return jsonify({"error": f"Invalid quality '{quality}' for item {position}, expected one of {', '.join(QUALITY_TIERS)}"}), 400
+        items.append((description, quality))
+    
+    print(f"Received batch animation request with {len(items)} items")
+    batch = batch_runner.submit(items, client=_client_id())
+    return jsonify({
+        "status": "running",
+        "batch_id": batch.batch_id,
+        "total": len(items),
+        "status_url": f"/api/batch/{batch.batch_id}",
+        "events_url": f"/api/batch/{batch.batch_id}/events"
+    }), 202
+
+@api.route('/batch/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    """Check the status of a batch and each of its items"""
+    batch_id = secure_filename(batch_id)
+    
+    batch = batch_runner.get(batch_id)
+    if batch is not None:
+        return jsonify(batch.to_dict())
+    # Another process's batch: item states come from its jobs' rows
+    record = job_store.get_batch(batch_id)
+    if record is None:
+        return jsonify({"status": "not_found"}), 404
+    return jsonify(batch_status(record))
+
+@api.route('/batch/<batch_id>/events', methods=['GET'])
+def batch_events(batch_id):
+    """
+    Push a batch's results as server-sent events as its items finish
+    
+    Events:
+        batch - the batch, as returned by /api/batch (on connect, with its
+                items) and a summary without items once all have finished
+        item  - one item, as listed by /api/batch, when it completes or fails
+    
+    The stream ends after the final batch event. Reconnecting clients
+    resume from Last-Event-ID.
+    """
+    batch_id = secure_filename(batch_id)
+    
+    batch = batch_runner.get(batch_id)
+    if batch is None:
+        record = job_store.get_batch(batch_id)
+        if record is None:
+            return jsonify({"status": "not_found"}), 404
+        return Response(stream_with_context(_stored_batch_events(record)), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
         })
-        
-    except Exception as e:
-        error_msg = f"Error generating animation for job {job_id}: {str(e)}"
-        print(error_msg)
-        return jsonify({"error": error_msg}), 500
+    
+    try:
+        last_seen = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        last_seen = 0
+    
+    def events():
+        after = last_seen
+        if not after:
+            after = batch.last_event_seq()
+            yield _sse('batch', batch.to_dict(), after)
+        while True:
+            if batch.done and after >= batch.last_event_seq():
+                return
+            new_events = batch.wait_events(after, timeout=EVENT_KEEPALIVE_SECONDS)
+            if not new_events:
+                yield ": keepalive\n\n"
+            for seq, event, data in new_events:
+                yield _sse(event, data, seq)
+                after = seq
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def _stored_batch_events(record):
+    """Events for a batch another process is running, polled from the job store"""
+    yield _sse('batch', batch_status(record))
+    sent = {item["position"] for item in record["items"] if item_status(item)["status"] in FINAL_STATES}
+    waited = 0
+    while len(sent) < len(record["items"]):
+        time.sleep(STORE_POLL_SECONDS)
+        waited += STORE_POLL_SECONDS
+        record = job_store.get_batch(record["batch_id"])
+        if record is None:
+            return
+        for item in record["items"]:
+            status = item_status(item)
+            if status["status"] in FINAL_STATES and item["position"] not in sent:
+                sent.add(item["position"])
+                waited = 0
+                yield _sse('item', status)
+        if waited >= EVENT_KEEPALIVE_SECONDS:
+            waited = 0
+            yield ": keepalive\n\n"
+    yield _sse('batch', batch_status(record, with_items=False))
+
+def _client_id():
+    """Who is asking, for the scheduler's per-client fairness"""
+    return request.headers.get('X-Client-ID') or request.remote_addr
+
+def _sse(event, data, event_id=None):
+    """Format one server-sent event"""
+    frame = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return f"id: {event_id}\n{frame}" if event_id is not None else frame
 
 @api.route('/video/<job_id>', methods=['GET'])
 def get_video(job_id):
-    """Serve the generated video file"""
+    """
+    Serve the generated video file
+    
+    Supports byte ranges and conditional requests; URLs carrying the
+    content hash as ?v= (as returned by /api/status) may be cached forever.
+    
+    Takes an optional ?quality=l|m|h|k (default l). A higher quality that
+    hasn't been rendered yet is queued from the job's stored script and
+    answered with 202; poll /api/status/<job_id> until it shows up under
+    "videos".
+    """
     # Sanitize job_id to prevent directory traversal
     job_id = secure_filename(job_id)
+    quality = request.args.get('quality', DEFAULT_QUALITY)
+    if quality not in QUALITY_TIERS:
+        return jsonify({"error": f"Invalid quality '{quality}', expected one of {', '.join(QUALITY_TIERS)}"}), 400
     
-    # Look for the video file
-    video_path = os.path.join(MEDIA_FOLDER, 'videos', job_id, '480p15', 'ManimScene.mp4')
-    
-    if not os.path.exists(video_path):
+    # The path the renderer reported, from this process or the job store
+    job = job_queue.lookup(job_id)
+    if job is None:
         return jsonify({"error": "Video not found"}), 404
+    video_path = job.videos.get(quality)
+    
+    if video_path is None or not os.path.exists(video_path):
+        if quality == DEFAULT_QUALITY:
+            if job.state == COMPLETED and (job.degradations or {}).get('last_frame'):
+                return jsonify({
+                    "error": "Only the final frame was rendered to make the deadline",
+                    "preview_url": job.preview_url,
+                    "rerender_job_id": job.rerender_job_id
+                }), 404
+            return jsonify({"error": "Video not found"}), 404
+        
+        try:
+            job = job_queue.request_quality(job_id, quality)
+        except QueueFullError as e:
+            response = jsonify({"error": str(e)})
+            response.headers['Retry-After'] = '5'
+            return response, 429
+        if job is None or job.state != COMPLETED:
+            return jsonify({"error": "Video not found"}), 404
+        if quality not in job.videos:
+            return jsonify({
+                "status": RENDERING,
+                "job_id": job_id,
+                "quality": quality,
+                "status_url": f"/api/status/{job_id}"
+            }), 202
+        video_path = job.videos[quality]
     
-    return send_file(video_path, mimetype='video/mp4')
+    return send_media(video_path, 'video/mp4')
+
+@api.route('/preview/<job_id>', methods=['GET'])
+def get_preview(job_id):
+    """Serve the last-frame preview image of a job"""
+    # Sanitize job_id to prevent directory traversal
+    job_id = secure_filename(job_id)
+    
+    job = job_queue.lookup(job_id)
+    image_path = job.preview_path if job is not None else None
+    
+    if not image_path or not os.path.exists(image_path):
+        return jsonify({"error": "Preview not found"}), 404
+    
+    return send_media(image_path, 'image/png')
 
 @api.route('/status/<job_id>', methods=['GET'])
 def get_status(job_id):
@@ -109,96 +383,108 @@ def get_status(job_id):
     # Sanitize job_id to prevent directory traversal
     job_id = secure_filename(job_id)
     
-    # Check if the video file exists
-    video_path = os.path.join(MEDIA_FOLDER, 'videos', job_id, '480p15', 'ManimScene.mp4')
-    
-    if os.path.exists(video_path):
+    job = job_queue.lookup(job_id)
+    if job is None:
         return jsonify({
-            "status": "completed",
-            "video_url": f"/api/video/{job_id}"
-        })
+            "status": "not_found"
+        }), 404
+    return jsonify(job.to_dict())
+
+@api.route('/pin/<job_id>', methods=['POST', 'DELETE'])
+def pin(job_id):
+    """
+    Keep a job's files regardless of their age or the storage budget
     
-    # Check if the script file exists
-    script_path = os.path.join(TEMP_FOLDER, f"{job_id}.py")
+    DELETE releases the pin, so the janitor may remove the files again.
+    """
+    # Sanitize job_id to prevent directory traversal
+    job_id = secure_filename(job_id)
     
-    if os.path.exists(script_path):
-        return jsonify({
-            "status": "processing"
-        })
+    if job_queue.lookup(job_id) is None:
+        return jsonify({"error": "Job not found"}), 404
     
-    return jsonify({
-        "status": "not_found"
-    }), 404
+    if request.method == 'DELETE':
+        unpin_job(job_id)
+    else:
+        pin_job(job_id)
+    return jsonify({"job_id": job_id, "pinned": request.method != 'DELETE'})
 
-def run_manim(script_path, job_id):
-    """Run Manim to generate the animation"""
+@api.route('/events/<job_id>', methods=['GET'])
+def job_events(job_id):
+    """
+    Push a job's state changes and render progress as server-sent events
+    
+    Events:
+        status   - the job, as returned by /api/status (sent on connect and on every change)
+        progress - {"phase": "l", "animation": 3, "total": 7} as the render advances
+    
+    The stream ends once the job has finished and no higher quality is
+    still rendering. Reconnecting clients resume from Last-Event-ID.
+    """
+    # Sanitize job_id to prevent directory traversal
+    job_id = secure_filename(job_id)
+    
+    job = job_queue.get(job_id)
+    if job is None:
+        # Owned by another process: follow its saved status in the job store
+        record = job_store.get(job_id)
+        if record is None:
+            return jsonify({"status": "not_found"}), 404
+        return Response(stream_with_context(_stored_job_events(record)), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+    
     try:
-        # Get the directory containing the script
-        script_dir = os.path.dirname(script_path)
-        
-        # Get the filename without extension
-        script_name = os.path.basename(script_path).split('.')[0]
-        
-        # Run Manim command
-        cmd = [
-            "python3", "-m", "manim", 
-            script_path, 
-            "ManimScene",  # The class name in our generated code
-            "-ql",  # Low quality for faster rendering
-            "--media_dir", MEDIA_FOLDER
-        ]
-        
-        # Log the command being executed
-        print(f"Executing command: {' '.join(cmd)}")
-        
-        # Execute the command with a longer timeout for complex animations
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        
-        try:
-            stdout, stderr = process.communicate(timeout=120)  # 120-second timeout for more complex animations
-            
-            if process.returncode != 0:
-                error_msg = f"Manim execution failed with return code {process.returncode}: {stderr}"
-                print(error_msg)
-                raise Exception(error_msg)
-            
-            # Expected output path based on Manim's conventions
-            output_path = os.path.join(MEDIA_FOLDER, 'videos', script_name, '480p15', 'ManimScene.mp4')
-            
-            # Check if the file exists
-            if not os.path.exists(output_path):
-                # Try to find the video file in case the path convention changed
-                possible_paths = []
-                for root, dirs, files in os.walk(os.path.join(MEDIA_FOLDER, 'videos', script_name)):
-                    for file in files:
-                        if file.endswith('.mp4'):
-                            possible_paths.append(os.path.join(root, file))
-                
-                if possible_paths:
-                    # Use the first found video file
-                    output_path = possible_paths[0]
-                    print(f"Found video at alternative path: {output_path}")
-                else:
-                    error_msg = f"Output video file not found at {output_path} or any subdirectory"
-                    print(error_msg)
-                    raise Exception(error_msg)
-            
-            print(f"Manim execution successful. Output at: {output_path}")
-            return output_path
-            
-        except subprocess.TimeoutExpired:
-            # Kill the process if it times out
-            process.kill()
-            error_msg = "Manim execution timed out after 120 seconds"
-            print(error_msg)
-            raise Exception(error_msg)
-            
-    except Exception as e:
-        error_msg = f"Error running Manim: {str(e)}"
-        print(error_msg)
-        raise Exception(error_msg)
+        last_seen = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        last_seen = 0
+    
+    def events():
+        after = last_seen
+        if not after:
+            # Start from the current snapshot rather than replaying the history
+            after = job.last_event_seq()
+            yield _sse('status', job.to_dict(), after)
+        while True:
+            new_events = job.wait_events(after, timeout=EVENT_KEEPALIVE_SECONDS)
+            if not new_events:
+                yield ": keepalive\n\n"
+            for seq, event, data in new_events:
+                yield _sse(event, data, seq)
+                after = seq
+            if job.state in FINAL_STATES and not job.pending_qualities:
+                return
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Keep nginx from buffering the stream
+    })
+
+def _stored_job_events(record):
+    """Status events for a job another process is working on, polled from the job store"""
+    waited = 0
+    while True:
+        yield _sse('status', Job.from_record(record).to_dict())
+        if record["state"] in FINAL_STATES:
+            return
+        updated_at = record["updated_at"]
+        while record is not None and record["updated_at"] == updated_at:
+            time.sleep(STORE_POLL_SECONDS)
+            waited += STORE_POLL_SECONDS
+            if waited >= EVENT_KEEPALIVE_SECONDS:
+                waited = 0
+                yield ": keepalive\n\n"
+            record = job_store.get(record["job_id"])
+        if record is None:
+            return
+
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    """Stage latency histograms and pipeline counters in the Prometheus text format"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@api.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters and sizes for the generated-code, video and scene caches"""
+    return jsonify({**result_cache.stats(), "scenes": scene_cache.stats()})
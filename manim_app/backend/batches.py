@@ -0,0 +1,267 @@
+import os
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+
+from backend.cache import normalize_description
+from backend.jobs import job_queue, EventLog, QueueFullError, QUEUED, COMPLETED, FAILED
+from backend.job_store import job_store
+from backend.renderer import DEFAULT_QUALITY
+from backend.metrics import registry
+from backend.scheduler import BATCH
+
+# Configuration
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '500'))
+# Batch jobs queued or rendering at once, across all batches of a server process;
+# the rest of the render queue (RENDER_QUEUE_SIZE) stays free for single requests
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '8'))
+BATCH_HISTORY_SIZE = int(os.environ.get('BATCH_HISTORY_SIZE', '100'))
+# Seconds to wait before offering a job to a full render queue again
+BATCH_RETRY_SECONDS = 1
+
+# Status of an item that hasn't been submitted yet
+PENDING = 'pending'
+RUNNING = 'running'
+
+batch_items_total = registry.counter(
+    'batch_items_total', 'Batch items finished, by final state', ['state'])
+
+
+def item_status(item):
+    """
+    The public view of a batch item.
+
+    Args:
+        item (dict): position, description, quality, job_id, state (of its job) and error
+    """
+    state = item["state"] or (FAILED if item["error"] else PENDING)
+    video_url = None
+    if state == COMPLETED:
+        video_url = f"/api/video/{item['job_id']}"
+        if item["quality"] != DEFAULT_QUALITY:
+            # Queued lazily (202) if the job was shared with an item of another quality
+            video_url += f"?quality={item['quality']}"
+    return {
+        "position": item["position"],
+        "description": item["description"],
+        "quality": item["quality"],
+        "job_id": item["job_id"],
+        "status": state,
+        "status_url": f"/api/status/{item['job_id']}" if item["job_id"] else None,
+        "video_url": video_url,
+        "error": item["error"] if state == FAILED else None,
+    }
+
+
+def batch_status(record, with_items=True):
+    """
+    The public view of a batch: item counts by status and, optionally, the items.
+
+    Args:
+        record (dict): batch_id, created_at and items, as returned by JobStore.get_batch
+    """
+    items = [item_status(item) for item in record["items"]]
+    counts = Counter(item["status"] for item in items)
+    finished = counts[COMPLETED] + counts[FAILED]
+    status = {
+        "batch_id": record["batch_id"],
+        "status": COMPLETED if finished == len(items) else RUNNING,
+        "created_at": record["created_at"],
+        "total": len(items),
+        "counts": dict(counts),
+    }
+    if with_items:
+        status["items"] = items
+    return status
+
+
+class Batch(EventLog):
+    """
+    A list of descriptions submitted together, and the jobs they became.
+
+    Publishes an "item" event as each item finishes and a "batch" summary
+    once they all have.
+    """
+
+    def __init__(self, items, batch_id=None, client=None):
+        """
+        Args:
+            items (list): (description, quality) pairs
+            client (str, optional): Who submitted the batch
+        """
+        super().__init__(history=len(items) + 2)
+        self.batch_id = batch_id or str(uuid.uuid4())
+        self.client = client
+        self.created_at = time.time()
+        self.finished_at = None
+        self.items = [
+            {"position": position, "description": description, "quality": quality,
+             "job_id": None, "state": None, "error": None}
+            for position, (description, quality) in enumerate(items)
+        ]
+        self._remaining = len(self.items)
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        """True once every item has finished; the final summary is the batch's last event"""
+        return self.finished_at is not None
+
+    def to_record(self):
+        with self._lock:
+            items = [dict(item) for item in self.items]
+        for item in items:
+            if item["job_id"] and item["state"] is None:
+                # Still running: the job's current state, as the job store's join would give
+                job = job_queue.get(item["job_id"])
+                item["state"] = job.state if job is not None else QUEUED
+        return {"batch_id": self.batch_id, "created_at": self.created_at, "items": items}
+
+    def to_dict(self, with_items=True):
+        return batch_status(self.to_record(), with_items)
+
+    def assign(self, positions, job_id):
+        with self._lock:
+            for position in positions:
+                self.items[position]["job_id"] = job_id
+
+    def finish_items(self, positions, state, error=None):
+        """Record the outcome of items and publish it; the last one also publishes the summary"""
+        finished = []
+        with self._lock:
+            for position in positions:
+                item = self.items[position]
+                item["state"] = state if item["job_id"] else None
+                item["error"] = error
+                finished.append(item_status(item))
+            self._remaining -= len(positions)
+            last = self._remaining == 0
+
+        for item in finished:
+            batch_items_total.inc(state=item["status"])
+            self.publish('item', item)
+        if last:
+            # Set first: event streams end once the batch is done and they have sent its last event
+            self.finished_at = time.time()
+            self.publish('batch', self.to_dict(with_items=False))
+            print(f"Batch {self.batch_id} finished ({len(self.items)} items)")
+
+
+class BatchRunner:
+    """
+    Fans batches out over the job queue under a process-wide concurrency cap.
+
+    Each batch gets a dispatcher thread that submits its items as slots
+    free up: at most BATCH_CONCURRENCY batch jobs are queued or rendering
+    at once, whichever batch they belong to, and a slot is handed back when
+    its job completes or fails. Items wait here rather than being turned
+    away with a 429, so a large batch keeps every render worker busy
+    without starving single requests, whose renders the scheduler also
+    runs ahead of batch ones (see backend/scheduler.py).
+
+    Items with the same (normalized) description are grouped into a single
+    job, so their code is generated and rendered once. Across batches and
+    single requests the job queue's own single-flight and result cache do
+    the same.
+    """
+
+    def __init__(self, concurrency=BATCH_CONCURRENCY, history_size=BATCH_HISTORY_SIZE):
+        self.concurrency = max(1, concurrency)
+        self.history_size = history_size
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._active = 0
+        self._batches = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, items, client=None):
+        """
+        Start a batch.
+
+        Args:
+            items (list): (description, quality) pairs
+            client (str, optional): Who submitted it, for the scheduler's per-client fairness
+
+        Returns:
+            Batch: The new batch; its items are submitted in the background
+        """
+        batch = Batch(items, client=client)
+        job_store.save_batch(batch.batch_id, batch.created_at, items)
+        with self._lock:
+            self._batches[batch.batch_id] = batch
+            self._prune_history()
+
+        threading.Thread(target=self._dispatch, args=(batch,), name=f"batch-{batch.batch_id[:8]}",
+                         daemon=True).start()
+        print(f"Queued batch {batch.batch_id} with {len(items)} items")
+        return batch
+
+    def get(self, batch_id):
+        """Return the batch with the given ID, or None if this process doesn't know it"""
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def active(self):
+        """Number of batch jobs queued or rendering"""
+        return self._active
+
+    def _dispatch(self, batch):
+        groups = OrderedDict()
+        for item in batch.items:
+            groups.setdefault(normalize_description(item["description"]), []).append(item["position"])
+
+        for positions in groups.values():
+            first = batch.items[positions[0]]
+            self._acquire()
+            try:
+                job = self._submit(first["description"], first["quality"], batch.client)
+            except Exception as e:
+                self._release()
+                error = f"Error queueing batch item: {str(e)}"
+                for position in positions:
+                    job_store.set_batch_item(batch.batch_id, position, error=error)
+                batch.finish_items(positions, FAILED, error)
+                continue
+
+            batch.assign(positions, job.job_id)
+            for position in positions:
+                job_store.set_batch_item(batch.batch_id, position, job_id=job.job_id)
+            job.add_done_callback(lambda job, positions=positions: self._job_done(batch, positions, job))
+
+    def _submit(self, description, quality, client):
+        """Submit a job, waiting for room in the render queue"""
+        while True:
+            try:
+                return job_queue.submit(description, quality=quality, priority=BATCH, client=client)
+            except QueueFullError:
+                time.sleep(BATCH_RETRY_SECONDS)
+
+    def _job_done(self, batch, positions, job):
+        self._release()
+        batch.finish_items(positions, job.state, job.error)
+
+    def _acquire(self):
+        self._slots.acquire()
+        with self._lock:
+            self._active += 1
+
+    def _release(self):
+        with self._lock:
+            self._active -= 1
+        self._slots.release()
+
+    def _prune_history(self):
+        """Forget the oldest finished batches beyond history_size (caller holds _lock)"""
+        excess = len(self._batches) - self.history_size
+        for batch_id in list(self._batches):
+            if excess <= 0:
+                break
+            if self._batches[batch_id].done:
+                del self._batches[batch_id]
+                excess -= 1
+
+
+# Shared runner used by the API blueprint
+batch_runner = BatchRunner()
+
+registry.gauge('batch_jobs_active', 'Batch jobs queued or rendering', function=batch_runner.active)
@@ -0,0 +1,258 @@
+import functools
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+from backend.metrics import registry
+
+# Configuration
+MEDIA_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'media')
+CACHE_FOLDER = os.environ.get('CACHE_FOLDER', os.path.join(MEDIA_FOLDER, 'cache'))
+CACHE_MAX_MB = int(os.environ.get('CACHE_MAX_MB', '2048'))
+CACHE_MAX_AGE_DAYS = float(os.environ.get('CACHE_MAX_AGE_DAYS', '30'))
+
+
+def normalize_description(description):
+    """Normalize a description so trivially different phrasings share a cache entry"""
+    text = re.sub(r'\s+', ' ', description.strip().lower())
+    return text.rstrip('.!')
+
+
+def sha256_hex(*parts):
+    """Hash the given parts into a stable hex digest"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def file_digest(path):
+    """
+    SHA-256 of a file's contents, memoized per (size, mtime) so repeated
+    requests for the same video don't re-hash it.
+    """
+    stat = os.stat(path)
+    return _file_digest(path, stat.st_size, stat.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=4096)
+def _file_digest(path, size, mtime_ns):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(src, dst):
+    """
+    Atomically place `src` at `dst`, hard-linking where the filesystem allows it.
+
+    A temporary name plus os.replace keeps readers from ever seeing a partial file.
+    """
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp_path = f"{dst}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+class DiskLRUCache:
+    """
+    A directory of files keyed by hash with size- and age-based LRU eviction.
+
+    The file mtime doubles as the last-access time: hits touch it, and
+    eviction removes expired entries first, then the least recently used
+    until the directory fits in `max_bytes`.
+    """
+
+    def __init__(self, directory, suffix, max_bytes, max_age):
+        self.directory = directory
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def get_path(self, key, count_miss=True):
+        """
+        Return the path of a live entry (refreshing its LRU position), or None.
+
+        Pass count_miss=False when re-checking a key whose miss was already counted.
+        """
+        path = self.path_for(key)
+        try:
+            age = time.time() - os.stat(path).st_mtime
+        except FileNotFoundError:
+            self._record(hit=False, count_miss=count_miss)
+            return None
+
+        if age > self.max_age:
+            self._remove(path)
+            self._record(hit=False, count_miss=count_miss)
+            return None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another worker between the stat and the touch
+            self._record(hit=False, count_miss=count_miss)
+            return None
+
+        self._record(hit=True)
+        return path
+
+    def get_text(self, key, count_miss=True):
+        path = self.get_path(key, count_miss)
+        if path is None:
+            return None
+        try:
+            with open(path) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put_file(self, key, src_path):
+        path = self.path_for(key)
+        link_or_copy(src_path, path)
+        self._added(os.path.getsize(path))
+        return path
+
+    def put_text(self, key, text):
+        path = self.path_for(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+        self._added(os.path.getsize(path))
+        return path
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        entries, size = self._scan_totals()
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / total, 3) if total else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def evict(self):
+        """Remove expired entries, then the least recently used until under max_bytes"""
+        now = time.time()
+        entries = []
+        for entry in self._entries():
+            stat = entry.stat()
+            if now - stat.st_mtime > self.max_age:
+                self._remove(entry.path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = sum(e[1] for e in entries)
+        entries.sort()
+        for _, entry_size, path in entries:
+            if size <= self.max_bytes:
+                break
+            self._remove(path)
+            size -= entry_size
+
+        with self._lock:
+            self._size = size
+
+    def _record(self, hit, count_miss=True):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            elif count_miss:
+                self.misses += 1
+
+    def _added(self, nbytes):
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_totals()[1]
+            else:
+                self._size += nbytes
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _entries(self):
+        with os.scandir(self.directory) as it:
+            return [e for e in it if e.is_file() and e.name.endswith(self.suffix)]
+
+    def _scan_totals(self):
+        entries = self._entries()
+        return len(entries), sum(e.stat().st_size for e in entries)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class ResultCache:
+    """
+    Two-level cache for the generate pipeline.
+
+    Level one maps a normalized description (plus model and prompt version)
+    to generated code; level two maps a hash of the code plus the render
+    quality to the rendered MP4.
+    """
+
+    def __init__(self, directory=CACHE_FOLDER, max_mb=CACHE_MAX_MB, max_age_days=CACHE_MAX_AGE_DAYS):
+        max_bytes = max_mb * 1024 * 1024
+        max_age = max_age_days * 86400
+        # Code is tiny next to video, so it gets a small slice of the budget
+        self.code = DiskLRUCache(os.path.join(directory, 'code'), '.py', max_bytes // 20, max_age)
+        self.videos = DiskLRUCache(os.path.join(directory, 'videos'), '.mp4', max_bytes - max_bytes // 20, max_age)
+
+    @staticmethod
+    def code_key(description, model, prompt_version):
+        return sha256_hex(normalize_description(description), model, prompt_version)
+
+    @staticmethod
+    def video_key(code, quality):
+        return sha256_hex(code, quality)
+
+    def get_code(self, description, model, prompt_version, count_miss=True):
+        return self.code.get_text(self.code_key(description, model, prompt_version), count_miss)
+
+    def put_code(self, description, model, prompt_version, code):
+        self.code.put_text(self.code_key(description, model, prompt_version), code)
+
+    def get_video(self, code, quality, count_miss=True):
+        return self.videos.get_path(self.video_key(code, quality), count_miss)
+
+    def put_video(self, code, quality, video_path):
+        return self.videos.put_file(self.video_key(code, quality), video_path)
+
+    def stats(self):
+        return {
+            "code": self.code.stats(),
+            "videos": self.videos.stats(),
+        }
+
+
+# Shared cache used by the job queue
+result_cache = ResultCache()
+
+registry.gauge('cache_hit_ratio', 'Hit ratio of the result caches since start-up', ['cache'],
+               function=lambda: {('code',): result_cache.code.stats()['hit_ratio'],
+                                 ('videos',): result_cache.videos.stats()['hit_ratio']})
+registry.gauge('cache_bytes', 'Size of the result caches on disk', ['cache'],
+               function=lambda: {('code',): result_cache.code.stats()['bytes'],
+                                 ('videos',): result_cache.videos.stats()['bytes']})
@@ -0,0 +1,233 @@
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+from backend.cache import MEDIA_FOLDER, normalize_description, sha256_hex
+from backend.metrics import registry, stage_seconds
+
+# Configuration
+# 'gemini' calls the API; 'stub' returns template scenes and 'replay' recorded
+# responses, both offline (for load tests and development)
+CODE_GENERATOR = os.environ.get('CODE_GENERATOR', 'gemini')
+# Seconds a single provider call may take
+CODEGEN_TIMEOUT = float(os.environ.get('CODEGEN_TIMEOUT', '60'))
+# Extra attempts after a transient failure (timeout, rate limit, 5xx)
+CODEGEN_RETRIES = int(os.environ.get('CODEGEN_RETRIES', '2'))
+# First retry waits up to this long; the cap doubles with each attempt
+CODEGEN_RETRY_BASE_SECONDS = float(os.environ.get('CODEGEN_RETRY_BASE_SECONDS', '1'))
+# Provider calls in flight at once per server process
+CODEGEN_CONCURRENCY = int(os.environ.get('CODEGEN_CONCURRENCY', '4'))
+# Where the replay backend reads responses, and where CODEGEN_RECORD=1 writes them
+CODEGEN_RECORDINGS = os.environ.get('CODEGEN_RECORDINGS', os.path.join(MEDIA_FOLDER, 'recordings'))
+CODEGEN_RECORD = os.environ.get('CODEGEN_RECORD', '0') == '1'
+
+codegen_retries_total = registry.counter(
+    'codegen_retries_total', 'Code generation attempts retried after a transient error', ['error'])
+
+
+class CodeGenerationTimeout(TimeoutError):
+    """Raised by a backend when a call runs past its timeout"""
+
+
+class CodeBackend(ABC):
+    """
+    Interface implemented by the code generation backends; a backend
+    missing one of the abstract methods can't be instantiated.
+
+    MODEL_NAME and PROMPT_VERSION are part of the generated-code cache key,
+    so two backends never share entries. `timeout` bounds a single call;
+    retries and the concurrency limit are applied by CodeGenerator.
+    """
+
+    MODEL_NAME = None
+    PROMPT_VERSION = None
+
+    @abstractmethod
+    def convert_to_manim_code(self, description, job_id=None, use_fallback=True, timeout=None):
+        """Return Manim code for a description"""
+
+    @abstractmethod
+    def stream_manim_code(self, description, job_id=None, timeout=None):
+        """Yield (code so far, done) pairs; the done=True item carries the complete code"""
+
+    def is_retryable(self, error):
+        """Whether a failed call is worth repeating"""
+        return isinstance(error, (TimeoutError, ConnectionError))
+
+
+def check_latency(latency, timeout):
+    """Behave like a provider call that times out when `latency` exceeds `timeout`"""
+    if timeout is not None and latency > timeout:
+        time.sleep(timeout)
+        raise CodeGenerationTimeout(f"No response within {timeout}s")
+
+
+def stream_lines(code, seconds):
+    """
+    Yield (code so far, done) pairs one line at a time, spread over `seconds`,
+    for the offline backends that stand in for a streaming provider.
+    """
+    lines = code.splitlines(keepends=True)
+    started = time.perf_counter()
+
+    partial = ''
+    for line in lines:
+        time.sleep(seconds / len(lines))
+        if not partial:
+            stage_seconds.observe(time.perf_counter() - started, stage='gemini_first_chunk')
+        partial += line
+        yield partial, False
+
+    stage_seconds.observe(time.perf_counter() - started, stage='gemini_call')
+    yield code, True
+
+
+def recording_path(description, directory=CODEGEN_RECORDINGS):
+    """File holding the recorded response for a description"""
+    return os.path.join(directory, f"{sha256_hex(normalize_description(description))}.json")
+
+
+class CodeGenerator:
+    """
+    Calls a CodeBackend with a per-call timeout, bounded retries with full
+    jitter, and a semaphore capping concurrent calls to the provider.
+
+    With CODEGEN_RECORD=1 every successful call is written to
+    CODEGEN_RECORDINGS so the replay backend can serve it later.
+    """
+
+    def __init__(self, backend, timeout=CODEGEN_TIMEOUT, retries=CODEGEN_RETRIES,
+                 retry_base=CODEGEN_RETRY_BASE_SECONDS, concurrency=CODEGEN_CONCURRENCY,
+                 record=CODEGEN_RECORD):
+        self.backend = backend
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.retry_base = retry_base
+        self.record = record
+        self._slots = threading.BoundedSemaphore(max(1, concurrency))
+
+    @property
+    def model_name(self):
+        return self.backend.MODEL_NAME
+
+    @property
+    def prompt_version(self):
+        return self.backend.PROMPT_VERSION
+
+    def generate(self, description, job_id=None):
+        """
+        Generate Manim code, retrying transient failures.
+
+        Returns:
+            str: Generated Manim code
+
+        Raises:
+            Exception: The backend's last error once retries are exhausted
+        """
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                with self._slot():
+                    code = self.backend.convert_to_manim_code(description, job_id, use_fallback=False,
+                                                              timeout=self.timeout)
+            except Exception as e:
+                if attempt >= self.retries or not self.backend.is_retryable(e):
+                    raise
+                attempt += 1
+                self._backoff(attempt, e)
+                continue
+            self._record(description, code, time.perf_counter() - started)
+            return code
+
+    def stream(self, description, job_id=None):
+        """
+        Stream Manim code as (code so far, done) pairs.
+
+        A call is only retried if it failed before yielding anything, so
+        callers never see a stream restart.
+        """
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            yielded = False
+            try:
+                with self._slot():
+                    for code, done in self.backend.stream_manim_code(description, job_id, timeout=self.timeout):
+                        yielded = True
+                        if done:
+                            self._record(description, code, time.perf_counter() - started)
+                        yield code, done
+                return
+            except Exception as e:
+                if yielded or attempt >= self.retries or not self.backend.is_retryable(e):
+                    raise
+                attempt += 1
+                self._backoff(attempt, e)
+
+    @contextmanager
+    def _slot(self):
+        """Hold one provider slot, recording how long it took to get one"""
+        with stage_seconds.time(stage='codegen_wait'):
+            self._slots.acquire()
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def _backoff(self, attempt, error):
+        delay = random.uniform(0, self.retry_base * 2 ** (attempt - 1))
+        codegen_retries_total.inc(error=type(error).__name__)
+        print(f"Code generation attempt {attempt} failed ({type(error).__name__}: {error}); "
+              f"retrying in {delay:.2f}s")
+        time.sleep(delay)
+
+    def _record(self, description, code, seconds):
+        if not self.record:
+            return
+        path = recording_path(description)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"description": description, "model": self.model_name,
+                       "prompt_version": self.prompt_version, "seconds": round(seconds, 3),
+                       "code": code}, f, indent=2)
+        os.replace(tmp_path, path)
+
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def create_backend(name=CODE_GENERATOR):
+    """Build the backend named by CODE_GENERATOR"""
+    # Imported here: the backends import CodeBackend from this module
+    if name == 'stub':
+        from utils.stub_converter import StubTextToManimConverter
+        return StubTextToManimConverter()
+    if name == 'replay':
+        from utils.replay_converter import ReplayTextToManimConverter
+        return ReplayTextToManimConverter(CODEGEN_RECORDINGS)
+    if name == 'gemini':
+        from utils.gemini_converter import GeminiTextToManimConverter
+        return GeminiTextToManimConverter(os.environ.get('GEMINI_API_KEY', 'PUT YOUR API KEY HERE'))
+    raise ValueError(f"Unknown CODE_GENERATOR '{name}', expected gemini, stub or replay")
+
+
+def get_code_generator():
+    """
+    The process-wide CodeGenerator, created on first use.
+
+    Creating it lazily keeps the provider client (and its connections) out
+    of the gunicorn master, so each worker process builds and reuses its own.
+    """
+    global _generator
+    with _generator_lock:
+        if _generator is None:
+            _generator = CodeGenerator(create_backend())
+        return _generator
@@ -0,0 +1,76 @@
+import os
+from flask import request, send_file, Response
+
+from backend.cache import file_digest
+
+# Configuration
+MEDIA_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'media')
+
+# 'flask' streams files from the worker; 'x-accel' (nginx) and 'x-sendfile'
+# (Apache, lighttpd) hand the file to the front proxy instead
+VIDEO_DELIVERY = os.environ.get('VIDEO_DELIVERY', 'flask')
+
+# Internal nginx location that maps onto MEDIA_FOLDER
+X_ACCEL_PREFIX = os.environ.get('X_ACCEL_PREFIX', '/protected-media/')
+
+# Length of the content hash used in ?v= URLs
+VERSION_LENGTH = 16
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def content_version(path):
+    """Short content hash for building content-addressed (?v=) URLs"""
+    return file_digest(path)[:VERSION_LENGTH]
+
+
+def versioned_url(url, path):
+    """Append the file's content version to `url`, or return it unchanged if the file is missing"""
+    try:
+        version = content_version(path)
+    except FileNotFoundError:
+        return url
+    separator = '&' if '?' in url else '?'
+    return f"{url}{separator}v={version}"
+
+
+def send_media(path, mimetype):
+    """
+    Send a media file with a strong ETag, byte-range support and cache headers.
+
+    The ETag is the SHA-256 of the file's contents. When the request carries
+    a ?v= matching that hash, the URL is content-addressed and the response
+    is cacheable forever; otherwise clients must revalidate, which costs a
+    304 rather than a re-download.
+
+    Args:
+        path (str): Absolute path of the file under MEDIA_FOLDER
+        mimetype (str): Content type of the response
+
+    Returns:
+        Response: A 200, 206, 304 or 416 response, or a proxy hand-off
+    """
+    digest = file_digest(path)
+
+    if VIDEO_DELIVERY in ('x-accel', 'x-sendfile'):
+        response = Response(mimetype=mimetype)
+        response.set_etag(digest)
+        response.make_conditional(request)
+        if response.status_code == 200:
+            if VIDEO_DELIVERY == 'x-accel':
+                relative_path = os.path.relpath(path, MEDIA_FOLDER).replace(os.sep, '/')
+                response.headers['X-Accel-Redirect'] = X_ACCEL_PREFIX.rstrip('/') + '/' + relative_path
+            else:
+                response.headers['X-Sendfile'] = path
+    else:
+        # send_file answers Range, If-Range and If-None-Match itself when conditional
+        response = send_file(path, mimetype=mimetype, conditional=True, etag=digest, max_age=None)
+
+    if request.args.get('v') == digest[:VERSION_LENGTH]:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
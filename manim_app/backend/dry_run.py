@@ -0,0 +1,244 @@
+"""
+Dry runs: execute a generated scene's construct() with every animation
+skipped, to catch runtime errors before a render worker spends time on it.
+
+The parent side (dry_run_scene) hands the script to a warm worker of a
+small render pool of its own (DRY_RUN_BACKEND=pool), which has Manim
+imported already, or runs
+
+    python3 -m backend.dry_run <script>
+
+(DRY_RUN_BACKEND=subprocess) and reads the JSON report the child prints as
+its last line. Either way the scene runs under the render limits and a
+short timeout. A subprocess spends most of its time importing Manim,
+typically a few seconds; on a warm worker a dry run takes a fraction of
+that.
+"""
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+
+from backend.cache import MEDIA_FOLDER, sha256_hex
+from backend.limits import apply_render_limits, kill_process_group
+from backend.render_pool import RenderPool, RenderTimeout
+from backend.renderer import PROJECT_ROOT, TEMP_FOLDER
+
+# Configuration
+# Dry-run generated scenes before queueing their render; failures fall back to templates
+DRY_RUN = os.environ.get('DRY_RUN', '1') == '1'
+# 'pool' dry-runs on warm workers that import Manim once; 'subprocess' starts (and imports Manim in) one per
+# scene, which adds seconds to every generation whatever RENDER_BACKEND is
+DRY_RUN_BACKEND = os.environ.get('DRY_RUN_BACKEND', 'pool')
+# Warm workers of the dry-run pool, per server process
+DRY_RUN_POOL_SIZE = int(os.environ.get('DRY_RUN_POOL_SIZE', '1'))
+# Seconds a dry run may take, Manim's import included with the subprocess backend; skipped animations
+# cost next to nothing, so a slow one is almost always a hang
+DRY_RUN_TIMEOUT = float(os.environ.get('DRY_RUN_TIMEOUT', '15'))
+# Dry-run reports kept per server process, so the queue can look up what code generation measured
+DRY_RUN_HISTORY = 1000
+
+# Prefix of the report line the child prints
+REPORT_PREFIX = 'DRY_RUN_REPORT '
+
+
+class DryRunResult:
+    """What a dry run found out about a scene"""
+
+    def __init__(self, error=None, duration=None, animation_count=None, seconds=None):
+        # The exception construct() raised (or the timeout), None if it ran through
+        self.error = error
+        # Scene length in seconds and number of play()/wait() calls, as Manim counted them
+        self.duration = duration
+        self.animation_count = animation_count
+        # Wall time of the dry run, process start-up included
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def to_dict(self):
+        data = {"ok": self.ok, "seconds": self.seconds}
+        if self.ok:
+            data["duration"] = round(self.duration, 2)
+            data["animation_count"] = self.animation_count
+        else:
+            data["error"] = self.error
+        return data
+
+
+_results = OrderedDict()
+_results_lock = threading.Lock()
+
+_dry_run_pool = None
+_dry_run_pool_lock = threading.Lock()
+
+
+def get_dry_run_pool():
+    """Return the warm pool dry runs use, creating it if needed (apart from renders, so they never wait on one)"""
+    global _dry_run_pool
+    with _dry_run_pool_lock:
+        if _dry_run_pool is None:
+            _dry_run_pool = RenderPool(MEDIA_FOLDER, size=DRY_RUN_POOL_SIZE)
+        return _dry_run_pool
+
+
+def dry_run_scene(code, job_id=None):
+    """
+    Dry-run generated Manim code on a warm worker or in a subprocess (DRY_RUN_BACKEND).
+
+    Args:
+        code (str): Code that passed validate_scene
+        job_id (str, optional): Names the temporary script, so the janitor can attribute it
+
+    Returns:
+        DryRunResult: The outcome, or None if the dry run itself broke down
+            (a crash or resource limit that left no report), in which case
+            the scene is left for the real render to judge
+    """
+    script_path = os.path.join(TEMP_FOLDER, f"{job_id or uuid.uuid4()}.dry_run.py")
+    os.makedirs(TEMP_FOLDER, exist_ok=True)
+    with open(script_path, 'w') as f:
+        f.write(code)
+
+    started = time.perf_counter()
+    try:
+        if DRY_RUN_BACKEND == 'pool':
+            result = _dry_run_on_pool(script_path)
+        else:
+            result = _dry_run_in_subprocess(script_path)
+    finally:
+        try:
+            os.remove(script_path)
+        except FileNotFoundError:
+            pass
+
+    if result is not None:
+        result.seconds = round(time.perf_counter() - started, 3)
+        with _results_lock:
+            _results[sha256_hex(code)] = result
+            while len(_results) > DRY_RUN_HISTORY:
+                _results.popitem(last=False)
+    return result
+
+
+def _dry_run_on_pool(script_path):
+    try:
+        return DryRunResult(**get_dry_run_pool().dry_run(script_path, DRY_RUN_TIMEOUT))
+    except RenderTimeout:
+        return DryRunResult(error=f"construct() did not finish within {DRY_RUN_TIMEOUT:g}s with animations skipped")
+    except Exception as e:
+        print(f"Dry run worker failed without a report: {str(e)[-1000:]}")
+        return None
+
+
+def _dry_run_in_subprocess(script_path):
+    python_path = os.pathsep.join(filter(None, [PROJECT_ROOT, os.environ.get('PYTHONPATH')]))
+    process = subprocess.Popen(
+        ["python3", "-m", "backend.dry_run", script_path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        start_new_session=True,
+        preexec_fn=apply_render_limits,
+        env={**os.environ, 'PYTHONPATH': python_path}
+    )
+    try:
+        stdout, stderr = process.communicate(timeout=DRY_RUN_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        kill_process_group(process.pid)
+        process.communicate()
+        result = DryRunResult(error=f"construct() did not finish within {DRY_RUN_TIMEOUT:g}s with animations skipped")
+    else:
+        result = _parse_report(stdout)
+        if result is None:
+            print(f"Dry run exited with code {process.returncode} without a report: {stderr[-1000:]}")
+    finally:
+        kill_process_group(process.pid)
+    return result
+
+
+def recorded_dry_run(code):
+    """The result of this process's last dry run of `code`, or None if it hasn't dry-run it"""
+    if code is None:
+        return None
+    with _results_lock:
+        return _results.get(sha256_hex(code))
+
+
+def _parse_report(stdout):
+    for line in reversed(stdout.splitlines()):
+        if line.startswith(REPORT_PREFIX):
+            return DryRunResult(**json.loads(line[len(REPORT_PREFIX):]))
+    return None
+
+
+def _dry_run_in_process(script_path):
+    """
+    Load the script and run ManimScene's construct() with animations skipped.
+
+    Skipped animations only compute their end state, and with dry_run set
+    Manim writes no frames, partial movies or final video. The scene is
+    not render()ed, which would try to combine the (missing) movie.
+    """
+    from manim import tempconfig
+    from manim.utils.exceptions import EndSceneEarlyException
+
+    spec = importlib.util.spec_from_file_location("manim_dry_run", script_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if not hasattr(module, 'ManimScene'):
+        raise Exception("No ManimScene class defined")
+
+    with tempconfig({
+        "input_file": script_path,
+        # Text SVGs and LaTeX land where the real render will look for them
+        "media_dir": MEDIA_FOLDER,
+        "scene_names": ["ManimScene"],
+        "progress_bar": "none",
+        "dry_run": True,
+        "write_to_movie": False,
+        "save_last_frame": False,
+        "disable_caching": True,
+        # Skipped animations still draw one frame each; make it a tiny one
+        "pixel_width": 32,
+        "pixel_height": 18,
+    }):
+        scene = module.ManimScene(skip_animations=True)
+        scene.setup()
+        try:
+            scene.construct()
+        except EndSceneEarlyException:
+            pass
+        scene.tear_down()
+        return {"duration": float(scene.renderer.time), "animation_count": scene.renderer.num_plays}
+
+
+def _describe_error(error, script_path):
+    """The exception, with the line of the scene it was raised from"""
+    message = f"{type(error).__name__}: {error}"
+    lines = [frame.lineno for frame in traceback.extract_tb(error.__traceback__) if frame.filename == script_path]
+    if lines:
+        message += f" (line {lines[-1]})"
+    return message
+
+
+if __name__ == '__main__':
+    # Leave no bytecode next to the temporary script
+    sys.dont_write_bytecode = True
+    from backend.scene_cache import install_scene_cache, scene_cache
+    install_scene_cache(scene_cache)
+
+    path = os.path.abspath(sys.argv[1])
+    try:
+        report = _dry_run_in_process(path)
+    except Exception as e:
+        report = {"error": _describe_error(e, path)}
+    print(REPORT_PREFIX + json.dumps(report), flush=True)
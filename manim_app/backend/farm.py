@@ -0,0 +1,308 @@
+import os
+import queue
+import threading
+import time
+
+from backend.job_store import JOB_DB_PATH, job_store, open_database
+from backend.metrics import registry
+from backend.renderer import DEFAULT_QUALITY
+from backend.scheduler import SCHEDULER_POLICY, SCHEDULER_CLIENT_PENALTY_SECONDS, render_priority, render_rank
+
+# Configuration
+# API nodes hand renders to render nodes (python -m backend.render_node) instead of rendering themselves
+RENDER_FARM = os.environ.get('RENDER_FARM', '0') == '1'
+# The shared render queue; must be reachable by every API and render node
+RENDER_QUEUE_DB_PATH = os.environ.get('RENDER_QUEUE_DB_PATH', JOB_DB_PATH)
+# A render node that stops renewing its lease this long is presumed dead and its render is handed out again
+FARM_LEASE_SECONDS = float(os.environ.get('FARM_LEASE_SECONDS', '60'))
+FARM_HEARTBEAT_SECONDS = float(os.environ.get('FARM_HEARTBEAT_SECONDS', str(FARM_LEASE_SECONDS / 4)))
+# Deliveries of one render before it is failed, so a scene that kills its render node can't take down the farm
+FARM_MAX_DELIVERIES = int(os.environ.get('FARM_MAX_DELIVERIES', '3'))
+# Seconds between polls of the render queue (idle render nodes) and of the job store (API nodes)
+FARM_POLL_SECONDS = float(os.environ.get('FARM_POLL_SECONDS', '0.5'))
+
+TASKS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS render_tasks (
+    job_id TEXT NOT NULL,
+    quality TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    deliveries INTEGER NOT NULL DEFAULT 0,
+    rank REAL NOT NULL DEFAULT 0,
+    client TEXT,
+    PRIMARY KEY (job_id, quality)
+);
+"""
+
+# Columns added since the table was first created, with their definitions
+TASKS_COLUMNS = {"rank": "REAL NOT NULL DEFAULT 0", "client": "TEXT"}
+
+
+class RenderTask:
+    """One render (a job at one quality tier) leased from the render queue"""
+
+    def __init__(self, job_id, quality, enqueued_at, deliveries):
+        self.job_id = job_id
+        self.quality = quality
+        self.enqueued_at = enqueued_at
+        # Including this one; above 1 means an earlier render node died or lost its lease
+        self.deliveries = deliveries
+
+    def __str__(self):
+        return f"{self.job_id} ({self.quality})"
+
+
+class LeaseQueue:
+    """
+    Durable render queue shared by all nodes of a render farm.
+
+    A render node leases the waiting task that ranks first (see
+    backend/scheduler.py; a client's tasks rank lower for every one of its
+    tasks in progress) for `lease_seconds` and renews the lease while it renders; the task is deleted once the render
+    has finished. If the node dies, its lease runs out and the next node
+    asking for work gets the task again (re-delivery). Putting a task that
+    is already queued is a no-op, so queueing is idempotent.
+
+    This is a SQLite table, by default in the job store's database, which
+    serves any number of processes and containers sharing a volume on one
+    host. Spreading nodes over several hosts takes a queue with the same
+    five operations on a networked database.
+    """
+
+    def __init__(self, path=RENDER_QUEUE_DB_PATH, lease_seconds=FARM_LEASE_SECONDS):
+        self.lease_seconds = lease_seconds
+        self._conn = open_database(path)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript(TASKS_SCHEMA)
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(render_tasks)")}
+            for column, definition in TASKS_COLUMNS.items():
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE render_tasks ADD COLUMN {column} {definition}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS render_tasks_rank ON render_tasks (rank)")
+
+    def put(self, job_id, quality, rank=None, client=None):
+        """
+        Queue a render.
+
+        Args:
+            rank (float, optional): backend.scheduler.render_rank of the render; defaults to arrival order
+            client (str, optional): Who asked for it
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR IGNORE INTO render_tasks (job_id, quality, enqueued_at, rank, client)
+                VALUES (?, ?, ?, ?, ?)
+                """, (job_id, quality, now, rank if rank is not None else now, client))
+
+    def rerank(self, job_id, quality, rank_of):
+        """
+        Change the rank of a queued render, e.g. once its job is promoted.
+
+        Args:
+            rank_of (callable): Called with the render's enqueued_at, returns its new rank
+
+        Returns:
+            bool: False if the render isn't queued (any more)
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT enqueued_at FROM render_tasks WHERE job_id = ? AND quality = ?",
+                                         (job_id, quality)).fetchone()
+                if row is not None:
+                    self._conn.execute("UPDATE render_tasks SET rank = ? WHERE job_id = ? AND quality = ?",
+                                       (rank_of(row["enqueued_at"]), job_id, quality))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row is not None
+
+    def lease(self, owner):
+        """
+        Take the first ranked task that is waiting or whose lease has run out.
+
+        Returns:
+            RenderTask: The task, or None if there is no work
+        """
+        now = time.time()
+        client_penalty = 0 if SCHEDULER_POLICY == 'fifo' else SCHEDULER_CLIENT_PENALTY_SECONDS
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    """
+                    SELECT job_id, quality, enqueued_at, deliveries FROM render_tasks t
+                    WHERE lease_expires IS NULL OR lease_expires < :now
+                    ORDER BY rank + :client_penalty * (
+                        SELECT COUNT(*) FROM render_tasks r WHERE r.client = t.client AND r.lease_expires >= :now
+                    ), rank
+                    LIMIT 1
+                    """, {"now": now, "client_penalty": client_penalty}).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        """
+                        UPDATE render_tasks SET lease_owner = ?, lease_expires = ?, deliveries = deliveries + 1
+                        WHERE job_id = ? AND quality = ?
+                        """, (owner, now + self.lease_seconds, row["job_id"], row["quality"]))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return RenderTask(row["job_id"], row["quality"], row["enqueued_at"], row["deliveries"] + 1)
+
+    def renew(self, task, owner):
+        """
+        Extend a lease (the heartbeat).
+
+        Returns:
+            bool: False if the lease ran out and the task went to another node
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE render_tasks SET lease_expires = ? WHERE job_id = ? AND quality = ? AND lease_owner = ?",
+                (time.time() + self.lease_seconds, task.job_id, task.quality, owner))
+        return cursor.rowcount == 1
+
+    def complete(self, task, owner):
+        """Remove a finished task, unless its lease went to another node meanwhile"""
+        with self._lock:
+            self._conn.execute("DELETE FROM render_tasks WHERE job_id = ? AND quality = ? AND lease_owner = ?",
+                               (task.job_id, task.quality, owner))
+
+    def has(self, job_id, quality=None):
+        """Whether a render of the job (at `quality`, or any) is waiting or leased"""
+        with self._lock:
+            if quality is None:
+                row = self._conn.execute("SELECT 1 FROM render_tasks WHERE job_id = ? LIMIT 1", (job_id,)).fetchone()
+            else:
+                row = self._conn.execute("SELECT 1 FROM render_tasks WHERE job_id = ? AND quality = ?",
+                                         (job_id, quality)).fetchone()
+        return row is not None
+
+    def counts(self):
+        """
+        Returns:
+            dict: Tasks "waiting" for a render node and "leased" by one
+        """
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT COUNT(*) AS total,
+                       COALESCE(SUM(lease_expires IS NOT NULL AND lease_expires >= ?), 0) AS leased
+                FROM render_tasks
+                """, (time.time(),)).fetchone()
+        return {"waiting": row["total"] - row["leased"], "leased": row["leased"]}
+
+    def depth(self):
+        return self.counts()["waiting"]
+
+
+class JobFollower:
+    """
+    Keeps jobs that render nodes are working on up to date on the node that
+    took the request, so their subscribers and done callbacks (batches) see
+    every change. Polls the job store every `interval` seconds and stops
+    following a job once it and any quality renders it asked for are done.
+    """
+
+    def __init__(self, interval=FARM_POLL_SECONDS, on_finished=None):
+        self.interval = interval
+        self.on_finished = on_finished
+        self._jobs = {}
+        # job_id -> updated_at of the row last applied
+        self._seen = {}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def follow(self, job):
+        with self._lock:
+            self._jobs[job.job_id] = job
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="job-follower", daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Following render farm jobs failed: {str(e)}")
+
+    def poll(self):
+        """Apply the changes saved since the last poll"""
+        with self._lock:
+            jobs = dict(self._jobs)
+        if not jobs:
+            return
+        updated = job_store.updated_at(list(jobs))
+        for job_id, job in jobs.items():
+            updated_at = updated.get(job_id)
+            record = None
+            if updated_at is not None and updated_at != self._seen.get(job_id):
+                record = job_store.get(job_id)
+            if record is not None:
+                self._seen[job_id] = record["updated_at"]
+                finished = job.refresh(record)
+                if finished and self.on_finished is not None:
+                    self.on_finished(job)
+            if updated_at is None or job.settled:
+                with self._lock:
+                    if self._jobs.get(job_id) is job:
+                        del self._jobs[job_id]
+                self._seen.pop(job_id, None)
+
+    def count(self):
+        with self._lock:
+            return len(self._jobs)
+
+
+class FarmQueue:
+    """
+    Stands in for the job queue's local render queue on a render farm: each
+    (job, quality) put becomes a task in the shared LeaseQueue, and the job
+    is followed until a render node has finished it (unless `follower` is
+    None, as on a render node). Capacity is counted
+    across the farm, from the tasks no render node has picked up yet.
+    """
+
+    def __init__(self, tasks, maxsize, follower):
+        self.tasks = tasks
+        self.maxsize = maxsize
+        self.follower = follower
+
+    def qsize(self):
+        return self.tasks.depth()
+
+    def put(self, item):
+        job, quality = item
+        now = time.time()
+        rank = render_rank(job.estimated_render_seconds(quality), render_priority(job, quality), now)
+        self.tasks.put(job.job_id, quality, rank=rank, client=job.client)
+        if self.follower is not None:
+            self.follower.follow(job)
+
+    def put_nowait(self, item):
+        if self.qsize() >= self.maxsize:
+            raise queue.Full
+        self.put(item)
+
+    def promote(self, job):
+        """Re-rank the job's queued render after its class changed, since ranks are stored with the task"""
+        cost = job.estimated_render_seconds(DEFAULT_QUALITY)
+        priority = render_priority(job, DEFAULT_QUALITY)
+        self.tasks.rerank(job.job_id, DEFAULT_QUALITY, lambda enqueued_at: render_rank(cost, priority, enqueued_at))
+
+
+# Shared render queue used by API nodes and render nodes
+render_tasks = LeaseQueue()
+
+registry.gauge('render_tasks', 'Renders in the render farm queue, waiting or leased by a render node', ['state'],
+               function=lambda: {(state,): count for state, count in render_tasks.counts().items()})
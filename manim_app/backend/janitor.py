@@ -0,0 +1,259 @@
+import fcntl
+import os
+import re
+import shutil
+import threading
+import time
+
+from backend.cache import MEDIA_FOLDER, result_cache
+from backend.job_store import job_store
+from backend.metrics import registry
+from backend.renderer import TEMP_FOLDER
+from backend.scene_cache import scene_cache
+
+# Configuration
+JANITOR_INTERVAL_SECONDS = int(os.environ.get('JANITOR_INTERVAL_SECONDS', '300'))
+# Job files (script, videos, preview) older than this are deleted unless pinned (0 keeps them forever)
+JOB_RETENTION_HOURS = float(os.environ.get('JOB_RETENTION_HOURS', '72'))
+# Beyond this total the least recently modified unpinned jobs are deleted first (0 disables)
+JOB_STORAGE_MAX_MB = int(os.environ.get('JOB_STORAGE_MAX_MB', '4096'))
+PIN_FOLDER = os.environ.get('PIN_FOLDER', os.path.join(MEDIA_FOLDER, 'pins'))
+
+# Files this young may belong to a job another process is still working on
+JOB_MIN_AGE_SECONDS = 15 * 60
+# Only UUID-named entries are job files; anything else in media/ is left alone
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+janitor_removed_jobs_total = registry.counter(
+    'janitor_removed_jobs_total', 'Jobs whose files the janitor deleted', ['reason'])
+janitor_freed_bytes_total = registry.counter(
+    'janitor_freed_bytes_total', 'Bytes freed by the janitor')
+
+
+def is_job_id(job_id):
+    return JOB_ID_PATTERN.match(job_id) is not None
+
+
+def pin_job(job_id):
+    """Keep a job's files regardless of age or the storage budget"""
+    os.makedirs(PIN_FOLDER, exist_ok=True)
+    with open(os.path.join(PIN_FOLDER, job_id), 'w'):
+        pass
+
+
+def unpin_job(job_id):
+    try:
+        os.remove(os.path.join(PIN_FOLDER, job_id))
+    except FileNotFoundError:
+        pass
+
+
+class JobFiles:
+    """The files one job left on disk, with their total size and last modification"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.paths = []
+        self.bytes = 0
+        self.modified = 0
+
+    def add(self, path, size, mtime):
+        self.paths.append(path)
+        self.bytes += size
+        self.modified = max(self.modified, mtime)
+
+
+class Janitor:
+    """
+    Background thread that keeps the media volume from filling up.
+
+    Every JANITOR_INTERVAL_SECONDS it deletes the files of jobs older than
+    JOB_RETENTION_HOURS, then the least recently modified ones until job
+    files fit in JOB_STORAGE_MAX_MB. It also evicts expired cache entries
+    and removes temporary files left by interrupted writes.
+
+    A job's files are its script (and bytecode) in utils/temp and its
+    media/videos and media/images directories. A sweep only lists those
+    directories and the few files inside each job's; partial movie files,
+    which used to make up most of them, are deleted after every render.
+    Pinned jobs, jobs this process is still working on and files younger
+    than JOB_MIN_AGE_SECONDS are never deleted.
+
+    Every server process runs a janitor, but a lock file makes sure only
+    one sweeps at a time.
+    """
+
+    def __init__(self, interval=JANITOR_INTERVAL_SECONDS, retention_hours=JOB_RETENTION_HOURS,
+                 max_mb=JOB_STORAGE_MAX_MB):
+        self.interval = interval
+        self.retention = retention_hours * 3600
+        self.max_bytes = max_mb * 1024 * 1024
+        self.job_bytes = 0
+        self.job_count = 0
+        self._active_jobs = lambda: set()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, active_jobs=None):
+        """
+        Start the sweep thread if it isn't running yet.
+
+        Args:
+            active_jobs (callable, optional): Returns the IDs of jobs this process is still working on
+        """
+        with self._lock:
+            if active_jobs is not None:
+                self._active_jobs = active_jobs
+            if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(target=self._loop, name="janitor", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        # Sweep once on start-up too, so the gauges are filled in straight away
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Janitor sweep failed: {str(e)}")
+            time.sleep(self.interval)
+
+    def sweep(self):
+        """
+        Delete expired and excess job files once.
+
+        Returns:
+            dict: Jobs removed and bytes freed, or None if another process is sweeping
+        """
+        os.makedirs(MEDIA_FOLDER, exist_ok=True)
+        with open(os.path.join(MEDIA_FOLDER, '.janitor.lock'), 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            return self._sweep()
+
+    def _sweep(self):
+        now = time.time()
+        jobs = self._scan()
+        protected = self._pinned() | set(self._active_jobs())
+        removable = sorted(
+            (files for files in jobs.values()
+             if files.job_id not in protected and now - files.modified > JOB_MIN_AGE_SECONDS),
+            key=lambda files: files.modified)
+
+        total = sum(files.bytes for files in jobs.values())
+        removed = freed = 0
+        for files in removable:
+            if self.retention > 0 and now - files.modified > self.retention:
+                reason = 'expired'
+            elif self.max_bytes > 0 and total > self.max_bytes:
+                reason = 'over_budget'
+            else:
+                continue
+            self._remove(files)
+            janitor_removed_jobs_total.inc(reason=reason)
+            janitor_freed_bytes_total.inc(files.bytes)
+            total -= files.bytes
+            removed += 1
+            freed += files.bytes
+
+        # Jobs that left no files behind (failed ones, mostly) only have their row to expire
+        if self.retention > 0:
+            job_store.delete_finished(now - self.retention, keep=protected)
+
+        for cache in (result_cache.code, result_cache.videos, scene_cache.partials, scene_cache.texts):
+            cache.evict()
+            self._remove_stale_temporaries(cache.directory, now)
+
+        self.job_bytes = total
+        self.job_count = len(jobs) - removed
+        if removed:
+            print(f"Janitor removed {removed} jobs, freeing {freed / 1024 / 1024:.1f} MB "
+                  f"({total / 1024 / 1024:.1f} MB of job files left)")
+        return {"removed": removed, "freed_bytes": freed}
+
+    def _scan(self):
+        """Group the job files on disk by job ID"""
+        jobs = {}
+
+        def files_for(job_id):
+            return jobs.setdefault(job_id, JobFiles(job_id))
+
+        # Scripts, and the bytecode Manim's import leaves next to them
+        for directory in (TEMP_FOLDER, os.path.join(TEMP_FOLDER, '__pycache__')):
+            for entry in _scandir(directory):
+                job_id = entry.name.split('.')[0]
+                if entry.is_file() and is_job_id(job_id):
+                    stat = entry.stat()
+                    files_for(job_id).add(entry.path, stat.st_size, stat.st_mtime)
+
+        for area in ('videos', 'images'):
+            for entry in _scandir(os.path.join(MEDIA_FOLDER, area)):
+                if entry.is_dir() and is_job_id(entry.name):
+                    size, mtime = _tree_totals(entry.path)
+                    files_for(entry.name).add(entry.path, size, mtime)
+        return jobs
+
+    def _pinned(self):
+        return {entry.name for entry in _scandir(PIN_FOLDER)}
+
+    def _remove(self, files):
+        # The job goes first, so no endpoint hands out a path that is about to disappear
+        job_store.delete(files.job_id)
+        for path in files.paths:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _remove_stale_temporaries(self, directory, now):
+        """Remove the *.tmp files and scratch directories interrupted writes left in a cache directory"""
+        for entry in _scandir(directory):
+            if not (entry.name.endswith('.tmp') or entry.is_dir()):
+                continue
+            try:
+                if now - entry.stat().st_mtime <= JOB_MIN_AGE_SECONDS:
+                    continue
+                if entry.is_dir():
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def _scandir(directory):
+    try:
+        with os.scandir(directory) as it:
+            return list(it)
+    except FileNotFoundError:
+        return []
+
+
+def _tree_totals(path):
+    """Total size and newest modification time of the files under a directory"""
+    size, mtime = 0, os.stat(path).st_mtime
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            size += stat.st_size
+            mtime = max(mtime, stat.st_mtime)
+    return size, mtime
+
+
+# Shared janitor, started by the job queue together with its workers
+janitor = Janitor()
+
+registry.gauge('job_storage_bytes', 'Size of the job files on disk at the last janitor sweep',
+               function=lambda: janitor.job_bytes)
+registry.gauge('job_storage_jobs', 'Jobs with files on disk at the last janitor sweep',
+               function=lambda: janitor.job_count)
+registry.gauge('disk_free_bytes', 'Free space on the media volume',
+               function=lambda: shutil.disk_usage(MEDIA_FOLDER).free)
@@ -0,0 +1,307 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from backend.cache import MEDIA_FOLDER, normalize_description, sha256_hex
+
+# Configuration
+# Kept on the data volume so it survives restarts and is shared by every server process, and
+# outside MEDIA_FOLDER, parts of which are served at /media/
+DATA_FOLDER = os.path.join(os.path.dirname(MEDIA_FOLDER), 'data')
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH', os.path.join(DATA_FOLDER, 'jobs.db'))
+# Milliseconds a write waits for another process's transaction before failing
+JOB_DB_BUSY_TIMEOUT_MS = int(os.environ.get('JOB_DB_BUSY_TIMEOUT_MS', '5000'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    description TEXT NOT NULL,
+    description_hash TEXT NOT NULL,
+    code TEXT,
+    code_hash TEXT,
+    state TEXT NOT NULL,
+    quality TEXT NOT NULL,
+    error TEXT,
+    cached INTEGER NOT NULL DEFAULT 0,
+    preview_path TEXT,
+    stats TEXT,
+    owner TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_description_hash ON jobs (description_hash);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+
+CREATE TABLE IF NOT EXISTS videos (
+    job_id TEXT NOT NULL REFERENCES jobs (job_id) ON DELETE CASCADE,
+    quality TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER,
+    PRIMARY KEY (job_id, quality)
+);
+
+CREATE TABLE IF NOT EXISTS batches (
+    batch_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS batch_items (
+    batch_id TEXT NOT NULL REFERENCES batches (batch_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    description TEXT NOT NULL,
+    quality TEXT NOT NULL,
+    job_id TEXT,
+    error TEXT,
+    PRIMARY KEY (batch_id, position)
+);
+"""
+
+
+def open_database(path):
+    """
+    A connection to a SQLite database shared by several processes: WAL mode,
+    autocommit (transactions are explicit) and usable from any thread.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=JOB_DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False,
+                           isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    # Durable across application crashes; only an OS crash can lose the last commits
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+def process_owner():
+    """Identifies the server process working on a job: host:pid"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner):
+    """Whether the process named by an owner string still runs (only decidable on its own host)"""
+    host, _, pid = (owner or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore:
+    """
+    Job metadata in SQLite, shared by every server process.
+
+    One row per job holds its description (and hash, indexed), code (and
+    hash), state, error, timings and preview; the videos table holds each
+    rendered quality's path and size. The job queue writes a row every
+    time a job's status changes, and the endpoints read jobs another
+    process (or a previous run) owns from here instead of probing the
+    filesystem.
+
+    Batches (see backend/batches.py) are kept alongside: one row per item
+    with its description, quality and, once submitted, its job.
+
+    The database runs in WAL mode, so readers never block the writer and
+    several gunicorn workers can share it. Each process uses a single
+    connection guarded by a lock; every statement is a short indexed
+    lookup or upsert.
+    """
+
+    def __init__(self, path=JOB_DB_PATH):
+        self.path = path
+        self._conn = open_database(path)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript(SCHEMA)
+
+    def save(self, record):
+        """
+        Insert or update a job and its videos.
+
+        Args:
+            record (dict): Columns of the jobs table, plus "videos" ({quality: path})
+                and "stats" (anything JSON-serializable)
+        """
+        now = time.time()
+        code = record.get("code")
+        videos = []
+        for quality, path in record.get("videos", {}).items():
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = None
+            videos.append((record["job_id"], quality, path, size))
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    """
+                    INSERT INTO jobs (job_id, description, description_hash, code, code_hash, state, quality,
+                                      error, cached, preview_path, stats, owner, created_at, started_at,
+                                      finished_at, updated_at)
+                    VALUES (:job_id, :description, :description_hash, :code, :code_hash, :state, :quality,
+                            :error, :cached, :preview_path, :stats, :owner, :created_at, :started_at,
+                            :finished_at, :updated_at)
+                    ON CONFLICT (job_id) DO UPDATE SET
+                        code = excluded.code, code_hash = excluded.code_hash, state = excluded.state,
+                        error = excluded.error, cached = excluded.cached, preview_path = excluded.preview_path,
+                        stats = excluded.stats, owner = excluded.owner, started_at = excluded.started_at,
+                        finished_at = excluded.finished_at, updated_at = excluded.updated_at
+                    """,
+                    {
+                        **record,
+                        "description_hash": sha256_hex(normalize_description(record["description"])),
+                        "code_hash": sha256_hex(code) if code is not None else None,
+                        "cached": int(bool(record.get("cached"))),
+                        "stats": json.dumps(record.get("stats") or {}),
+                        "owner": process_owner(),
+                        "updated_at": now,
+                    })
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO videos (job_id, quality, path, size) VALUES (?, ?, ?, ?)", videos)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get(self, job_id):
+        """
+        Return a job as a dict (the save() format), or None if unknown.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            videos = self._conn.execute("SELECT quality, path FROM videos WHERE job_id = ?", (job_id,)).fetchall()
+        return self._record(row, videos)
+
+    def updated_at(self, job_ids):
+        """
+        When each of the given jobs last changed; jobs that no longer exist are left out.
+
+        Returns:
+            dict: {job_id: updated_at}
+        """
+        placeholders = ', '.join('?' for _ in job_ids)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT job_id, updated_at FROM jobs WHERE job_id IN ({placeholders})", tuple(job_ids)).fetchall()
+        return {row["job_id"]: row["updated_at"] for row in rows}
+
+    def delete(self, job_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def delete_finished(self, before, keep=()):
+        """
+        Delete jobs that finished, and last changed, before the `before`
+        timestamp, and batches created before it.
+
+        Args:
+            keep (set): IDs of jobs to leave alone (pinned ones)
+
+        Returns:
+            int: Number of jobs deleted
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id FROM jobs WHERE finished_at < ? AND updated_at < ?", (before, before)).fetchall()
+            expired = [(row["job_id"],) for row in rows if row["job_id"] not in keep]
+            self._conn.executemany("DELETE FROM jobs WHERE job_id = ?", expired)
+            self._conn.execute("DELETE FROM batches WHERE created_at < ?", (before,))
+        return len(expired)
+
+    def save_batch(self, batch_id, created_at, items):
+        """
+        Record a new batch.
+
+        Args:
+            items (list): (description, quality) pairs, in order
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("INSERT INTO batches (batch_id, created_at) VALUES (?, ?)", (batch_id, created_at))
+                self._conn.executemany(
+                    "INSERT INTO batch_items (batch_id, position, description, quality) VALUES (?, ?, ?, ?)",
+                    [(batch_id, position, description, quality)
+                     for position, (description, quality) in enumerate(items)])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def set_batch_item(self, batch_id, position, job_id=None, error=None):
+        """Record the job a batch item was submitted as, or why it couldn't be"""
+        with self._lock:
+            self._conn.execute("UPDATE batch_items SET job_id = ?, error = ? WHERE batch_id = ? AND position = ?",
+                               (job_id, error, batch_id, position))
+
+    def get_batch(self, batch_id):
+        """
+        Return a batch with the state of each item's job, or None if unknown.
+
+        Returns:
+            dict: batch_id, created_at and items (position, description, quality,
+                job_id, state, error), in order
+        """
+        with self._lock:
+            batch = self._conn.execute("SELECT * FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+            if batch is None:
+                return None
+            rows = self._conn.execute(
+                """
+                SELECT i.position, i.description, i.quality, i.job_id, j.state,
+                       COALESCE(i.error, j.error) AS error
+                FROM batch_items i LEFT JOIN jobs j ON j.job_id = i.job_id
+                WHERE i.batch_id = ? ORDER BY i.position
+                """, (batch_id,)).fetchall()
+        return {**dict(batch), "items": [dict(row) for row in rows]}
+
+    def claim_orphans(self, states):
+        """
+        Take over jobs in `states` whose owning process on this host has died.
+
+        The claim is a compare-and-set on the owner, so when several processes
+        recover at once each orphan goes to exactly one of them.
+
+        Returns:
+            list: The claimed jobs, as dicts
+        """
+        placeholders = ', '.join('?' for _ in states)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT job_id, owner FROM jobs WHERE state IN ({placeholders})", tuple(states)).fetchall()
+        claimed = []
+        for row in rows:
+            if _owner_alive(row["owner"]):
+                continue
+            with self._lock:
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET owner = ?, updated_at = ? WHERE job_id = ? AND owner IS ?",
+                    (process_owner(), time.time(), row["job_id"], row["owner"]))
+            if cursor.rowcount == 1:
+                claimed.append(self.get(row["job_id"]))
+        return claimed
+
+    def _record(self, row, videos):
+        record = dict(row)
+        record["cached"] = bool(record["cached"])
+        record["stats"] = json.loads(record["stats"] or '{}')
+        record["videos"] = {video["quality"]: video["path"] for video in videos}
+        return record
+
+
+# Shared store used by the job queue and the API
+job_store = JobStore()
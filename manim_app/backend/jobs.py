@@ -0,0 +1,981 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from backend.text_to_manim import generate_manim_code, SOURCE_GEMINI
+from backend.codegen import get_code_generator, CODEGEN_CONCURRENCY
+from backend.renderer import run_manim, render_preview, video_path_for, TEMP_FOLDER, DEFAULT_QUALITY
+from backend.cache import result_cache, link_or_copy, normalize_description
+from backend.delivery import versioned_url
+from backend.validation import validate_scene
+from backend.dry_run import recorded_dry_run
+from backend.manim_output import ANIMATION_STARTED, ANIMATION_FINISHED, PARTIAL_MOVIE_WRITTEN
+from backend.metrics import registry, time_stage, stage_seconds, job_seconds
+from backend.janitor import janitor
+from backend.job_store import job_store
+from backend.farm import RENDER_FARM, FarmQueue, JobFollower, render_tasks
+from backend.scheduler import JobScheduler, estimate_render_seconds, plan_degradations, INTERACTIVE, BATCH
+
+# Configuration
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', '2'))
+RENDER_QUEUE_SIZE = int(os.environ.get('RENDER_QUEUE_SIZE', '16'))
+# Threads generating code ahead of the render workers, so a slow provider never holds one
+CODEGEN_WORKERS = int(os.environ.get('CODEGEN_WORKERS', str(CODEGEN_CONCURRENCY)))
+JOB_HISTORY_SIZE = int(os.environ.get('JOB_HISTORY_SIZE', '1000'))
+# Render the last frame as a quick preview before the full video
+RENDER_PREVIEW = os.environ.get('RENDER_PREVIEW', '1') == '1'
+# Events kept per job for /api/events subscribers that (re)connect late
+JOB_EVENT_HISTORY = 200
+
+# Job states reported by /api/status/<job_id>
+QUEUED = 'queued'
+GENERATING_CODE = 'generating_code'
+RENDERING = 'rendering'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+FINAL_STATES = (COMPLETED, FAILED)
+
+deadline_degradations_total = registry.counter(
+    'deadline_degradations_total', 'Renders degraded to make their deadline, by degradation', ['degradation'])
+deadlines_total = registry.counter(
+    'deadlines_total', 'Jobs with a deadline that finished, by whether they made it', ['outcome'])
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue has no room for another job"""
+
+
+class EventLog:
+    """
+    Numbered events for server-sent event subscribers, kept for a while
+    so that subscribers who (re)connect late can catch up.
+    """
+
+    def __init__(self, history=JOB_EVENT_HISTORY):
+        # (sequence number, event, data)
+        self._events = deque(maxlen=history)
+        self._event_seq = 0
+        self._changed = threading.Condition()
+
+    def publish(self, event, data):
+        """Record an event and wake up everyone waiting in wait_events"""
+        with self._changed:
+            self._event_seq += 1
+            self._events.append((self._event_seq, event, data))
+            self._changed.notify_all()
+
+    def last_event_seq(self):
+        with self._changed:
+            return self._event_seq
+
+    def wait_events(self, after, timeout):
+        """
+        Events with a sequence number above `after`, blocking up to `timeout`
+        seconds for one to arrive.
+
+        Returns:
+            list: (sequence number, event, data) tuples, empty on timeout
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._event_seq > after, timeout)
+            return [e for e in self._events if e[0] > after]
+
+
+class Job(EventLog):
+    """A single text-to-animation request and its progress through the pipeline"""
+
+    def __init__(self, description, job_id=None, quality=DEFAULT_QUALITY, priority=INTERACTIVE, client=None,
+                 deadline_ms=None, rerender=True):
+        super().__init__()
+        self.job_id = job_id or str(uuid.uuid4())
+        self.description = description
+        self.quality = quality
+        # Scheduling class (backend/scheduler.py) and who asked, for per-client fairness
+        self.priority = priority
+        self.client = client
+        # Latency budget: when the low quality video should be done, and how it was degraded to make it
+        # ({} for not at all; None until decided). With `rerender` a degraded video is replaced by a full
+        # render, done by the job `rerender_job_id`.
+        self.deadline_ms = deadline_ms
+        self.degradations = None
+        self.rerender = rerender
+        self.rerender_job_id = None
+        self._state = QUEUED
+        # Called once with the job when it completes or fails
+        self._done_callbacks = []
+        self.code = None
+        # Scene duration and animation count measured by the code's dry run, if it had one
+        self.dry_run = None
+        # Rendered videos by quality tier; low quality always comes first
+        self.videos = {}
+        self.pending_qualities = set()
+        self.quality_errors = {}
+        # Peak RSS and CPU seconds per render phase ('preview' or a quality tier)
+        self.resources = {}
+        # Animations started / estimated total of the render in progress
+        self.progress = None
+        # Per render phase: seconds each animation took and partial movie files written
+        self.timings = {}
+        self.preview_path = None
+        self.error = None
+        self.cached = False
+        self.deduplicated = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.render_queued_at = None
+        self.finished_at = None
+
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, state):
+        self._state = state
+        self.publish_status()
+        if state in FINAL_STATES:
+            self._run_done_callbacks()
+
+    @property
+    def settled(self):
+        """True once the job and every higher quality render asked of it have finished"""
+        return self._state in FINAL_STATES and not self.pending_qualities
+
+    def add_done_callback(self, callback):
+        """Call `callback(job)` once the job has completed or failed (straight away if it has)"""
+        with self._changed:
+            if self._state not in FINAL_STATES:
+                self._done_callbacks.append(callback)
+                return
+        callback(self)
+
+    def _run_done_callbacks(self):
+        with self._changed:
+            callbacks, self._done_callbacks = self._done_callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def publish_status(self):
+        """Save the job's new state to the job store and push it to subscribers"""
+        self.save()
+        self.publish('status', self.to_dict())
+
+    def save(self):
+        try:
+            job_store.save(self.to_record())
+        except sqlite3.Error as e:
+            # Other processes see a stale state until the next save; this one carries on
+            print(f"Could not save job {self.job_id} to the job store: {str(e)}")
+
+    def report_render_event(self, phase, event, total):
+        """
+        Record a structured render event (see backend/manim_output.py) for the
+        `phase` render, whose scene has about `total` animations.
+        """
+        timings = self.timings.setdefault(phase, {"animation_seconds": [], "partial_movies": 0})
+        if event["event"] == ANIMATION_STARTED:
+            animation = event["animation"] + 1
+            self.progress = {"phase": phase, "animation": animation, "total": max(total, animation),
+                             "name": event.get("name")}
+            self.publish('progress', self.progress)
+        elif event["event"] == ANIMATION_FINISHED:
+            timings["animation_seconds"].append(event["seconds"])
+        elif event["event"] == PARTIAL_MOVIE_WRITTEN:
+            timings["partial_movies"] += 1
+
+    @property
+    def animation_count(self):
+        """Animations in the scene: counted by the dry run, else estimated from the code"""
+        if self.dry_run:
+            return self.dry_run["animation_count"]
+        return validate_scene(self.code).animation_count
+
+    def estimated_render_seconds(self, quality=DEFAULT_QUALITY):
+        return estimate_render_seconds(self.code, quality, self.dry_run)
+
+    @property
+    def deadline_at(self):
+        return self.created_at + self.deadline_ms / 1000 if self.deadline_ms is not None else None
+
+    @property
+    def degraded_video(self):
+        """Whether the low quality video is short of the full one (skipping just the preview leaves it whole)"""
+        return bool(set(self.degradations or ()) - {'skipped_preview'})
+
+    @property
+    def output_path(self):
+        """Path of the default (low quality) render"""
+        return self.videos.get(DEFAULT_QUALITY)
+
+    @property
+    def video_url(self):
+        return self.video_url_for(DEFAULT_QUALITY)
+
+    def video_url_for(self, quality):
+        """Content-addressed URL of a rendered video, so clients can cache it forever"""
+        url = f"/api/video/{self.job_id}"
+        if quality != DEFAULT_QUALITY:
+            url += f"?quality={quality}"
+        path = self.videos.get(quality)
+        return versioned_url(url, path) if path else url
+
+    @property
+    def preview_url(self):
+        url = f"/api/preview/{self.job_id}"
+        return versioned_url(url, self.preview_path) if self.preview_path else url
+
+    def to_record(self):
+        """The job as a job store row (see backend/job_store.py)"""
+        return {
+            "job_id": self.job_id,
+            "description": self.description,
+            "code": self.code,
+            "state": self.state,
+            "quality": self.quality,
+            "error": self.error,
+            "cached": self.cached,
+            "preview_path": self.preview_path,
+            "videos": dict(self.videos),
+            "stats": {"resources": self.resources, "timings": self.timings, "progress": self.progress,
+                      "pending_qualities": sorted(self.pending_qualities), "quality_errors": self.quality_errors,
+                      "dry_run": self.dry_run, "priority": self.priority, "client": self.client,
+                      "deadline_ms": self.deadline_ms, "degradations": self.degradations,
+                      "rerender": self.rerender, "rerender_job_id": self.rerender_job_id},
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    @classmethod
+    def from_record(cls, record):
+        """Rebuild a job saved by this or another server process"""
+        job = cls(record["description"], job_id=record["job_id"], quality=record["quality"])
+        job._load_record(record)
+        return job
+
+    def refresh(self, record):
+        """
+        Take over the changes another process (a render node) saved for this
+        job and push them to subscribers, without saving them again.
+
+        Returns:
+            bool: True if the job completed or failed with this change
+        """
+        finished = self._state not in FINAL_STATES and record["state"] in FINAL_STATES
+        progress = self.progress
+        self._load_record(record)
+        if self.progress is not None and self.progress != progress:
+            self.publish('progress', self.progress)
+        self.publish('status', self.to_dict())
+        if finished:
+            self._run_done_callbacks()
+        return finished
+
+    def _load_record(self, record):
+        stats = record["stats"]
+        self._state = record["state"]
+        self.code = record["code"]
+        self.error = record["error"]
+        self.cached = record["cached"]
+        self.preview_path = record["preview_path"]
+        self.videos = record["videos"]
+        self.resources = stats.get("resources", {})
+        self.timings = stats.get("timings", {})
+        self.progress = stats.get("progress")
+        self.pending_qualities = set(stats.get("pending_qualities", ()))
+        self.quality_errors = stats.get("quality_errors", {})
+        self.dry_run = stats.get("dry_run")
+        self.priority = stats.get("priority", INTERACTIVE)
+        self.client = stats.get("client")
+        self.deadline_ms = stats.get("deadline_ms")
+        self.degradations = stats.get("degradations")
+        self.rerender = stats.get("rerender", True)
+        self.rerender_job_id = stats.get("rerender_job_id")
+        self.created_at = record["created_at"]
+        self.started_at = record["started_at"]
+        self.finished_at = record["finished_at"]
+
+    def to_dict(self):
+        """Serialize the job for the status endpoint"""
+        data = {
+            "job_id": self.job_id,
+            "status": self.state,
+            "priority": self.priority,
+        }
+        if self.code is not None:
+            data["code"] = self.code
+        if self.preview_path is not None:
+            data["preview_url"] = self.preview_url
+        if self.state == COMPLETED:
+            if self.output_path is not None:
+                data["video_url"] = self.video_url
+            data["cached"] = self.cached
+            data["videos"] = {quality: self.video_url_for(quality) for quality in self.videos}
+        if self.pending_qualities:
+            data["pending_qualities"] = sorted(self.pending_qualities)
+        if self.quality_errors:
+            data["quality_errors"] = self.quality_errors
+        if self.progress and (self.state == RENDERING or self.pending_qualities):
+            data["progress"] = self.progress
+        if self.deadline_ms is not None:
+            data["deadline_ms"] = self.deadline_ms
+        if self.degradations is not None:
+            data["degradations"] = self.degradations
+        if self.rerender_job_id is not None:
+            data["rerender_job_id"] = self.rerender_job_id
+        if self.dry_run:
+            data["dry_run"] = self.dry_run
+        if self.resources:
+            data["resources"] = self.resources
+        if self.timings:
+            data["timings"] = self.timings
+        if self.deduplicated:
+            data["deduplicated_requests"] = self.deduplicated
+        if self.state == FAILED:
+            data["error"] = self.error
+        return data
+
+
+class JobQueue:
+    """
+    Bounded queue of animation jobs drained by a pool of render workers.
+
+    Jobs without code first go to a separate pool of code generation
+    workers, which hand them to the render queue once their code is ready,
+    so render workers only ever render. Jobs waiting for or in code
+    generation count towards the queue's capacity.
+
+    Workers (and the janitor, see backend/janitor.py) are started lazily on
+    the first submission so that forking servers (gunicorn) start them in
+    each worker process rather than the master.
+
+    On a render farm (`farm`, see backend/farm.py) this process renders
+    nothing: renders go to the shared render queue, and the jobs are
+    followed through the job store while render nodes work on them.
+    A render node (`render_node`, see backend/render_node.py) renders what
+    it leases by calling render() itself: the quality renders its jobs ask
+    for go to the shared queue too, and it starts no workers of its own.
+    """
+
+    def __init__(self, num_workers=RENDER_WORKERS, max_size=RENDER_QUEUE_SIZE,
+                 history_size=JOB_HISTORY_SIZE, num_codegen_workers=CODEGEN_WORKERS, farm=RENDER_FARM,
+                 render_node=False):
+        self.farm = farm or render_node
+        self.render_node = render_node
+        self.num_workers = 0 if self.farm else max(1, num_workers)
+        self.num_codegen_workers = max(1, num_codegen_workers)
+        self.history_size = history_size
+        if render_node:
+            # The API node that took the request follows the job, and lands it
+            self._queue = FarmQueue(render_tasks, max(1, max_size), None)
+        elif farm:
+            self._queue = FarmQueue(render_tasks, max(1, max_size), JobFollower(on_finished=self._farm_job_finished))
+        else:
+            self._queue = JobScheduler(max(1, max_size), lambda job, quality: job.estimated_render_seconds(quality))
+        self._codegen_queue = JobScheduler(name='codegen')
+        # Jobs waiting for or in code generation
+        self._generating = 0
+        self._jobs = OrderedDict()
+        # Single-flight: normalized description -> job still being worked on
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._workers = []
+        self._codegen_workers = []
+        self._recovered = False
+
+    def submit(self, description, code=None, source=None, quality=DEFAULT_QUALITY, priority=INTERACTIVE, client=None,
+               deadline_ms=None, rerender=True):
+        """
+        Enqueue a new job for the given description.
+
+        When both the generated code and its render are cached the job is
+        completed immediately and never touches the queue. When an identical
+        description is already queued or running, the caller is attached to
+        that job instead of starting new work; the quality it asked for is
+        rendered once that job completes, like the job's own.
+
+        Args:
+            description (str): Text description of the animation
+            code (str, optional): Already generated code (e.g. streamed); skips code generation
+            source (str, optional): Where `code` came from (SOURCE_GEMINI or SOURCE_TEMPLATE)
+            quality (str): Quality tier wanted; rendered after the low-quality video
+            priority (str): Scheduling class, INTERACTIVE or BATCH (see backend/scheduler.py)
+            client (str, optional): Who asked, so the scheduler can share workers fairly
+            deadline_ms (int, optional): Milliseconds from now the low quality video should be done
+                in; it is rendered at a lower frame rate or resolution, or only its last frame, if
+                that is what it takes (not applied when attaching to an in-flight job)
+            rerender (bool): Queue a full render to replace a degraded video
+
+        Returns:
+            Job: The queued, in-flight or already completed job
+
+        Raises:
+            QueueFullError: If the queue is at capacity
+        """
+        key = normalize_description(description)
+
+        with self._lock:
+            existing = self._in_flight.get(key)
+        if existing is not None:
+            return self._attach(existing, quality, priority)
+
+        job = Job(description, quality=quality, priority=priority, client=client, deadline_ms=deadline_ms,
+                  rerender=rerender)
+        if code is not None:
+            job.code = code
+            self._record_dry_run(job)
+            if source == SOURCE_GEMINI:
+                generator = get_code_generator()
+                result_cache.put_code(description, generator.model_name, generator.prompt_version, code)
+
+        if self._complete_from_cache(job):
+            self._register(job)
+            print(f"Served job {job.job_id} from the result cache")
+            self._request_requested_quality(job)
+            return job
+
+        self._ensure_workers()
+        with self._lock:
+            # Re-check: an identical request may have been queued during the cache lookup
+            existing = self._in_flight.get(key)
+            if existing is None:
+                if self._queue.qsize() + self._generating >= self._queue.maxsize:
+                    raise QueueFullError(f"Render queue is full ({self._queue.maxsize} jobs waiting)")
+                # Saved before a worker can pick it up, so its first update never gets overwritten
+                job.save()
+                self._enqueue(job)
+
+                self._in_flight[key] = job
+                self._jobs[job.job_id] = job
+                self._prune_history()
+        if existing is not None:
+            return self._attach(existing, quality, priority)
+
+        print(f"Queued job {job.job_id} (queue depth: {self.depth()})")
+        return job
+
+    def _attach(self, existing, quality, priority):
+        """Attach a duplicate request to an in-flight job, taking on its quality and scheduling class"""
+        existing.deduplicated += 1
+        # Someone is waiting on it now
+        if priority == INTERACTIVE and existing.priority != INTERACTIVE:
+            existing.priority = INTERACTIVE
+            self._queue.promote(existing)
+        if quality != DEFAULT_QUALITY and quality != existing.quality:
+            existing.add_done_callback(lambda job: self._request_requested_quality(job, quality))
+        print(f"Attached duplicate request to in-flight job {existing.job_id}")
+        return existing
+
+    def get(self, job_id):
+        """Return the job with the given ID, or None if this process doesn't know it"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def lookup(self, job_id):
+        """
+        Return the job with the given ID from this process or, failing that,
+        from the job store (jobs of other server processes and earlier runs).
+
+        On a render farm a finished job is always read from the store, since
+        another API node may have asked for a higher quality since.
+
+        Returns:
+            Job: The job, or None if no process has ever seen it
+        """
+        job = self.get(job_id)
+        if job is not None and not (self.farm and job.settled):
+            return job
+        record = job_store.get(job_id)
+        return Job.from_record(record) if record is not None else job
+
+    def request_quality(self, job_id, quality):
+        """
+        Make sure a job's video exists at the given quality tier.
+
+        Higher tiers are produced lazily from the job's stored script: served
+        from the video cache when possible, otherwise queued for rendering.
+
+        Args:
+            job_id (str): ID of a job whose low-quality video has been rendered
+            quality (str): One of renderer.QUALITY_TIERS
+
+        Returns:
+            Job: The job (check job.videos / job.pending_qualities), or None if unknown
+
+        Raises:
+            QueueFullError: If the render has to be queued and the queue is at capacity
+        """
+        job = self.lookup(job_id)
+        if job is None or job.state != COMPLETED:
+            return job
+
+        with self._lock:
+            if quality in job.videos or quality in job.pending_qualities:
+                return job
+
+        cached_video = result_cache.get_video(job.code, quality)
+        if cached_video is not None:
+            job.videos[quality] = self._reuse_video(job, cached_video, quality)
+            job.publish_status()
+            return job
+
+        self._ensure_workers()
+        with self._lock:
+            if quality in job.pending_qualities:
+                return job
+            job.pending_qualities.add(quality)
+            job.quality_errors.pop(quality, None)
+            self._jobs[job.job_id] = job
+            self._prune_history()
+
+        # Saved before a render node can pick the render up, so its updates never get overwritten
+        job.publish_status()
+        try:
+            self._queue.put_nowait((job, quality))
+        except queue.Full:
+            with self._lock:
+                job.pending_qualities.discard(quality)
+            job.publish_status()
+            raise QueueFullError(f"Render queue is full ({self._queue.maxsize} jobs waiting)")
+        print(f"Queued {quality} quality render for job {job.job_id}")
+        return job
+
+    def render(self, job, quality=DEFAULT_QUALITY):
+        """
+        Render a job (or one of its higher quality tiers) in the calling
+        thread. Render nodes call this for every task they lease.
+        """
+        self._register(job)
+        if quality == DEFAULT_QUALITY:
+            job.render_queued_at = job.render_queued_at or time.time()
+            self._process(job)
+        else:
+            self._render_quality(job, quality)
+
+    def abandon(self, job, quality, error):
+        """Give up on a render that no render node managed to finish"""
+        self._register(job)
+        if quality == DEFAULT_QUALITY:
+            self._finish(job, error)
+            return
+        with self._lock:
+            job.pending_qualities.discard(quality)
+        job.quality_errors[quality] = str(error)
+        job.publish_status()
+
+    def cached_code(self, description):
+        """Return cached Gemini code for the description, or None"""
+        generator = get_code_generator()
+        return result_cache.get_code(description, generator.model_name, generator.prompt_version)
+
+    def depth(self):
+        """Number of jobs waiting for a worker"""
+        return self._queue.qsize() + self._generating
+
+    def generating(self):
+        """Number of jobs waiting for or in code generation"""
+        return self._generating
+
+    def active_job_ids(self):
+        """IDs of jobs still queued or rendering in this process, whose files the janitor must keep"""
+        with self._lock:
+            return {job_id for job_id, job in self._jobs.items()
+                    if job.state not in FINAL_STATES or job.pending_qualities}
+
+    def _enqueue(self, job):
+        """Queue a job for code generation, or straight for rendering if it has code (caller holds _lock)"""
+        if job.code is None:
+            self._generating += 1
+            self._codegen_queue.put((job, None))
+        else:
+            job.render_queued_at = time.time()
+            self._queue.put_nowait((job, DEFAULT_QUALITY))
+
+    def _recover_orphans(self):
+        """
+        Requeue the unfinished jobs of server processes that have died, so a
+        restart loses no work. Jobs that no longer fit in the queue fail.
+        """
+        for record in job_store.claim_orphans((QUEUED, GENERATING_CODE, RENDERING)):
+            job = Job.from_record(record)
+            key = normalize_description(job.description)
+            # Quality renders only survive in the render farm's queue
+            job.pending_qualities = {quality for quality in job.pending_qualities
+                                     if self.farm and render_tasks.has(job.job_id, quality)}
+            if self.farm and render_tasks.has(job.job_id, DEFAULT_QUALITY):
+                # Still in the shared queue: a render node will finish it
+                with self._lock:
+                    self._in_flight.setdefault(key, job)
+                    self._jobs[job.job_id] = job
+                    self._prune_history()
+                self._queue.follower.follow(job)
+                continue
+
+            job._state = QUEUED
+            with self._lock:
+                full = self._queue.qsize() + self._generating >= self._queue.maxsize
+                if not full:
+                    job.save()
+                    self._enqueue(job)
+                    self._in_flight.setdefault(key, job)
+                self._jobs[job.job_id] = job
+                self._prune_history()
+            if full:
+                self._finish(job, QueueFullError("Render queue was full when the job was recovered"))
+            else:
+                print(f"Recovered job {job.job_id} from a server process that exited")
+
+    def _register(self, job):
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._prune_history()
+
+    def _complete_from_cache(self, job):
+        """Finish a job using only cached code and video; returns False on any miss"""
+        if job.code is None:
+            job.code = self.cached_code(job.description)
+            if job.code is None:
+                return False
+
+        cached_video = result_cache.get_video(job.code, DEFAULT_QUALITY)
+        if cached_video is None:
+            return False
+
+        self._write_script(job)
+        job.videos[DEFAULT_QUALITY] = self._reuse_video(job, cached_video, DEFAULT_QUALITY)
+        job.cached = True
+        job.state = COMPLETED
+        job.started_at = job.finished_at = time.time()
+        job_seconds.observe(job.finished_at - job.created_at, state=COMPLETED)
+        return True
+
+    def _record_dry_run(self, job):
+        """Attach what the dry run during code generation measured to the job"""
+        result = recorded_dry_run(job.code)
+        if result is not None and result.ok:
+            job.dry_run = result.to_dict()
+
+    def _write_script(self, job):
+        script_path = os.path.join(TEMP_FOLDER, f"{job.job_id}.py")
+        with time_stage('script_write'):
+            with open(script_path, 'w') as f:
+                f.write(job.code)
+        return script_path
+
+    def _reuse_video(self, job, cached_video, quality):
+        """Link a cached render into the job's own video path"""
+        output_path = video_path_for(job.job_id, quality)
+        link_or_copy(cached_video, output_path)
+        return output_path
+
+    def _request_requested_quality(self, job, quality=None):
+        """Queue the tier the client (or a request attached to the job) asked for once the low-quality video exists"""
+        quality = quality or job.quality
+        if quality == DEFAULT_QUALITY or job.state != COMPLETED:
+            return
+        try:
+            self.request_quality(job.job_id, quality)
+        except QueueFullError as e:
+            job.quality_errors[quality] = str(e)
+            print(f"Could not queue {quality} quality render for job {job.job_id}: {str(e)}")
+
+    def _prune_history(self):
+        # Drop the oldest finished jobs once the registry grows past its limit
+        excess = len(self._jobs) - self.history_size
+        if excess <= 0:
+            return
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id].state in FINAL_STATES:
+                del self._jobs[job_id]
+                excess -= 1
+
+    def _ensure_workers(self):
+        # A render node's workers, janitor and recovery are its own (RenderNode.run)
+        if self.render_node:
+            return
+        with self._lock:
+            self._workers = [w for w in self._workers if w.is_alive()]
+            while len(self._workers) < self.num_workers:
+                worker = threading.Thread(
+                    target=self._worker_loop,
+                    name=f"render-worker-{len(self._workers)}",
+                    daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+
+            self._codegen_workers = [w for w in self._codegen_workers if w.is_alive()]
+            while len(self._codegen_workers) < self.num_codegen_workers:
+                worker = threading.Thread(
+                    target=self._codegen_loop,
+                    name=f"codegen-worker-{len(self._codegen_workers)}",
+                    daemon=True
+                )
+                worker.start()
+                self._codegen_workers.append(worker)
+
+        janitor.start(self.active_job_ids)
+
+        with self._lock:
+            recover, self._recovered = not self._recovered, True
+        if recover:
+            self._recover_orphans()
+
+    def _worker_loop(self):
+        while True:
+            job, quality = self._queue.get()
+            try:
+                if quality == DEFAULT_QUALITY:
+                    self._process(job)
+                else:
+                    self._render_quality(job, quality)
+            except Exception as e:
+                # _process records its own failures; this guards the worker itself
+                print(f"Render worker crashed on job {job.job_id}: {str(e)}")
+            finally:
+                self._queue.task_done((job, quality))
+
+    def _codegen_loop(self):
+        while True:
+            job, _ = self._codegen_queue.get()
+            try:
+                self._prepare(job)
+            except Exception as e:
+                print(f"Code generation worker crashed on job {job.job_id}: {str(e)}")
+            finally:
+                self._codegen_queue.task_done((job, None))
+
+    def _prepare(self, job):
+        """Generate a job's code, then pass it on to the render queue"""
+        job.started_at = time.time()
+        stage_seconds.observe(job.started_at - job.created_at, stage='queue_wait')
+        try:
+            job.state = GENERATING_CODE
+            job.code = self._generate_code(job)
+            self._record_dry_run(job)
+        except Exception as e:
+            with self._lock:
+                self._generating -= 1
+            self._finish(job, e)
+            return
+
+        job.render_queued_at = time.time()
+        job.state = QUEUED
+        # May briefly wait if quality renders filled the queue meanwhile
+        self._queue.put((job, DEFAULT_QUALITY))
+        with self._lock:
+            self._generating -= 1
+
+    def _process(self, job):
+        """Render a job whose code is ready"""
+        now = time.time()
+        stage_seconds.observe(now - job.render_queued_at, stage='render_queue_wait')
+        if job.started_at is None:
+            job.started_at = now
+            stage_seconds.observe(now - job.created_at, stage='queue_wait')
+        error = None
+        try:
+            script_path = self._write_script(job)
+            print(f"Saved Manim code to {script_path}")
+
+            job.state = RENDERING
+            # Another job may have rendered the same code while this one waited
+            cached_video = result_cache.get_video(job.code, DEFAULT_QUALITY, count_miss=False)
+            if cached_video is not None:
+                print(f"Reusing cached render for job {job.job_id}")
+                job.videos[DEFAULT_QUALITY] = self._reuse_video(job, cached_video, DEFAULT_QUALITY)
+                job.cached = True
+            elif self._plan_degradations(job).get('last_frame'):
+                # Not even the smallest video makes the deadline: the final frame stands in for it
+                job.resources['preview'] = {}
+                job.preview_path = run_manim(script_path, job.job_id, save_last_frame=True,
+                                             usage=job.resources['preview'])
+            else:
+                if RENDER_PREVIEW and not job.degradations:
+                    # Phase one: the last frame only, published while the video renders
+                    job.resources['preview'] = {}
+                    job.preview_path = render_preview(script_path, job.job_id, usage=job.resources['preview'])
+                    job.publish_status()
+                job.resources[DEFAULT_QUALITY] = {}
+                output_path = run_manim(script_path, job.job_id, usage=job.resources[DEFAULT_QUALITY],
+                                        progress=self._progress_reporter(job, DEFAULT_QUALITY),
+                                        animation_count=job.animation_count, degradations=job.degradations)
+                if not output_path or not os.path.exists(output_path):
+                    raise Exception("Output file not found")
+                # A degraded video must never be served as the full one
+                if not job.degraded_video:
+                    result_cache.put_video(job.code, DEFAULT_QUALITY, output_path)
+                job.videos[DEFAULT_QUALITY] = output_path
+        except Exception as e:
+            error = e
+        self._finish(job, error)
+
+    def _finish(self, job, error=None):
+        """Move a job to its final state and record how long it took"""
+        if error is None:
+            job.state = COMPLETED
+            print(f"Animation generated successfully for job {job.job_id}")
+        else:
+            job.error = f"Error generating animation for job {job.job_id}: {str(error)}"
+            job.state = FAILED
+            print(job.error)
+        job.finished_at = time.time()
+        job_seconds.observe(job.finished_at - job.created_at, state=job.state)
+        if job.deadline_ms is not None:
+            deadlines_total.inc(outcome='met' if job.finished_at <= job.deadline_at else 'missed')
+        self._land(job)
+        if error is None:
+            self._request_requested_quality(job)
+            # On a render farm the node that took the request queues it (_farm_job_finished)
+            if not self.farm and job.rerender and job.degraded_video:
+                self._queue_rerender(job)
+
+    def _farm_job_finished(self, job):
+        """Called on the node that took a request once a render node has finished its job"""
+        self._land(job)
+        if job.state == COMPLETED and job.rerender and job.degraded_video and job.rerender_job_id is None:
+            self._queue_rerender(job)
+
+    def planned_degradations(self, job):
+        """
+        The degradations the job's low quality video gets, or would get if
+        a worker picked it up now: the plan is only made for good then (see
+        _plan_degradations), once the wait in the queue is known.
+
+        Returns:
+            dict: The degradations, or None without a deadline or while the job has no code to estimate
+        """
+        if job.degradations is not None:
+            return job.degradations
+        if job.deadline_ms is None or job.code is None:
+            return None
+        return plan_degradations(job.code, job.deadline_at - time.time(), job.dry_run, preview=RENDER_PREVIEW)
+
+    def _plan_degradations(self, job):
+        """
+        Decide how to render the job's low quality video to make its deadline,
+        from the time left (which already reflects how long it waited in the
+        queue) and its estimated render cost. Returns job.degradations.
+        """
+        if job.deadline_ms is None:
+            job.degradations = None
+            return {}
+        job.degradations = plan_degradations(job.code, job.deadline_at - time.time(), job.dry_run,
+                                             preview=RENDER_PREVIEW)
+        for degradation in job.degradations:
+            deadline_degradations_total.inc(degradation=degradation)
+        if job.degradations:
+            print(f"Degrading job {job.job_id} to make its deadline: {job.degradations}")
+        return job.degradations
+
+    def _queue_rerender(self, job):
+        """Queue a full render of a degraded job as a batch job; its video replaces the degraded one"""
+        try:
+            rerender = self.submit(job.description, code=job.code, priority=BATCH, client=job.client)
+        except QueueFullError as e:
+            print(f"Could not queue a full render of degraded job {job.job_id}: {str(e)}")
+            return
+        self._reload(job)
+        job.rerender_job_id = rerender.job_id
+        job.save()
+        print(f"Queued full render of degraded job {job.job_id} as job {rerender.job_id}")
+        rerender.add_done_callback(lambda rerender: self._take_rerender(job, rerender))
+
+    def _take_rerender(self, job, rerender):
+        if rerender.state != COMPLETED or rerender.output_path is None:
+            print(f"Full render of degraded job {job.job_id} failed: {rerender.error}")
+            return
+        self._reload(job)
+        job.videos[DEFAULT_QUALITY] = self._reuse_video(job, rerender.output_path, DEFAULT_QUALITY)
+        job.degradations = {}
+        job.publish_status()
+        print(f"Replaced the degraded video of job {job.job_id} with a full render")
+
+    def _reload(self, job):
+        """
+        On a render farm, take over what other nodes saved for a finished job
+        (higher quality renders, say) before changing and saving it here.
+        """
+        if not self.farm:
+            return
+        try:
+            record = job_store.get(job.job_id)
+        except sqlite3.Error as e:
+            print(f"Could not reload job {job.job_id} from the job store: {str(e)}")
+            return
+        if record is not None:
+            job.refresh(record)
+
+    def _render_quality(self, job, quality):
+        """Render an already completed job's stored script at a higher quality tier"""
+        try:
+            # Rewritten from the stored code: the janitor may have removed the script since
+            script_path = self._write_script(job)
+            job.resources[quality] = {}
+            output_path = run_manim(script_path, job.job_id, quality=quality, usage=job.resources[quality],
+                                    progress=self._progress_reporter(job, quality),
+                                    animation_count=job.animation_count)
+            if not output_path or not os.path.exists(output_path):
+                raise Exception("Output file not found")
+            result_cache.put_video(job.code, quality, output_path)
+            job.videos[quality] = output_path
+            print(f"Rendered {quality} quality video for job {job.job_id}")
+        except Exception as e:
+            job.quality_errors[quality] = str(e)
+            print(f"Error rendering {quality} quality video for job {job.job_id}: {str(e)}")
+        finally:
+            with self._lock:
+                job.pending_qualities.discard(quality)
+            job.publish_status()
+
+    def _progress_reporter(self, job, phase):
+        """Progress callback for run_manim, scaled by the scene's estimated animation count"""
+        total = job.animation_count
+
+        def report(event):
+            job.report_render_event(phase, event, total)
+            if self.farm and event["event"] == ANIMATION_STARTED:
+                # The API node that took the request follows the render through the job store
+                job.save()
+        return report
+
+    def _land(self, job):
+        """Detach a finished job from the single-flight table"""
+        key = normalize_description(job.description)
+        with self._lock:
+            if self._in_flight.get(key) is job:
+                del self._in_flight[key]
+
+    def _generate_code(self, job):
+        """Return cached code for the description, or generate (and cache) it"""
+        generator = get_code_generator()
+        model, prompt_version = generator.model_name, generator.prompt_version
+
+        # submit() already counted the miss; this only catches code cached since then
+        code = result_cache.get_code(job.description, model, prompt_version, count_miss=False)
+        if code is not None:
+            print(f"Reusing cached Manim code for job {job.job_id}")
+            return code
+
+        with time_stage('code_generation'):
+            code, source = generate_manim_code(job.description, job.job_id)
+        print(f"Generated Manim code for job {job.job_id} ({source})")
+        # Template fallbacks are cheap and shouldn't pin a failed Gemini call in the cache
+        if source == SOURCE_GEMINI:
+            result_cache.put_code(job.description, model, prompt_version, code)
+        return code
+
+
+# Shared queue used by the API blueprint
+job_queue = JobQueue()
+
+registry.gauge('queue_depth', 'Jobs waiting for a render worker, including those still generating code',
+               function=job_queue.depth)
+registry.gauge('codegen_jobs', 'Jobs waiting for or in code generation', function=job_queue.generating)
@@ -0,0 +1,128 @@
+import os
+import resource
+import signal
+import subprocess
+import time
+
+from backend.manim_output import RenderStalled
+
+# Configuration (0 disables a limit)
+RENDER_MAX_MEMORY_MB = int(os.environ.get('RENDER_MAX_MEMORY_MB', '4096'))
+RENDER_MAX_CPU_SECONDS = int(os.environ.get('RENDER_MAX_CPU_SECONDS', '300'))
+RENDER_MAX_FILE_MB = int(os.environ.get('RENDER_MAX_FILE_MB', '512'))
+
+MB = 1024 * 1024
+
+
+def _set_limit(limit, value, keep_hard=False):
+    """Lower a limit to `value`, never above an existing hard limit"""
+    _, hard = resource.getrlimit(limit)
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    resource.setrlimit(limit, (value, hard if keep_hard else value))
+
+
+def apply_render_limits():
+    """
+    Cap memory, CPU time and output file size for the current process.
+
+    Inherited by ffmpeg and any other children Manim starts. Used as the
+    preexec_fn of render subprocesses and at the start of warm workers.
+    """
+    if RENDER_MAX_MEMORY_MB:
+        _set_limit(resource.RLIMIT_AS, RENDER_MAX_MEMORY_MB * MB)
+    if RENDER_MAX_FILE_MB:
+        _set_limit(resource.RLIMIT_FSIZE, RENDER_MAX_FILE_MB * MB)
+        # Fail the write with EFBIG instead of killing the process outright
+        signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+    allow_cpu_seconds(RENDER_MAX_CPU_SECONDS)
+
+
+def allow_cpu_seconds(seconds):
+    """
+    Let the current process use `seconds` more CPU time before SIGXCPU kills it.
+
+    Only the soft limit moves, so a long-lived warm worker can grant each
+    job a fresh budget.
+    """
+    if seconds:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        _set_limit(resource.RLIMIT_CPU, int(usage.ru_utime + usage.ru_stime + seconds) + 1, keep_hard=True)
+
+
+def kill_process_group(pgid):
+    """Kill a render's whole process group (Manim plus the ffmpeg it spawned)"""
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def wait_with_usage(process, timeout, stalled=None):
+    """
+    Wait for a Popen process and return the rusage of it and its reaped children.
+
+    Polls with WNOHANG rather than blocking in wait4 so it stays cooperative
+    under gevent.
+
+    Returns:
+        dict: peak_rss_mb and cpu_seconds of the render
+
+    Raises:
+        subprocess.TimeoutExpired: If the process is still running after `timeout` seconds
+        RenderStalled: If `stalled()` turns true first
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+        if pid:
+            process.returncode = os.waitstatus_to_exitcode(status)
+            return usage_dict(usage)
+        if time.monotonic() > deadline:
+            raise subprocess.TimeoutExpired(process.args, timeout)
+        if stalled is not None and stalled():
+            raise RenderStalled("Manim stopped producing output")
+        time.sleep(0.05)
+
+
+def usage_dict(usage):
+    # ru_maxrss is reported in kilobytes on Linux
+    return {
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+        "cpu_seconds": round(usage.ru_utime + usage.ru_stime, 2),
+    }
+
+
+def reset_peak_rss():
+    """Reset this process's peak RSS so the next reading covers one job (Linux, best effort)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def current_usage():
+    """
+    Peak RSS of this process since the last reset_peak_rss(), and CPU
+    seconds used so far by it and its reaped children (ffmpeg).
+
+    Returns:
+        dict: peak_rss_mb and cpu_seconds
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is the lifetime peak; VmHWM honours the reset
+    peak_kb = own.ru_maxrss
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    peak_kb = int(line.split()[1])
+                    break
+    except OSError:
+        pass
+    return {
+        "peak_rss_mb": round(peak_kb / 1024, 1),
+        "cpu_seconds": round(own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime, 2),
+    }
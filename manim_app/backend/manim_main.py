@@ -0,0 +1,13 @@
+"""
+Manim's command line with the shared scene cache installed.
+
+Subprocess renders run `python3 -m backend.manim_main` with the same
+arguments they would pass to `python3 -m manim`.
+"""
+from backend.scene_cache import install_scene_cache, scene_cache
+
+if __name__ == '__main__':
+    install_scene_cache(scene_cache)
+
+    from manim.__main__ import main
+    main()
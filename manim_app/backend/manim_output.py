@@ -0,0 +1,109 @@
+import os
+import re
+import threading
+import time
+from collections import deque
+
+# Configuration
+RENDER_OUTPUT_TAIL_LINES = int(os.environ.get('RENDER_OUTPUT_TAIL_LINES', '200'))
+# A render that prints nothing for this long is considered hung (0 disables)
+RENDER_STALL_SECONDS = int(os.environ.get('RENDER_STALL_SECONDS', '60'))
+
+# "Animation 3: Create(Circle):  45%|..." (progress bar) or "Animation 3 : Using cached data" (log)
+ANIMATION_LINE = re.compile(r'Animation (\d+)\s?:')
+PROGRESS_BAR = re.compile(r'Animation \d+: (.+?):\s+\d+%')
+# Manim quotes the path; Rich's log handler may pad the line and append a "scene_file_writer.py:527" column
+PARTIAL_MOVIE = re.compile(r"Partial movie file written in\s+(?:'(?P<quoted>[^']+)'|(?P<bare>\S+))")
+# "File ready at '/app/media/videos/<job_id>/480p15/ManimScene.mp4'", the render's final output
+FILE_READY = re.compile(r"File ready at\s+(?:'(?P<quoted>[^']+)'|(?P<bare>\S+))")
+
+# Structured events passed to on_event
+ANIMATION_STARTED = 'animation_started'
+ANIMATION_FINISHED = 'animation_finished'
+PARTIAL_MOVIE_WRITTEN = 'partial_movie_written'
+
+
+def _path(match):
+    """The path a PARTIAL_MOVIE or FILE_READY match found"""
+    return match.group('quoted') or match.group('bare')
+
+
+class RenderStalled(Exception):
+    """Raised when a render stops producing output long before its timeout"""
+
+
+class ManimOutputParser:
+    """
+    Incremental parser for Manim's stdout/stderr.
+
+    Lines are fed as they arrive (from one or more reader threads). Only the
+    last `tail_lines` lines are kept, for error messages, so memory stays
+    flat however chatty the scene is. Animation starts and finishes and
+    partial movie writes are turned into event dicts for `on_event`.
+    """
+
+    def __init__(self, on_event=None, tail_lines=RENDER_OUTPUT_TAIL_LINES, stall_seconds=RENDER_STALL_SECONDS):
+        self.on_event = on_event
+        self.stall_seconds = stall_seconds
+        self.partial_movies = 0
+        # Output file Manim reported, if any
+        self.output_path = None
+        self._tail = deque(maxlen=tail_lines)
+        self._current = None
+        self._current_started_at = None
+        self._last_output_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def feed(self, line):
+        line = line.rstrip('\n')
+        if not line:
+            return
+        with self._lock:
+            self._tail.append(line)
+            self._last_output_at = time.monotonic()
+
+            match = ANIMATION_LINE.search(line)
+            if match and (self._current is None or int(match.group(1)) > self._current):
+                self._finish_current()
+                name = PROGRESS_BAR.search(line)
+                self._current = int(match.group(1))
+                self._current_started_at = time.monotonic()
+                self._emit(ANIMATION_STARTED, name=name.group(1) if name else None)
+
+            partial = PARTIAL_MOVIE.search(line)
+            if partial:
+                self.partial_movies += 1
+                self._emit(PARTIAL_MOVIE_WRITTEN, path=_path(partial))
+
+            ready = FILE_READY.search(line)
+            if ready:
+                self.output_path = _path(ready)
+
+    def read_stream(self, stream):
+        """Feed every line of a text stream until EOF (the target of a reader thread)"""
+        for line in stream:
+            self.feed(line)
+
+    def finish(self):
+        """Close the animation still running when the output ended"""
+        with self._lock:
+            self._finish_current()
+
+    def tail(self, max_chars=4000):
+        with self._lock:
+            return '\n'.join(self._tail)[-max_chars:]
+
+    def is_stalled(self):
+        if not self.stall_seconds:
+            return False
+        with self._lock:
+            return time.monotonic() - self._last_output_at > self.stall_seconds
+
+    def _finish_current(self):
+        if self._current_started_at is not None:
+            self._emit(ANIMATION_FINISHED, seconds=round(time.monotonic() - self._current_started_at, 3))
+            self._current_started_at = None
+
+    def _emit(self, event, **data):
+        if self.on_event is not None:
+            self.on_event({"event": event, "animation": self._current, **data})
@@ -0,0 +1,126 @@
+"""
+A render node of the render farm: renders jobs from the shared render
+queue (see backend/farm.py) until stopped.
+
+    python3 -m backend.render_node --workers 2
+
+Run as many as the hardware allows, next to API nodes started with
+RENDER_FARM=1. Every node must see the same media directory and job
+database (data/jobs.db) at the same path.
+"""
+import argparse
+import sqlite3
+import threading
+import time
+
+from backend.farm import FARM_HEARTBEAT_SECONDS, FARM_MAX_DELIVERIES, FARM_POLL_SECONDS, render_tasks
+from backend.janitor import janitor
+from backend.jobs import Job, JobQueue, RENDER_WORKERS, DEFAULT_QUALITY, FINAL_STATES
+from backend.job_store import job_store, process_owner
+
+
+class RenderNode:
+    """
+    Worker threads leasing renders from the shared queue, plus a heartbeat
+    thread renewing the leases of the renders in progress. A render that
+    fails is finished like any other (the job fails); only a node that dies
+    or stalls past its lease leaves the render to be delivered again.
+    """
+
+    def __init__(self, num_workers=RENDER_WORKERS, tasks=render_tasks, heartbeat=FARM_HEARTBEAT_SECONDS,
+                 max_deliveries=FARM_MAX_DELIVERIES):
+        self.num_workers = max(1, num_workers)
+        self.tasks = tasks
+        self.heartbeat = heartbeat
+        self.max_deliveries = max_deliveries
+        self.owner = process_owner()
+        # Quality renders a node asks for go back to the shared queue rather than to local workers
+        self.queue = JobQueue(render_node=True)
+        # (job_id, quality) -> RenderTask being rendered
+        self._held = {}
+        self._lock = threading.Lock()
+
+    def run(self):
+        janitor.start(self.queue.active_job_ids)
+        threads = [threading.Thread(target=self._heartbeat_loop, name="lease-heartbeat", daemon=True)]
+        threads += [threading.Thread(target=self._worker_loop, name=f"render-node-worker-{i}", daemon=True)
+                    for i in range(self.num_workers)]
+        for thread in threads:
+            thread.start()
+        print(f"Render node {self.owner} started with {self.num_workers} workers")
+        for thread in threads:
+            thread.join()
+
+    def _worker_loop(self):
+        while True:
+            try:
+                task = self.tasks.lease(self.owner)
+            except sqlite3.Error as e:
+                print(f"Could not lease a render: {str(e)}")
+                task = None
+            if task is None:
+                time.sleep(FARM_POLL_SECONDS)
+                continue
+
+            with self._lock:
+                self._held[(task.job_id, task.quality)] = task
+            try:
+                self._work(task)
+            except Exception as e:
+                print(f"Render node worker crashed on {task}: {str(e)}")
+            finally:
+                with self._lock:
+                    del self._held[(task.job_id, task.quality)]
+                self._complete(task)
+
+    def _complete(self, task):
+        """Remove a finished task; if that keeps failing, its lease runs out and a node skips it as done"""
+        for attempt in range(3):
+            try:
+                self.tasks.complete(task, self.owner)
+                return
+            except sqlite3.Error as e:
+                print(f"Could not remove finished render {task} (attempt {attempt + 1}): {str(e)}")
+                time.sleep(FARM_POLL_SECONDS)
+
+    def _work(self, task):
+        record = job_store.get(task.job_id)
+        if record is None:
+            print(f"Dropping render of job {task.job_id}, which no longer exists")
+            return
+        job = Job.from_record(record)
+
+        # A node that finished the render may have died before removing the task
+        if task.quality == DEFAULT_QUALITY and job.state in FINAL_STATES:
+            return
+        if task.quality != DEFAULT_QUALITY and task.quality in job.videos:
+            return
+
+        if task.deliveries > self.max_deliveries:
+            self.queue.abandon(job, task.quality, Exception(
+                f"Render abandoned after {task.deliveries - 1} render nodes stopped while rendering it"))
+            return
+        if task.deliveries > 1:
+            print(f"Rendering {task} again (delivery {task.deliveries})")
+
+        job.render_queued_at = task.enqueued_at
+        self.queue.render(job, task.quality)
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(self.heartbeat)
+            with self._lock:
+                held = list(self._held.values())
+            for task in held:
+                try:
+                    if not self.tasks.renew(task, self.owner):
+                        print(f"Lost the lease on {task}; another render node may render it again")
+                except sqlite3.Error as e:
+                    print(f"Could not renew the lease on {task}: {str(e)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render jobs from the shared render queue')
+    parser.add_argument('--workers', type=int, default=RENDER_WORKERS, help='Renders to run at once')
+    args = parser.parse_args()
+    RenderNode(num_workers=args.workers).run()
@@ -0,0 +1,320 @@
+import importlib.util
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import traceback
+
+from backend.manim_output import ANIMATION_STARTED, ANIMATION_FINISHED
+from backend.validation import touches_shared_state
+from backend.limits import (apply_render_limits, allow_cpu_seconds, current_usage, kill_process_group,
+                            reset_peak_rss, RENDER_MAX_CPU_SECONDS)
+
+# Configuration
+RENDER_POOL_SIZE = int(os.environ.get('RENDER_POOL_SIZE', os.environ.get('RENDER_WORKERS', '2')))
+RENDER_POOL_MAX_JOBS = int(os.environ.get('RENDER_POOL_MAX_JOBS', '50'))
+RENDER_POOL_MAX_RSS_MB = int(os.environ.get('RENDER_POOL_MAX_RSS_MB', '1536'))
+
+
+class RenderTimeout(Exception):
+    """Raised when a warm worker does not finish a render in time"""
+
+
+def _render_in_process(script_path, media_dir, save_last_frame=False, quality='low_quality', on_event=None):
+    """
+    Load the generated ManimScene module and render it with a fresh config.
+
+    Runs inside a worker process, so manim is already imported. `on_event`
+    gets the same animation started/finished events ManimOutputParser
+    extracts from a subprocess render.
+    """
+    from manim import tempconfig
+
+    module_name = os.path.splitext(os.path.basename(script_path))[0]
+
+    # Load the script under a private name so jobs never share module state
+    spec = importlib.util.spec_from_file_location(f"manim_job_{module_name.replace('-', '_')}", script_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    if not hasattr(module, 'ManimScene'):
+        raise Exception(f"No ManimScene class found in {script_path}")
+
+    # tempconfig restores the global config afterwards, so every job starts from defaults.
+    # input_file determines the module_name part of the output directory.
+    with tempconfig({
+        "input_file": script_path,
+        "media_dir": media_dir,
+        "quality": quality,
+        "scene_names": ["ManimScene"],
+        "progress_bar": "none",
+        "save_last_frame": save_last_frame,
+    }):
+        scene = module.ManimScene()
+        if on_event is not None:
+            _report_plays(scene, on_event)
+        scene.render()
+        file_writer = scene.renderer.file_writer
+        return str(file_writer.image_file_path if save_last_frame else file_writer.movie_file_path)
+
+
+def _report_plays(scene, on_event):
+    """Wrap scene.play so every animation is reported (self.wait() goes through play too)"""
+    original_play = scene.play
+    index = -1
+
+    def play(*args, **kwargs):
+        nonlocal index
+        index += 1
+        name = type(args[0]).__name__ if args else None
+        on_event({"event": ANIMATION_STARTED, "animation": index, "name": name})
+        started_at = time.monotonic()
+        try:
+            return original_play(*args, **kwargs)
+        finally:
+            on_event({"event": ANIMATION_FINISHED, "animation": index,
+                      "seconds": round(time.monotonic() - started_at, 3)})
+
+    scene.play = play
+
+
+def _dry_run(script_path):
+    """The report backend.dry_run's child would print: an exception in the scene is a finding, not a failure"""
+    from backend.dry_run import _dry_run_in_process, _describe_error
+    try:
+        return _dry_run_in_process(script_path)
+    except MemoryError:
+        raise
+    except Exception as e:
+        return {"error": _describe_error(e, script_path)}
+
+
+def _worker_main(conn, media_dir):
+    """Worker process loop: import manim once, then render jobs sent over the pipe"""
+    import manim  # noqa: F401 - the whole point of a warm worker
+    from backend.scene_cache import install_scene_cache, scene_cache
+    install_scene_cache(scene_cache)
+
+    # Own process group, so a timeout can take down the ffmpeg children too
+    os.setsid()
+    apply_render_limits()
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+
+        script_path, save_last_frame, quality, dry_run = request
+        reset_peak_rss()
+        allow_cpu_seconds(RENDER_MAX_CPU_SECONDS)
+        before = current_usage()
+        try:
+            if dry_run:
+                status, payload = "ok", _dry_run(script_path)
+            else:
+                output_path = _render_in_process(script_path, media_dir, save_last_frame, quality,
+                                                 on_event=lambda event: conn.send(("progress", event, None)))
+                status, payload = "ok", output_path
+        except MemoryError:
+            status, payload = "error", "MemoryError: render exceeded the memory limit"
+        except Exception as e:
+            status, payload = "error", f"{type(e).__name__}: {str(e)}\n{traceback.format_exc(limit=5)}"
+        usage = current_usage()
+        usage["cpu_seconds"] = round(usage["cpu_seconds"] - before["cpu_seconds"], 2)
+        conn.send((status, payload, usage))
+
+
+class RenderWorker:
+    """A single warm render process and the pipe used to talk to it"""
+
+    def __init__(self, ctx, media_dir):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, media_dir), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs_done = 0
+        self.peak_rss_mb = 0
+        self.last_usage = None
+        # Set once a script may have changed module state later renders would inherit
+        self.tainted = False
+
+    def render(self, script_path, timeout, save_last_frame=False, quality='low_quality', progress=None,
+               dry_run=False):
+        """
+        Render one script in the worker process.
+
+        Progress messages from the worker are passed to `progress` until the
+        final result arrives.
+
+        Returns:
+            str: Path of the rendered video (or last-frame PNG); with
+                `dry_run`, the dry run's report (see backend/dry_run.py)
+
+        Raises:
+            RenderTimeout: If the worker doesn't answer within `timeout` seconds
+        """
+        self.last_usage = None
+        self.conn.send((script_path, save_last_frame, quality, dry_run))
+        deadline = time.monotonic() + timeout
+        while True:
+            if not self.conn.poll(max(0, deadline - time.monotonic())):
+                raise RenderTimeout(f"Manim execution timed out after {timeout} seconds")
+            status, payload, usage = self.conn.recv()
+            if status != "progress":
+                break
+            if progress is not None:
+                progress(payload)
+
+        self.last_usage = usage
+        self.peak_rss_mb = max(self.peak_rss_mb, self.last_usage["peak_rss_mb"])
+        self.jobs_done += 1
+        if status != "ok":
+            raise Exception(f"Manim execution failed: {payload}")
+        return payload
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def stop(self):
+        """Ask the worker to exit, killing it if it doesn't"""
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.kill()
+        self.conn.close()
+
+    def kill(self):
+        kill_process_group(self.process.pid)
+        self.process.kill()
+        self.process.join()
+
+
+class RenderPool:
+    """
+    Pool of persistent render processes that import manim once.
+
+    Workers are forked from a forkserver that has already imported manim, so
+    both the first job and every recycled replacement start warm. A worker is
+    recycled after `max_jobs` renders or once its peak RSS passes `max_rss_mb`,
+    and killed outright when a render times out.
+
+    Scripts share their worker's modules with the renders after them, so a
+    worker is also recycled after any script that may change state outside
+    its own objects (see backend.validation.touches_shared_state). That
+    check is static; deployments rendering scenes from untrusted sources
+    should set RENDER_POOL_MAX_JOBS=1 (or use the subprocess backend) for
+    one process per render.
+    """
+
+    def __init__(self, media_dir, size=RENDER_POOL_SIZE, max_jobs=RENDER_POOL_MAX_JOBS,
+                 max_rss_mb=RENDER_POOL_MAX_RSS_MB):
+        self.media_dir = media_dir
+        self.size = max(1, size)
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self._ctx = None
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        """Pre-fork the workers (called lazily by render)"""
+        with self._lock:
+            if self._started:
+                return
+            self._ctx = multiprocessing.get_context('forkserver')
+            self._ctx.set_forkserver_preload(['manim', __name__])
+            for _ in range(self.size):
+                self._idle.put(RenderWorker(self._ctx, self.media_dir))
+            self._started = True
+            print(f"Started render pool with {self.size} warm workers")
+
+    def render(self, script_path, timeout=120, save_last_frame=False, quality='low_quality', usage=None,
+               progress=None, dry_run=False):
+        """
+        Render a script on the next idle warm worker.
+
+        Args:
+            script_path (str): Path of the generated Manim script
+            timeout (int): Seconds to wait before killing the worker
+            save_last_frame (bool): Render only the final frame as a PNG
+            quality (str): Manim quality name, e.g. 'low_quality'
+            usage (dict, optional): Filled with the job's peak_rss_mb and cpu_seconds
+            progress (callable, optional): Called with each animation started/finished event
+            dry_run (bool): Run construct() with animations skipped instead (see dry_run)
+
+        Returns:
+            str: Path of the rendered video (or last-frame PNG)
+        """
+        self.start()
+        with open(script_path) as f:
+            tainting = touches_shared_state(f.read())
+        worker = self._idle.get()
+        try:
+            if not worker.is_alive():
+                worker = RenderWorker(self._ctx, self.media_dir)
+            worker.tainted = worker.tainted or tainting
+            try:
+                return worker.render(script_path, timeout, save_last_frame, quality, progress, dry_run)
+            finally:
+                if usage is not None and worker.last_usage:
+                    usage.update(worker.last_usage)
+        except RenderTimeout:
+            # The worker is stuck mid-render; it can't be reused
+            worker.kill()
+            worker = None
+            raise
+        except (EOFError, BrokenPipeError, OSError) as e:
+            # The worker died mid-render (e.g. a segfault in cairo, or SIGXCPU from the CPU limit)
+            worker.kill()
+            exitcode = worker.process.exitcode
+            worker = None
+            if exitcode is not None and exitcode < 0:
+                raise Exception(f"Render worker was killed by {signal.Signals(-exitcode).name}")
+            raise Exception(f"Render worker exited unexpectedly: {type(e).__name__} {str(e)}")
+        finally:
+            self._release(worker)
+
+    def dry_run(self, script_path, timeout):
+        """
+        Dry-run a script on the next idle warm worker, so it doesn't pay for
+        importing Manim.
+
+        Returns:
+            dict: The report: duration and animation_count, or the error the scene raised
+
+        Raises:
+            RenderTimeout: If construct() doesn't finish within `timeout` seconds
+        """
+        return self.render(script_path, timeout=timeout, dry_run=True)
+
+    def _release(self, worker):
+        if (worker is not None and not worker.tainted and worker.jobs_done < self.max_jobs
+                and worker.peak_rss_mb < self.max_rss_mb):
+            self._idle.put(worker)
+            return
+
+        if worker is not None:
+            reason = ", after a script that changed shared state" if worker.tainted else ""
+            print(f"Recycling render worker after {worker.jobs_done} jobs ({worker.peak_rss_mb:.0f} MB peak RSS)"
+                  f"{reason}")
+            worker.stop()
+        self._idle.put(RenderWorker(self._ctx, self.media_dir))
+
+    def shutdown(self):
+        """Stop all idle workers"""
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().stop()
+                except queue.Empty:
+                    break
+            self._started = False
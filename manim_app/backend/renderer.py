@@ -0,0 +1,442 @@
+import glob
+import os
+import shutil
+import signal
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.render_pool import RenderPool, RenderTimeout
+from backend.metrics import time_stage, render_failures_total
+from backend.limits import apply_render_limits, kill_process_group, wait_with_usage
+from backend.manim_output import ManimOutputParser, RenderStalled, ANIMATION_STARTED
+from backend.scene_cache import scene_cache
+
+# Configuration
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MEDIA_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'media')
+TEMP_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'utils', 'temp')
+
+# 'subprocess' starts a fresh `python3 -m manim` per job; 'pool' renders on warm worker processes
+RENDER_BACKEND = os.environ.get('RENDER_BACKEND', 'subprocess')
+RENDER_TIMEOUT = int(os.environ.get('RENDER_TIMEOUT', '120'))
+PREVIEW_TIMEOUT = int(os.environ.get('PREVIEW_TIMEOUT', '30'))
+# Manim processes one long scene's render is split across (0 or 1 renders every scene in one process)
+RENDER_SEGMENTS = int(os.environ.get('RENDER_SEGMENTS', '0'))
+# Fewest animations per segment; Manim reads `-n 0,0` as "no upper bound", so never fewer than 2
+RENDER_SEGMENT_MIN_ANIMATIONS = max(2, int(os.environ.get('RENDER_SEGMENT_MIN_ANIMATIONS', '4')))
+
+# Quality tiers: Manim's -q<tier> flag -> (config quality name, output directory)
+QUALITY_TIERS = {
+    'l': ('low_quality', '480p15'),
+    'm': ('medium_quality', '720p30'),
+    'h': ('high_quality', '1080p60'),
+    'k': ('fourk_quality', '2160p60'),
+}
+DEFAULT_QUALITY = 'l'
+
+# Warm render pool, created on first use
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+class RenderError(Exception):
+    """A failed render, with a short `cause` for the failure metrics"""
+
+    def __init__(self, message, cause='scene_error'):
+        super().__init__(message)
+        self.cause = cause
+
+def get_render_pool():
+    """Return the shared warm render pool, creating it if needed"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = RenderPool(MEDIA_FOLDER)
+        return _render_pool
+
+def resolution_dir(quality=DEFAULT_QUALITY, degradations=None):
+    """
+    Name of the directory Manim renders into, <height>p<frame rate>: the
+    quality tier's, unless `degradations` lower the resolution or frame rate
+    """
+    resolution = QUALITY_TIERS[quality][1]
+    if not degradations:
+        return resolution
+    height, frame_rate = resolution.split('p')
+    if degradations.get('resolution'):
+        height = degradations['resolution'].split('x')[1]
+    return f"{height}p{float(degradations.get('frame_rate', frame_rate)):g}"
+
+def video_path_for(job_id, quality=DEFAULT_QUALITY, media_dir=MEDIA_FOLDER, degradations=None):
+    """Where Manim writes the render of a job's script at the given quality tier"""
+    return os.path.join(media_dir, 'videos', job_id, resolution_dir(quality, degradations), 'ManimScene.mp4')
+
+def find_image(job_id):
+    """Find the last-frame PNG Manim wrote for a job (its name includes the Manim version)"""
+    images = sorted(glob.glob(os.path.join(MEDIA_FOLDER, 'images', job_id, 'ManimScene*.png')))
+    return images[-1] if images else None
+
+def run_manim(script_path, job_id, save_last_frame=False, quality=DEFAULT_QUALITY, usage=None, progress=None,
+              animation_count=None, degradations=None):
+    """
+    Run Manim to generate the animation
+    
+    With save_last_frame=True only the final frame is rendered (Manim's -s),
+    which is much faster and is used for previews; the PNG path is returned.
+    `quality` is one of the QUALITY_TIERS keys. Renders run under the memory,
+    CPU and file-size limits from backend/limits.py; pass a dict as `usage`
+    to get the render's peak_rss_mb and cpu_seconds. `progress` is called
+    with the structured events of backend/manim_output.py (animation
+    started/finished, partial movie written) as the render advances.
+    
+    With RENDER_SEGMENTS set, scenes with enough animations (the estimated
+    `animation_count`) are rendered in parallel segments; see
+    run_manim_segmented.
+    
+    `degradations` (see backend/scheduler.py) lower the frame rate and
+    resolution of the tier, to make a deadline; such renders always run in
+    a subprocess of their own.
+    """
+    segments = [(0, None)]
+    if animation_count and not save_last_frame and not degradations and RENDER_BACKEND != 'pool':
+        segments = plan_segments(animation_count)
+    
+    if len(segments) > 1:
+        def render(*args):
+            return run_manim_segmented(*args, segments=segments)
+    elif degradations:
+        def render(*args):
+            return run_manim_subprocess(*args, degradations=degradations)
+    else:
+        render = run_manim_warm if RENDER_BACKEND == 'pool' else run_manim_subprocess
+    try:
+        with time_stage('preview_render' if save_last_frame else 'manim_render'):
+            output_path = render(script_path, job_id, save_last_frame, quality, usage, progress)
+    except RenderError as e:
+        render_failures_total.inc(cause=e.cause)
+        raise
+    if not save_last_frame:
+        _harvest_partials(script_path, quality, degradations=degradations)
+    return output_path
+
+def _harvest_partials(script_path, quality, media_dir=MEDIA_FOLDER, degradations=None):
+    """
+    Add the partial movies of a finished render to the shared scene cache,
+    then delete them: the job only needs its final MP4
+    """
+    script_name = os.path.splitext(os.path.basename(script_path))[0]
+    resolution = resolution_dir(quality, degradations)
+    partials_root = os.path.join(media_dir, 'videos', script_name, resolution, 'partial_movie_files')
+    try:
+        stored, reused = scene_cache.harvest_partials(os.path.join(partials_root, 'ManimScene'), resolution)
+        print(f"Scene cache: {reused} partial movies reused, {stored} stored")
+    except OSError as e:
+        # The render itself succeeded; a cache failure only costs later renders
+        print(f"Could not add partial movies of {script_name} to the scene cache: {str(e)}")
+    shutil.rmtree(partials_root, ignore_errors=True)
+
+def render_preview(script_path, job_id, usage=None):
+    """
+    Render just the last frame of the scene as a quick preview
+    
+    Returns:
+        str: Path of the PNG, or None if the preview could not be rendered
+    """
+    try:
+        return run_manim(script_path, job_id, save_last_frame=True, usage=usage)
+    except Exception as e:
+        # The full render reports the real error; a missing preview isn't fatal
+        print(f"Preview render failed for job {job_id}: {str(e)}")
+        return None
+
+def run_manim_warm(script_path, job_id, save_last_frame=False, quality=DEFAULT_QUALITY, usage=None, progress=None):
+    """Render the script in-process on a warm pool worker"""
+    try:
+        print(f"Rendering job {job_id} on the warm render pool")
+        timeout = PREVIEW_TIMEOUT if save_last_frame else RENDER_TIMEOUT
+        output_path = get_render_pool().render(script_path, timeout=timeout, save_last_frame=save_last_frame,
+                                               quality=QUALITY_TIERS[quality][0], usage=usage, progress=progress)
+        
+        with time_stage('file_discovery'):
+            if not os.path.exists(output_path):
+                raise RenderError(f"Output file not found at {output_path}", 'output_missing')
+        
+        print(f"Manim execution successful. Output at: {output_path}")
+        return output_path
+        
+    except Exception as e:
+        error_msg = f"Error running Manim: {str(e)}"
+        print(error_msg)
+        raise RenderError(error_msg, _warm_failure_cause(e))
+
+def _warm_failure_cause(error):
+    """Classify a warm pool failure for the metrics"""
+    message = str(error)
+    if isinstance(error, RenderError):
+        return error.cause
+    if isinstance(error, RenderTimeout):
+        return 'timeout'
+    if 'MemoryError' in message:
+        return 'memory_limit'
+    if 'SIGXCPU' in message:
+        return 'cpu_limit'
+    if 'Render worker' in message:
+        return 'worker_crashed'
+    return 'scene_error'
+
+
+def plan_segments(animation_count, segments=RENDER_SEGMENTS, min_animations=RENDER_SEGMENT_MIN_ANIMATIONS):
+    """
+    Split a scene's animations into contiguous ranges to render in parallel.
+    
+    Returns:
+        list: (first, last) animation numbers of each segment, inclusive. The
+            last segment is open-ended (last is None) since the count is only
+            an estimate. A single segment means the scene isn't split.
+    """
+    count = min(segments, animation_count // min_animations)
+    if count < 2:
+        return [(0, None)]
+    bounds = [round(i * animation_count / count) for i in range(count + 1)]
+    return [(bounds[i], bounds[i + 1] - 1 if i < count - 1 else None) for i in range(count)]
+
+def run_manim_segmented(script_path, job_id, save_last_frame=False, quality=DEFAULT_QUALITY, usage=None,
+                        progress=None, segments=()):
+    """
+    Render a scene's animation ranges in parallel Manim processes and join the results
+    
+    Each process runs the whole construct(), but with Manim's -n the
+    animations before its range are skipped: only their end state is
+    computed, which replays the scene's set-up for a fraction of the cost
+    of rendering it. Animations after the range end the scene early. Each
+    segment renders into its own media directory under the job's video
+    directory (sharing the LaTeX cache, and the scene cache for partial
+    movies and texts), and the segment videos are concatenated without
+    re-encoding.
+    """
+    script_name = os.path.basename(script_path).split('.')[0]
+    segments_root = os.path.join(MEDIA_FOLDER, 'videos', script_name, QUALITY_TIERS[quality][1], 'segments')
+    media_dirs = [os.path.join(segments_root, str(index)) for index in range(len(segments))]
+    usages = [{} for _ in segments]
+    report = _segment_progress(progress)
+    print(f"Rendering job {job_id} in {len(segments)} parallel segments: {segments}")
+    
+    def render_segment(index):
+        _share_tex_dir(media_dirs[index])
+        try:
+            return run_manim_subprocess(script_path, job_id, quality=quality, usage=usages[index], progress=report,
+                                        media_dir=media_dirs[index], animation_range=segments[index])
+        except RenderError as e:
+            # The scene had fewer animations than estimated, leaving nothing for this segment
+            if index > 0 and e.cause == 'output_missing':
+                return None
+            raise
+    
+    try:
+        with ThreadPoolExecutor(max_workers=len(segments), thread_name_prefix=f"segment-{job_id[:8]}") as pool:
+            futures = [pool.submit(render_segment, index) for index in range(len(segments))]
+            outputs = [future.result() for future in futures]
+        
+        output_path = video_path_for(script_name, quality)
+        with time_stage('segment_concat'):
+            _concat_videos([path for path in outputs if path], output_path)
+        for media_dir in media_dirs:
+            _harvest_partials(script_path, quality, media_dir)
+    finally:
+        shutil.rmtree(segments_root, ignore_errors=True)
+        if usage is not None:
+            # The segments run side by side: memory peaks add up, and so does CPU time
+            usage.update({
+                "peak_rss_mb": round(sum(u.get("peak_rss_mb", 0) for u in usages), 1),
+                "cpu_seconds": round(sum(u.get("cpu_seconds", 0) for u in usages), 2),
+                "segments": len(segments),
+            })
+    
+    print(f"Joined {len(segments)} segments of job {job_id} into {output_path}")
+    return output_path
+
+def _segment_progress(progress):
+    """
+    Wrap a progress callback for parallel segments: Manim numbers animations
+    from the start of the scene in every segment, so started animations are
+    counted across all of them instead
+    """
+    if progress is None:
+        return None
+    lock = threading.Lock()
+    started = [0]
+    
+    def report(event):
+        with lock:
+            if event["event"] == ANIMATION_STARTED:
+                event = {**event, "animation": started[0]}
+                started[0] += 1
+            progress(event)
+    return report
+
+def _share_tex_dir(media_dir):
+    """Point a segment's LaTeX directory at the shared one, so formulas are compiled once"""
+    shared = os.path.join(MEDIA_FOLDER, 'Tex')
+    os.makedirs(shared, exist_ok=True)
+    os.makedirs(media_dir, exist_ok=True)
+    link = os.path.join(media_dir, 'Tex')
+    if not os.path.lexists(link):
+        os.symlink(shared, link)
+
+def _concat_videos(paths, output_path):
+    """Join videos with identical encoding settings into one without re-encoding (ffmpeg's concat demuxer)"""
+    if not paths:
+        raise RenderError("No segment produced a video", 'output_missing')
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    if len(paths) == 1:
+        os.replace(paths[0], output_path)
+        return
+    
+    list_path = f"{output_path}.segments.txt"
+    with open(list_path, 'w') as list_file:
+        for path in paths:
+            list_file.write(f"file 'file:{path}'\n")
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-nostdin", "-f", "concat", "-safe", "0", "-i", list_path,
+           "-c", "copy", output_path]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=RENDER_TIMEOUT,
+                                preexec_fn=apply_render_limits)
+    except subprocess.TimeoutExpired:
+        raise RenderError(f"Joining segments timed out after {RENDER_TIMEOUT} seconds", 'timeout')
+    finally:
+        os.remove(list_path)
+    if result.returncode != 0 or not os.path.exists(output_path):
+        raise RenderError(f"Joining segments failed: {result.stderr.strip()}", 'concat_failed')
+
+def run_manim_subprocess(script_path, job_id, save_last_frame=False, quality=DEFAULT_QUALITY, usage=None,
+                         progress=None, media_dir=MEDIA_FOLDER, animation_range=None, degradations=None):
+    """
+    Run Manim in a fresh subprocess to generate the animation
+    
+    `animation_range` (first, last) renders only those animations (Manim's
+    -n; last may be None for "to the end"), as one segment of a scene.
+    `degradations` may set a lower frame_rate and resolution ("WxH").
+    """
+    try:
+        # Get the directory containing the script
+        script_dir = os.path.dirname(script_path)
+        
+        # Get the filename without extension
+        script_name = os.path.basename(script_path).split('.')[0]
+        
+        # Run Manim (through a wrapper that installs the shared scene cache)
+        cmd = [
+            "python3", "-m", "backend.manim_main", 
+            script_path, 
+            "ManimScene",  # The class name in our generated code
+            f"-q{quality}",  # Low quality unless a higher tier was requested
+            "--media_dir", media_dir
+        ]
+        if save_last_frame:
+            cmd.append("-s")  # Only render the last frame as a PNG
+        if animation_range is not None:
+            first, last = animation_range
+            cmd += ["-n", f"{first},{last}" if last is not None else str(first)]
+        if degradations and degradations.get('frame_rate'):
+            cmd += ["--frame_rate", str(degradations['frame_rate'])]
+        if degradations and degradations.get('resolution'):
+            cmd += ["-r", degradations['resolution'].replace('x', ',')]
+        timeout = PREVIEW_TIMEOUT if save_last_frame else RENDER_TIMEOUT
+        
+        # Log the command being executed
+        print(f"Executing command: {' '.join(cmd)}")
+        
+        # Run in a new session so a timeout can kill ffmpeg along with Manim.
+        # A wide COLUMNS keeps rich from wrapping log lines (and the paths in them).
+        python_path = os.pathsep.join(filter(None, [PROJECT_ROOT, os.environ.get('PYTHONPATH')]))
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            start_new_session=True,
+            preexec_fn=apply_render_limits,
+            env={**os.environ, 'COLUMNS': '1000', 'PYTHONPATH': python_path}
+        )
+        
+        # Parse both pipes line by line on threads (text mode turns the progress
+        # bar's carriage returns into line breaks) while this one waits for the
+        # exit status and rusage
+        parser = ManimOutputParser(on_event=progress)
+        readers = [
+            threading.Thread(target=parser.read_stream, args=(process.stdout,), daemon=True),
+            threading.Thread(target=parser.read_stream, args=(process.stderr,), daemon=True)
+        ]
+        for reader in readers:
+            reader.start()
+        
+        try:
+            try:
+                render_usage = wait_with_usage(process, timeout, stalled=parser.is_stalled)
+            finally:
+                # Also reaps stray children that would otherwise hold the pipes open
+                kill_process_group(process.pid)
+                for reader in readers:
+                    reader.join()
+                parser.finish()
+            stderr = parser.tail()
+            if usage is not None:
+                usage.update(render_usage)
+            print(f"Render used {render_usage['cpu_seconds']}s CPU, {render_usage['peak_rss_mb']} MB peak RSS")
+            
+            if process.returncode < 0:
+                # Killed by a signal, e.g. SIGXCPU from the CPU time limit
+                signal_name = signal.Signals(-process.returncode).name
+                error_msg = f"Manim was killed by {signal_name}: {stderr}"
+                print(error_msg)
+                raise RenderError(error_msg, 'cpu_limit' if signal_name == 'SIGXCPU' else 'killed')
+            if process.returncode != 0:
+                error_msg = f"Manim execution failed with return code {process.returncode}: {stderr}"
+                print(error_msg)
+                raise RenderError(error_msg, 'memory_limit' if 'MemoryError' in stderr else 'scene_error')
+            
+            with time_stage('file_discovery'):
+                output_path = _find_output(script_name, save_last_frame, quality, parser.output_path, media_dir,
+                                           degradations)
+            
+            print(f"Manim {'preview' if save_last_frame else 'execution'} successful. Output at: {output_path}")
+            return output_path
+            
+        except subprocess.TimeoutExpired:
+            # The whole process group has been killed
+            process.wait()
+            error_msg = f"Manim execution timed out after {timeout} seconds: {parser.tail(1000)}"
+            print(error_msg)
+            raise RenderError(error_msg, 'timeout')
+        except RenderStalled:
+            process.wait()
+            error_msg = (f"Manim produced no output for {parser.stall_seconds} seconds and was killed as hung: "
+                         f"{parser.tail(1000)}")
+            print(error_msg)
+            raise RenderError(error_msg, 'stalled')
+            
+    except Exception as e:
+        error_msg = f"Error running Manim: {str(e)}"
+        print(error_msg)
+        raise RenderError(error_msg, getattr(e, 'cause', 'error'))
+
+def _find_output(script_name, save_last_frame, quality, reported_path=None, media_dir=MEDIA_FOLDER,
+                 degradations=None):
+    """Locate the PNG or MP4 a subprocess render wrote, preferring the path Manim reported"""
+    if reported_path and os.path.exists(reported_path):
+        return reported_path
+    
+    if save_last_frame:
+        output_path = find_image(script_name)
+        if not output_path:
+            raise RenderError(f"Output image not found for {script_name}", 'output_missing')
+        return output_path
+    
+    # Expected output path based on Manim's conventions
+    output_path = video_path_for(script_name, quality, media_dir, degradations)
+    if not os.path.exists(output_path):
+        error_msg = f"Output video file not found at {output_path}"
+        print(error_msg)
+        raise RenderError(error_msg, 'output_missing')
+    
+    return output_path
@@ -0,0 +1,200 @@
+import glob
+import importlib.metadata
+import os
+import shutil
+import tempfile
+import threading
+
+from backend.cache import CACHE_FOLDER, CACHE_MAX_AGE_DAYS, DiskLRUCache, link_or_copy, sha256_hex
+from backend.metrics import registry
+
+# Configuration
+SCENE_CACHE_FOLDER = os.environ.get('SCENE_CACHE_FOLDER', os.path.join(CACHE_FOLDER, 'scenes'))
+SCENE_CACHE_MAX_MB = int(os.environ.get('SCENE_CACHE_MAX_MB', '1024'))
+
+# Manim names partial movies by animation hash, or "uncached_00001" when caching is off
+UNCACHED_PREFIX = 'uncached'
+
+scene_cache_partials_total = registry.counter(
+    'scene_cache_partials_total', 'Partial movies of finished renders, by whether the store already had them',
+    ['result'])
+
+
+def manim_version():
+    try:
+        return importlib.metadata.version('manim')
+    except importlib.metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+class SceneCache:
+    """
+    Content-addressed store of Manim's partial movie files and text SVGs, shared by all jobs.
+
+    Manim skips re-encoding an animation when a partial movie named after
+    its hash is already in the scene's partial movie directory, but that
+    directory is per job. Render processes fetch missing partial movies
+    from this store (see install_scene_cache) and the server harvests new
+    ones after each render, so identical animations, such as a template
+    scene's opening Create(Circle(color=BLUE)), are encoded once. Entries
+    are keyed by Manim version and resolution as well as the hash.
+
+    Text SVGs are written straight into the store's text directory, which
+    is Manim's text_dir for every render. Its path must be the same for
+    every job, because the SVG path is part of the animation hash.
+
+    Both halves are DiskLRUCaches: entries are placed with an atomic
+    link-and-rename and evicted least recently used.
+    """
+
+    def __init__(self, directory=SCENE_CACHE_FOLDER, max_mb=SCENE_CACHE_MAX_MB, max_age_days=CACHE_MAX_AGE_DAYS):
+        max_bytes = max_mb * 1024 * 1024
+        max_age = max_age_days * 86400
+        # SVGs are a few KB each; movies take nearly all of the budget
+        self.partials = DiskLRUCache(os.path.join(directory, 'partials'), '.mp4', max_bytes - max_bytes // 20, max_age)
+        self.texts = DiskLRUCache(os.path.join(directory, 'texts'), '.svg', max_bytes // 20, max_age)
+        self.version = manim_version()
+        self.stored = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+
+    def partial_key(self, animation_hash, resolution):
+        return sha256_hex(self.version, resolution, animation_hash)
+
+    def fetch_partial(self, animation_hash, resolution, dest_path):
+        """
+        Place a stored partial movie at `dest_path`.
+
+        Returns:
+            bool: False on a miss, or if the entry was evicted meanwhile
+        """
+        path = self.partials.get_path(self.partial_key(animation_hash, resolution))
+        if path is None:
+            return False
+        try:
+            link_or_copy(path, dest_path)
+        except OSError:
+            return False
+        return True
+
+    def harvest_partials(self, partial_dir, resolution):
+        """
+        Store the partial movies a finished render left in `partial_dir`.
+
+        Partial movies the store already had were (almost always) fetched
+        from it rather than encoded, and are counted as reused.
+
+        Returns:
+            tuple: (partial movies added to the store, partial movies reused)
+        """
+        stored = reused = 0
+        for path in glob.glob(os.path.join(partial_dir, f"*{self.partials.suffix}")):
+            animation_hash = os.path.splitext(os.path.basename(path))[0]
+            if animation_hash.startswith(UNCACHED_PREFIX):
+                continue
+            key = self.partial_key(animation_hash, resolution)
+            if os.path.exists(self.partials.path_for(key)):
+                reused += 1
+            else:
+                self.partials.put_file(key, path)
+                stored += 1
+
+        scene_cache_partials_total.inc(stored, result='stored')
+        scene_cache_partials_total.inc(reused, result='reused')
+        with self._lock:
+            self.stored += stored
+            self.reused += reused
+        return stored, reused
+
+    def stats(self):
+        # Lookups happen in the render processes, so hits are counted here from the harvests
+        partial_entries, partial_bytes = self.partials._scan_totals()
+        text_entries, text_bytes = self.texts._scan_totals()
+        with self._lock:
+            stored, reused = self.stored, self.reused
+        total = stored + reused
+        return {
+            "partials": {
+                "stored": stored,
+                "reused": reused,
+                "reuse_ratio": round(reused / total, 3) if total else 0.0,
+                "entries": partial_entries,
+                "bytes": partial_bytes,
+            },
+            "texts": {
+                "entries": text_entries,
+                "bytes": text_bytes,
+            },
+        }
+
+
+def install_scene_cache(cache):
+    """
+    Patch Manim in the current (render) process to use the shared scene cache.
+
+    Called at the start of every warm pool worker, and by backend/manim_main.py
+    before it hands over to Manim's command line for subprocess renders.
+    A render process draws one scene at a time, so briefly swapping
+    config.text_dir below is safe.
+
+    Returns:
+        bool: False if this Manim version doesn't have the expected hooks
+    """
+    try:
+        from manim import config
+        from manim.scene.scene_file_writer import SceneFileWriter
+        from manim.mobject.text.text_mobject import Text, MarkupText
+    except ImportError as e:
+        print(f"Scene cache not installed: {str(e)}")
+        return False
+
+    config.text_dir = cache.texts.directory
+
+    original_is_already_cached = SceneFileWriter.is_already_cached
+
+    def is_already_cached(self, hash_invocation):
+        if original_is_already_cached(self, hash_invocation):
+            return True
+        if not hasattr(self, 'partial_movie_directory'):
+            return False
+        # <video_dir>/partial_movie_files/<scene>, where video_dir ends in the resolution (480p15)
+        resolution = self.partial_movie_directory.parent.parent.name
+        dest_path = self.partial_movie_directory / f"{hash_invocation}{config['movie_file_extension']}"
+        return cache.fetch_partial(hash_invocation, resolution, str(dest_path))
+
+    SceneFileWriter.is_already_cached = is_already_cached
+
+    for text_class in (Text, MarkupText):
+        text_class._text2svg = _atomic_text2svg(text_class._text2svg, cache, config)
+    return True
+
+
+def _atomic_text2svg(original, cache, config):
+    """
+    Wrap Text._text2svg so the SVG is drawn in a scratch directory and
+    renamed into the shared text directory, and concurrent renders never
+    read a half-written file.
+    """
+    def text2svg(self, color):
+        key = self._text2hash(color)
+        path = cache.texts.get_path(key)
+        if path is not None:
+            return path
+
+        scratch = tempfile.mkdtemp(dir=cache.texts.directory)
+        config.text_dir = scratch
+        try:
+            svg_file = original(self, color)
+            return cache.texts.put_file(key, svg_file)
+        finally:
+            config.text_dir = cache.texts.directory
+            shutil.rmtree(scratch, ignore_errors=True)
+    return text2svg
+
+
+# Shared store used by the renderer
+scene_cache = SceneCache()
+
+registry.gauge('scene_cache_bytes', 'Size of the shared scene cache on disk', ['kind'],
+               function=lambda: {('partials',): scene_cache.stats()['partials']['bytes'],
+                                 ('texts',): scene_cache.stats()['texts']['bytes']})
@@ -0,0 +1,332 @@
+import re
+
+# Shapes: keyword -> (Manim class, extra constructor arguments, default color)
+SHAPES = {
+    'circle': ('Circle', '', 'BLUE'),
+    'square': ('Square', '', 'RED'),
+    'triangle': ('Triangle', '', 'GREEN'),
+    'rectangle': ('Rectangle', 'width=3, height=2, ', 'ORANGE'),
+    'star': ('Star', '', 'GOLD'),
+    'dot': ('Dot', 'radius=0.2, ', 'WHITE'),
+    'ellipse': ('Ellipse', 'width=3, height=1.5, ', 'TEAL'),
+    'pentagon': ('RegularPolygon', 'n=5, ', 'PURPLE'),
+    'hexagon': ('RegularPolygon', 'n=6, ', 'PINK'),
+}
+
+COLORS = {
+    'red': 'RED', 'blue': 'BLUE', 'green': 'GREEN', 'yellow': 'YELLOW', 'orange': 'ORANGE',
+    'purple': 'PURPLE', 'pink': 'PINK', 'white': 'WHITE', 'gray': 'GRAY', 'grey': 'GRAY',
+    'teal': 'TEAL', 'gold': 'GOLD',
+}
+
+# Verbs that bring an object on screen -> the animation used for it
+INTRO_VERBS = {
+    'create': 'Create', 'draw': 'Create', 'make': 'Create', 'show': 'Create', 'add': 'Create',
+    'display': 'Create', 'write': 'Write', 'fade in': 'FadeIn', 'grow': 'GrowFromCenter',
+}
+
+# Verbs acting on an object already on screen -> action name (see ACTIONS)
+ACTION_VERBS = {
+    'rotate': 'rotate', 'spin': 'rotate',
+    'transform': 'transform', 'morph': 'transform', 'turn into': 'transform',
+    'become': 'transform', 'change into': 'transform',
+    # "fade in" is an intro verb; a bare "fade" is "fade it out"
+    'fade out': 'fade_out', 'fade': 'fade_out', 'disappear': 'fade_out', 'vanish': 'fade_out',
+    'move': 'move', 'shift': 'move', 'slide': 'move',
+    'scale': 'scale', 'enlarge': 'scale',
+    'indicate': 'indicate', 'highlight': 'indicate',
+}
+
+# Transform verbs that follow their source ("the circle turns into a square"); the others precede it
+TRANSFORMS_AFTER_SOURCE = {'turn into', 'become', 'change into'}
+
+# Directions a move can take
+DIRECTIONS = {'left': 'LEFT', 'right': 'RIGHT', 'up': 'UP', 'down': 'DOWN'}
+DEFAULT_DIRECTION = 'RIGHT'
+
+# Code for each action; transform is handled when its target shape is seen
+ACTIONS = {
+    'rotate': "self.play(Rotate({name}, angle=PI), run_time=2)",
+    'fade_out': "self.play(FadeOut({name}))",
+    'move': "self.play({name}.animate.shift({direction} * 2))",
+    'scale': "self.play({name}.animate.scale(1.5))",
+    'indicate': "self.play(Indicate({name}))",
+}
+
+# Words that carry no meaning of their own for the scene. Positions ("below", "next to") and
+# numbers are not among them: the templates can't honour those, so such descriptions go to Gemini.
+STOPWORDS = {
+    'a', 'an', 'the', 'and', 'then', 'it', 'them', 'into', 'to', 'of', 'with', 'in', 'on', 'at',
+    'by', 'after', 'that', 'this', 'its', 'is', 'screen', 'finally', 'first', 'slowly', 'quickly',
+    'animation', 'text', 'please', 'so', 'from', 'out', 'all', 'shape',
+}
+
+# Words standing for the object last mentioned
+PRONOUNS = {'it', 'them'}
+
+DEFAULT_TEXT = "Hello, Manim!"
+
+# Widest a row of objects may be before it is scaled down (the frame is ~14 units wide)
+MAX_ROW_WIDTH = 12
+
+
+def _inflections(phrase):
+    """The phrase with common suffixes on its first word: rotate, rotates, rotated, rotating..."""
+    first, _, rest = phrase.partition(' ')
+    stems = {first, first + 's', first + 'es', first + 'd', first + 'ed', first + 'ing'}
+    if first.endswith('e'):
+        stems.add(first[:-1] + 'ing')
+    return {f"{stem} {rest}".strip() for stem in stems}
+
+
+def _build_vocabulary():
+    vocabulary = {}
+    for kind, table in (('color', COLORS), ('intro', INTRO_VERBS), ('action', ACTION_VERBS), ('shape', SHAPES),
+                        ('direction', DIRECTIONS)):
+        for keyword in table:
+            for form in (_inflections(keyword) if kind in ('intro', 'action', 'shape') else {keyword}):
+                vocabulary.setdefault(form, (kind, keyword))
+    vocabulary['text'] = ('text', 'text')
+    return vocabulary
+
+
+# Every known word or phrase -> (kind, canonical keyword)
+VOCABULARY = _build_vocabulary()
+
+# Tokens: quoted text (kept verbatim), a single word or a number
+TOKEN_PATTERN = re.compile(r'"([^"]*)"|([A-Za-z\']+|\d+(?:\.\d+)?)')
+
+
+class SceneObject:
+    """A mobject declared by the generated scene"""
+
+    def __init__(self, name, constructor, kind, key):
+        self.name = name
+        self.constructor = constructor
+        self.kind = kind
+        self.key = key
+        # Object this one replaces on screen (transform targets are placed over it)
+        self.replaces = None
+
+
+class ScenePlan:
+    """Objects and animations derived from a description"""
+
+    def __init__(self):
+        self.objects = []
+        self.steps = []
+        self.unknown_words = []
+        # Action verbs that ended up with nothing (or nothing suitable) to act on
+        self.dropped_actions = []
+        # Words understood but not honoured: plurals, and directions with no move to apply to
+        self.unhandled_words = []
+
+    @property
+    def complete(self):
+        """True when every word of the description was understood, acted on, and something was drawn"""
+        return bool(self.steps) and not self.unknown_words and not self.dropped_actions and not self.unhandled_words
+
+
+def plan_scene(description):
+    """
+    Turn a description into a ScenePlan in a single pass over its tokens.
+
+    Every word is looked up once in VOCABULARY, which holds all inflections
+    of the table entries, so matching costs one dict lookup per word.
+
+    Colors apply to the next shape. Intro verbs decide how the next object
+    appears; action verbs apply to the next object mentioned or, when
+    another verb or the end comes first, to the last one ("rotate it").
+    A direction sets where a move goes, before or after the object ("move
+    it to the left"). A transform's source is the next object mentioned, or
+    the last one for "it", "into" and the verbs that follow their source
+    ("the circle turns into a square"); the object after it is the target.
+    Mentioning the same shape and color again refers to the existing object
+    (or what it was transformed into) rather than declaring a new one.
+
+    Anything the templates can't honour (unknown words, numbers, plurals,
+    positions, a verb left without anything to act on) makes the plan
+    incomplete.
+    """
+    plan = ScenePlan()
+    by_key = {}
+    names = {}
+    state = {"last": None, "intro": None, "action": None, "color": None, "wants_text": False,
+             "direction": None, "source": None, "moved": None}
+
+    def declare(kind, key, constructor):
+        base = key[0] if kind == 'shape' else 'text'
+        names[base] = names.get(base, 0) + 1
+        name = base if names[base] == 1 else f"{base}_{names[base]}"
+        obj = SceneObject(name, constructor, kind, key)
+        plan.objects.append(obj)
+        by_key[key] = obj
+        return obj
+
+    def flush_action():
+        action, last, direction = state["action"], state["last"], state["direction"]
+        state["action"] = state["direction"] = state["source"] = None
+        if action in ACTIONS and last is not None:
+            plan.steps.append(ACTIONS[action].format(name=last.name, direction=direction or DEFAULT_DIRECTION))
+            # A direction may still follow the object: "move the circle to the left"
+            state["moved"] = len(plan.steps) - 1 if action == 'move' and direction is None else None
+        elif action is not None:
+            plan.dropped_actions.append(action)
+
+    def introduce(obj, default_intro):
+        plan.steps.append(f"self.play({state['intro'] or default_intro}({obj.name}))")
+        state["intro"] = None
+        state["last"] = obj
+
+    def transform_into(target, kind, key, constructor):
+        source = state["source"]
+        state["action"] = state["source"] = None
+        if target is source:
+            plan.dropped_actions.append('transform')
+            return
+        if target is None:
+            target = declare(kind, key, constructor)
+            target.replaces = source
+        plan.steps.append(f"self.play(ReplacementTransform({source.name}, {target.name}))")
+        # The source is gone from the scene; mentioning it again means what it became
+        by_key[source.key] = target
+        state["last"] = target
+
+    def mention(kind, key, constructor, default_intro):
+        existing = by_key.get(key)
+        if state["action"] == 'transform' and state["source"] is not None:
+            transform_into(existing, kind, key, constructor)
+            return
+        if existing is None:
+            existing = declare(kind, key, constructor)
+            introduce(existing, default_intro)
+        else:
+            state["last"] = existing
+        if state["action"] == 'transform':
+            state["source"] = existing
+        elif state["action"] is not None:
+            flush_action()
+
+    tokens = TOKEN_PATTERN.findall(description)
+    position = 0
+    while position < len(tokens):
+        quoted, word = tokens[position]
+        position += 1
+
+        if not word:
+            content = quoted
+            state["wants_text"] = False
+            mention('text', ('text', content), f"Text({content!r}, color=YELLOW)", 'Write')
+            continue
+
+        word = word.lower()
+        # Two-word phrases ("fade in", "turn into") win over their first word
+        if position < len(tokens) and tokens[position][1]:
+            phrase = f"{word} {tokens[position][1].lower()}"
+            if phrase in VOCABULARY:
+                word = phrase
+                position += 1
+        if state["action"] == 'transform' and state["source"] is None and (word in PRONOUNS or word == 'into'):
+            state["source"] = state["last"]
+            continue
+        if word not in VOCABULARY:
+            if word not in STOPWORDS and word not in PRONOUNS:
+                plan.unknown_words.append(word)
+            continue
+
+        kind, keyword = VOCABULARY[word]
+        if kind == 'color':
+            state["color"] = COLORS[keyword]
+        elif kind == 'text':
+            state["wants_text"] = True
+        elif kind == 'direction':
+            if state["action"] == 'move':
+                state["direction"] = DIRECTIONS[keyword]
+            elif state["moved"] is not None and state["moved"] == len(plan.steps) - 1:
+                plan.steps[-1] = ACTIONS['move'].format(name=state["last"].name, direction=DIRECTIONS[keyword])
+                state["moved"] = None
+            else:
+                plan.unhandled_words.append(word)
+        elif kind == 'intro':
+            flush_action()
+            state["intro"] = INTRO_VERBS[keyword]
+            if keyword == 'write':
+                state["wants_text"] = True
+        elif kind == 'action':
+            flush_action()
+            state["action"] = ACTION_VERBS[keyword]
+            if keyword in TRANSFORMS_AFTER_SOURCE:
+                state["source"] = state["last"]
+        else:
+            if word != keyword and word in (keyword + 's', keyword + 'es'):
+                # "squares": the templates draw one of each shape
+                plan.unhandled_words.append(word)
+            cls, args, default_color = SHAPES[keyword]
+            key = (keyword, state["color"] or default_color)
+            state["color"] = None
+            mention('shape', key, f"{cls}({args}color={key[1]})", 'Create')
+
+    if state["wants_text"] and not any(obj.kind == 'text' for obj in plan.objects):
+        mention('text', ('text', DEFAULT_TEXT), f"Text({DEFAULT_TEXT!r}, color=YELLOW)", 'Write')
+    flush_action()
+    return plan
+
+
+def _layout(plan):
+    """Lines placing texts in a row at the top and shapes in a row below, so nothing overlaps"""
+    lines = []
+    texts = [obj.name for obj in plan.objects if obj.kind == 'text' and obj.replaces is None]
+    shapes = [obj.name for obj in plan.objects if obj.kind == 'shape' and obj.replaces is None]
+
+    if texts:
+        lines.append(f"VGroup({', '.join(texts)}).arrange(DOWN, buff=0.4).to_edge(UP)")
+    if len(shapes) > 1:
+        lines.append(f"shapes = VGroup({', '.join(shapes)}).arrange(RIGHT, buff=1)")
+        if len(shapes) > 4:
+            lines.append(f"shapes.scale_to_fit_width({MAX_ROW_WIDTH})")
+        if texts:
+            lines.append("shapes.shift(DOWN * 0.5)")
+    elif shapes and texts:
+        lines.append(f"{shapes[0]}.shift(DOWN * 0.5)")
+    for obj in plan.objects:
+        if obj.replaces is not None:
+            lines.append(f"{obj.name}.move_to({obj.replaces.name})")
+    return lines
+
+
+def render_scene_code(description, plan=None):
+    """
+    Build a complete ManimScene module for a description.
+
+    Args:
+        description (str): Text description of the animation
+        plan (ScenePlan, optional): A plan already made with plan_scene
+
+    Returns:
+        str: Manim code
+    """
+    plan = plan or plan_scene(description)
+    summary = ' '.join(description.split())
+
+    if plan.steps:
+        body = [f"{obj.name} = {obj.constructor}" for obj in plan.objects]
+        body += _layout(plan)
+        body += [""] + plan.steps + ["self.wait(1)"]
+    else:
+        # Nothing recognised: show the description itself
+        caption = summary if len(summary) <= 60 else summary[:57] + '...'
+        body = [
+            f"text = Text({caption!r}, font_size=24)",
+            "self.play(Write(text))",
+            "self.wait(2)",
+        ]
+
+    content = '\n'.join(f"        {line}" if line else "" for line in body)
+    return f"""from manim import *
+
+class ManimScene(Scene):
+    def construct(self):
+        # Generated from description: {summary}
+
+{content}
+"""
@@ -0,0 +1,209 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter
+
+from backend.metrics import registry
+from backend.renderer import DEFAULT_QUALITY
+from backend.validation import validate_scene
+
+# Configuration
+# 'sjf' runs the cheapest waiting render first (with aging, priority classes and per-client fairness);
+# 'fifo' runs them in the order they arrived
+SCHEDULER_POLICY = os.environ.get('SCHEDULER_POLICY', 'sjf')
+# Seconds of estimated render time forgiven per second a render waits, so long renders never starve
+SCHEDULER_AGING = float(os.environ.get('SCHEDULER_AGING', '0.5'))
+# Head start interactive renders get over batch and higher quality (export) renders
+SCHEDULER_BATCH_PENALTY_SECONDS = float(os.environ.get('SCHEDULER_BATCH_PENALTY_SECONDS', '60'))
+# Penalty per render a client already has running, so one client can't take every worker
+SCHEDULER_CLIENT_PENALTY_SECONDS = float(os.environ.get('SCHEDULER_CLIENT_PENALTY_SECONDS', '30'))
+
+# Priority classes
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+PRIORITY_CLASSES = (INTERACTIVE, BATCH)
+
+# Render cost model: seconds to start Manim, then seconds per second of scene at low quality,
+# growing with the number of mobjects on screen and several times over for 3D scenes
+RENDER_STARTUP_SECONDS = 2.0
+RENDER_SECONDS_PER_SCENE_SECOND = 0.3
+RENDER_MOBJECT_FACTOR = 0.05
+RENDER_THREE_D_FACTOR = 4.0
+# Pixels times frame rate of each quality tier, relative to low quality (480p15)
+QUALITY_COST = {'l': 1.0, 'm': 4.5, 'h': 20.0, 'k': 80.0}
+LOW_QUALITY_PIXEL_RATE = 854 * 480 * 15
+
+# Cheaper ways to render the low quality video, tried in order when its deadline can't be met otherwise
+DEGRADATIONS = [
+    {"frame_rate": 10},
+    {"frame_rate": 10, "resolution": "640x360"},
+    {"frame_rate": 10, "resolution": "426x240"},
+]
+
+scheduler_wait_seconds = registry.histogram(
+    'scheduler_wait_seconds', 'Time jobs waited in a scheduled queue, by queue and priority class',
+    ['queue', 'priority'])
+
+
+def estimate_render_seconds(code, quality=DEFAULT_QUALITY, dry_run=None, degradations=None):
+    """
+    Estimate how long rendering a scene takes, from its syntax tree.
+
+    Args:
+        code (str): The scene's code
+        quality (str): Quality tier to render
+        dry_run (dict, optional): The job's dry run (backend/dry_run.py), whose
+            measured duration replaces the static estimate
+        degradations (dict, optional): Lower frame_rate and resolution to render
+            the low quality tier at (one of DEGRADATIONS)
+
+    Returns:
+        float: Estimated render seconds; only their order matters to the scheduler
+    """
+    validation = validate_scene(code)
+    duration = dry_run["duration"] if dry_run else validation.estimated_duration
+    cost = duration * RENDER_SECONDS_PER_SCENE_SECOND * (1 + RENDER_MOBJECT_FACTOR * validation.mobject_count)
+    if validation.three_d:
+        cost *= RENDER_THREE_D_FACTOR
+    if degradations:
+        width, height = map(int, degradations.get('resolution', '854x480').split('x'))
+        pixel_rate = width * height * degradations.get('frame_rate', 15)
+        return RENDER_STARTUP_SECONDS + cost * pixel_rate / LOW_QUALITY_PIXEL_RATE
+    return RENDER_STARTUP_SECONDS + cost * QUALITY_COST.get(quality, 1.0)
+
+
+def plan_degradations(code, seconds_left, dry_run=None, preview=False):
+    """
+    Choose how to render a job's low quality video so it is done within
+    `seconds_left`, going down DEGRADATIONS until the estimate fits.
+
+    Args:
+        preview (bool): Whether a last-frame preview would be rendered first;
+            it is the first thing dropped
+
+    Returns:
+        dict: The degradations: empty if the full render fits, else
+            skipped_preview (if `preview`), then the frame_rate and resolution
+            to render at if the full video still doesn't fit, or last_frame if
+            not even the smallest video fits and only the final frame is
+            rendered
+    """
+    full = estimate_render_seconds(code, DEFAULT_QUALITY, dry_run)
+    if full + (RENDER_STARTUP_SECONDS if preview else 0) <= seconds_left:
+        return {}
+    if preview and full <= seconds_left:
+        return {"skipped_preview": True}
+    for degradations in DEGRADATIONS:
+        if estimate_render_seconds(code, DEFAULT_QUALITY, dry_run, degradations) <= seconds_left:
+            return {"skipped_preview": True, **degradations} if preview else dict(degradations)
+    return {"last_frame": True}
+
+
+def render_priority(job, quality):
+    """Priority class of a render: higher quality tiers are exports, whoever asked for the job"""
+    return job.priority if quality in (None, DEFAULT_QUALITY) else BATCH
+
+
+def render_rank(cost, priority, enqueued_at, policy=SCHEDULER_POLICY):
+    """
+    Where a render goes in the queue: lowest first.
+
+    The score of a waiting render is its cost plus its class penalty, minus
+    SCHEDULER_AGING times the seconds it has waited. Every score drops by
+    the same amount as time passes, so they are ordered by this rank, which
+    only changes with the render's class, and can be stored with the render
+    (see backend/farm.py, which re-ranks a promoted render).
+    """
+    if policy == 'fifo':
+        return enqueued_at
+    penalty = SCHEDULER_BATCH_PENALTY_SECONDS if priority == BATCH else 0.0
+    return cost + penalty + SCHEDULER_AGING * enqueued_at
+
+
+class JobScheduler:
+    """
+    Stands in for queue.Queue of (job, quality) items, handing them out by
+    render_rank rather than in arrival order: shortest estimated render
+    first, interactive renders ahead of batch and export ones, and long
+    waits aged to the front. A client's renders also rank lower by
+    SCHEDULER_CLIENT_PENALTY_SECONDS for each of its renders in progress,
+    so concurrent clients share the workers.
+
+    `estimate` is called with the job and quality of each item put; without
+    one (code generation, whose cost isn't known yet) only the class, aging
+    and fairness terms apply. Workers report each item with task_done(item).
+
+    The queue is bounded (RENDER_QUEUE_SIZE), so picking the next item is a
+    scan of the waiting ones, which keeps the per-client term live.
+    """
+
+    def __init__(self, maxsize=0, estimate=None, name='render'):
+        """
+        Args:
+            name (str): Label of the queue in scheduler_wait_seconds
+        """
+        self.maxsize = maxsize
+        self.estimate = estimate
+        self.name = name
+        # [estimated cost, sequence, item, enqueued_at]
+        self._waiting = []
+        self._sequence = 0
+        # Client -> items handed out and not yet done
+        self._running = Counter()
+        self._changed = threading.Condition()
+
+    def qsize(self):
+        with self._changed:
+            return len(self._waiting)
+
+    def put(self, item, block=True):
+        job, quality = item
+        cost = self.estimate(job, quality) if self.estimate is not None else 0.0
+        with self._changed:
+            while self.maxsize > 0 and len(self._waiting) >= self.maxsize:
+                if not block:
+                    raise queue.Full
+                self._changed.wait()
+            # Aging starts once the item is in the queue, not while its producer waited for room
+            self._sequence += 1
+            self._waiting.append([cost, self._sequence, item, time.time()])
+            self._changed.notify_all()
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def promote(self, job):
+        """Nothing to do: the class of a waiting item is read each time the next one is picked"""
+
+    def get(self):
+        with self._changed:
+            while not self._waiting:
+                self._changed.wait()
+            entry = min(self._waiting, key=self._score)
+            self._waiting.remove(entry)
+            _, _, item, enqueued_at = entry
+            job, quality = item
+            if job.client is not None:
+                self._running[job.client] += 1
+            self._changed.notify_all()
+        scheduler_wait_seconds.observe(time.time() - enqueued_at, queue=self.name,
+                                       priority=render_priority(job, quality))
+        return item
+
+    def task_done(self, item):
+        job, _ = item
+        if job.client is None:
+            return
+        with self._changed:
+            self._running[job.client] -= 1
+            if self._running[job.client] <= 0:
+                del self._running[job.client]
+
+    def _score(self, entry):
+        # The class is read here: a batch job an interactive request attached to has been promoted
+        cost, sequence, (job, quality), enqueued_at = entry
+        rank = render_rank(cost, render_priority(job, quality), enqueued_at)
+        if SCHEDULER_POLICY == 'fifo' or job.client is None:
+            return rank, sequence
+        return rank + SCHEDULER_CLIENT_PENALTY_SECONDS * self._running[job.client], sequence
@@ -1,18 +1,22 @@
 import os
 import sys
-import re
 
 # Add the project root to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# Import the Gemini converter
-from utils.gemini_converter import GeminiTextToManimConverter
+# The Gemini converter (or an offline backend) is built on first use; see backend/codegen.py
+from backend.codegen import get_code_generator
+from backend.validation import validate_scene
+from backend.dry_run import dry_run_scene, DRY_RUN
+from backend.scene_templates import plan_scene, render_scene_code
+from backend.metrics import time_stage, code_generated_total, code_fallbacks_total
 
-# Get the API key from environment variable or use the provided one
-api_key = os.environ.get('GEMINI_API_KEY', 'PUT YOUR API KEY HERE')
+# Serve prompts the templates fully understand without calling Gemini
+TEMPLATE_FAST_PATH = os.environ.get('TEMPLATE_FAST_PATH', '0') == '1'
 
-# Initialize the Gemini converter
-gemini_converter = GeminiTextToManimConverter(api_key)
+# Where generated code came from; only Gemini output is worth caching
+SOURCE_GEMINI = 'gemini'
+SOURCE_TEMPLATE = 'template'
 
 def text_to_manim_code(description, job_id):
     """
@@ -25,137 +29,138 @@ def text_to_manim_code(description, job_id):
     Returns:
         str: Generated Manim code
     """
+    manim_code, _ = generate_manim_code(description, job_id)
+    return manim_code
+
+def generate_manim_code(description, job_id):
+    """
+    Convert text description to Manim code, reporting which path produced it
+    
+    Args:
+        description (str): Text description of the animation
+        job_id (str): Unique identifier for the job
+        
+    Returns:
+        tuple: (Generated Manim code, SOURCE_GEMINI or SOURCE_TEMPLATE)
+    """
+    manim_code = _fast_path_code(description)
+    if manim_code is not None:
+        return manim_code, SOURCE_TEMPLATE
+    
     try:
         # Use Gemini API to convert text to Manim code
         print(f"Using Gemini API to generate Manim code for: '{description}'")
-        manim_code = gemini_converter.convert_to_manim_code(description, job_id)
+        manim_code = get_code_generator().generate(description, job_id)
         print(f"Successfully generated Manim code using Gemini API")
-        return manim_code
     except Exception as e:
         print(f"Error using Gemini API: {str(e)}")
         print(f"Falling back to template-based approach")
         # Fall back to template-based approach if Gemini fails
-        return template_based_text_to_manim_code(description, job_id)
-
-def template_based_text_to_manim_code(description, job_id):
-    """
-    Convert text description to Manim code using templates
-    
-    This is a simplified version that uses templates for common animations.
-    Used as a fallback if the Gemini API fails.
-    """
-    # Basic template for a Manim scene
-    template = """from manim import *
-
-class ManimScene(Scene):
-    def construct(self):
-        # Generated from description: {description}
-        
-{content}
-"""
-    
-    # Very simple keyword matching for the prototype
-    content = []
+        return _fallback(description, job_id, 'gemini_error'), SOURCE_TEMPLATE
     
-    # Check for common elements in the description
-    if "circle" in description.lower():
-        content.append("        # Create a circle")
-        content.append("        circle = Circle(color=BLUE)")
-        content.append("        self.play(Create(circle))")
-        content.append("        self.wait(1)")
+    # Catch broken or unsafe scenes here rather than after a render has been attempted
+    with time_stage('validation'):
+        validation = validate_scene(manim_code)
+    if not validation.ok:
+        print(f"Generated Manim code failed validation: {'; '.join(validation.errors)}")
+        print(f"Falling back to template-based approach")
+        return _fallback(description, job_id, 'validation_failed'), SOURCE_TEMPLATE
     
-    if "square" in description.lower():
-        content.append("        # Create a square")
-        content.append("        square = Square(color=RED)")
-        content.append("        self.play(Create(square))")
-        content.append("        self.wait(1)")
+    error = _dry_run_error(manim_code, job_id)
+    if error is not None:
+        print(f"Generated Manim code failed its dry run: {error}")
+        print(f"Falling back to template-based approach")
+        return _fallback(description, job_id, 'dry_run_failed'), SOURCE_TEMPLATE
     
-    if "triangle" in description.lower():
-        content.append("        # Create a triangle")
-        content.append("        triangle = Triangle(color=GREEN)")
-        content.append("        self.play(Create(triangle))")
-        content.append("        self.wait(1)")
+    code_generated_total.inc(source=SOURCE_GEMINI)
+    return manim_code, SOURCE_GEMINI
+
+def stream_manim_code(description, job_id):
+    """
+    Stream Manim code from Gemini, falling back to templates if the stream fails
     
-    if "text" in description.lower() or "write" in description.lower():
-        # Extract text content if it's in quotes
-        text_match = re.search(r'"([^"]*)"', description)
-        text_content = text_match.group(1) if text_match else "Hello, Manim!"
+    Args:
+        description (str): Text description of the animation
+        job_id (str): Unique identifier for the job
         
-        content.append(f"        # Add text: {text_content}")
-        content.append(f'        text = Text("{text_content}", color=YELLOW)')
-        content.append("        self.play(Write(text))")
-        content.append("        self.wait(1)")
-    
-    if "transform" in description.lower():
-        if "circle" in description.lower() and "square" in description.lower():
-            content.append("        # Transform circle to square")
-            content.append("        circle = Circle(color=BLUE)")
-            content.append("        square = Square(color=RED)")
-            content.append("        self.play(Create(circle))")
-            content.append("        self.wait(1)")
-            content.append("        self.play(Transform(circle, square))")
-            content.append("        self.wait(1)")
-        elif "square" in description.lower() and "triangle" in description.lower():
-            content.append("        # Transform square to triangle")
-            content.append("        square = Square(color=RED)")
-            content.append("        triangle = Triangle(color=GREEN)")
-            content.append("        self.play(Create(square))")
-            content.append("        self.wait(1)")
-            content.append("        self.play(Transform(square, triangle))")
-            content.append("        self.wait(1)")
-    
-    if "rotate" in description.lower():
-        if "circle" in description.lower():
-            content.append("        # Rotate a circle")
-            content.append("        circle = Circle(color=BLUE)")
-            content.append("        self.play(Create(circle))")
-            content.append("        self.play(Rotate(circle, angle=PI), run_time=2)")
-            content.append("        self.wait(1)")
-        elif "square" in description.lower():
-            content.append("        # Rotate a square")
-            content.append("        square = Square(color=RED)")
-            content.append("        self.play(Create(square))")
-            content.append("        self.play(Rotate(square, angle=PI), run_time=2)")
-            content.append("        self.wait(1)")
-    
-    if "fade" in description.lower():
-        if "in" in description.lower():
-            if "circle" in description.lower():
-                content.append("        # Fade in a circle")
-                content.append("        circle = Circle(color=BLUE)")
-                content.append("        self.play(FadeIn(circle))")
-                content.append("        self.wait(1)")
-            elif "square" in description.lower():
-                content.append("        # Fade in a square")
-                content.append("        square = Square(color=RED)")
-                content.append("        self.play(FadeIn(square))")
-                content.append("        self.wait(1)")
-        elif "out" in description.lower():
-            if "circle" in description.lower():
-                content.append("        # Fade out a circle")
-                content.append("        circle = Circle(color=BLUE)")
-                content.append("        self.play(Create(circle))")
-                content.append("        self.wait(1)")
-                content.append("        self.play(FadeOut(circle))")
-                content.append("        self.wait(1)")
-            elif "square" in description.lower():
-                content.append("        # Fade out a square")
-                content.append("        square = Square(color=RED)")
-                content.append("        self.play(Create(square))")
-                content.append("        self.wait(1)")
-                content.append("        self.play(FadeOut(square))")
-                content.append("        self.wait(1)")
-    
-    # If no specific animation was matched, create a default one
-    if not content:
-        content.append("        # Default animation")
-        content.append("        text = Text(f\"Animation based on: {description}\", font_size=24)")
-        content.append("        self.play(Write(text))")
-        content.append("        self.wait(2)")
-    
-    # Format the content into the template
-    formatted_content = "\n".join(content)
+    Yields:
+        tuple: ("partial", code so far) while Gemini is generating,
+        ("aborted", error message) if generation was abandoned, and
+        finally ("final", (code, source))
+    """
+    manim_code = _fast_path_code(description)
+    if manim_code is not None:
+        yield "final", (manim_code, SOURCE_TEMPLATE)
+        return
     
-    manim_code = template.format(description=description, content=formatted_content)
+    # Why the stream was abandoned, for the fallback metrics
+    reason = 'gemini_error'
+    try:
+        print(f"Streaming Manim code from Gemini API for: '{description}'")
+        for manim_code, done in get_code_generator().stream(description, job_id):
+            if done:
+                break
+            yield "partial", manim_code
+        else:
+            raise Exception("Gemini stream ended without a result")
+        
+        with time_stage('validation'):
+            validation = validate_scene(manim_code)
+        if not validation.ok:
+            reason = 'validation_failed'
+            raise Exception(f"Generated Manim code failed validation: {'; '.join(validation.errors)}")
+        
+        error = _dry_run_error(manim_code, job_id)
+        if error is not None:
+            reason = 'dry_run_failed'
+            raise Exception(f"Generated Manim code failed its dry run: {error}")
+        
+        print(f"Successfully streamed Manim code using Gemini API")
+        code_generated_total.inc(source=SOURCE_GEMINI)
+        yield "final", (manim_code, SOURCE_GEMINI)
+    except Exception as e:
+        print(f"Error streaming from Gemini API: {str(e)}")
+        print(f"Falling back to template-based approach")
+        if isinstance(e, SyntaxError):
+            reason = 'syntax_error'
+        yield "aborted", str(e)
+        yield "final", (_fallback(description, job_id, reason), SOURCE_TEMPLATE)
+
+def _dry_run_error(manim_code, job_id):
+    """Run the scene with animations skipped; returns the error it raised, if any"""
+    if not DRY_RUN:
+        return None
+    with time_stage('dry_run'):
+        result = dry_run_scene(manim_code, job_id)
+    if result is None or result.ok:
+        return None
+    return result.error
+
+def _fast_path_code(description):
+    """Template code for a description the templates fully understand, or None"""
+    if not TEMPLATE_FAST_PATH:
+        return None
+    with time_stage('template_match'):
+        plan = plan_scene(description)
+    if not plan.complete:
+        return None
+    print(f"Using templates for simple description: '{description}'")
+    code_generated_total.inc(source=SOURCE_TEMPLATE)
+    return render_scene_code(description, plan)
+
+def _fallback(description, job_id, reason):
+    """Template-based code for a description Gemini couldn't handle, counted by `reason`"""
+    code_fallbacks_total.inc(reason=reason)
+    code_generated_total.inc(source=SOURCE_TEMPLATE)
+    return template_based_text_to_manim_code(description, job_id)
+
+def template_based_text_to_manim_code(description, job_id):
+    """
+    Convert text description to Manim code using templates
     
-    return manim_code
+    Shapes, colors and verbs are matched against the tables in
+    backend/scene_templates.py in one pass over the description. Used as
+    the fallback when Gemini fails, and on its own for simple prompts when
+    TEMPLATE_FAST_PATH is enabled.
+    """
+    return render_scene_code(description)
@@ -0,0 +1,310 @@
+import ast
+import math
+import os
+
+# Configuration
+MAX_SCENE_SECONDS = float(os.environ.get('MAX_SCENE_SECONDS', '90'))
+
+# Modules generated scenes may import
+ALLOWED_IMPORTS = {'manim', 'numpy', 'math', 'random', 'itertools', 'functools', 'colour', 'typing', '__future__'}
+
+# Builtins that have no business in an animation
+FORBIDDEN_CALLS = {'exec', 'eval', 'compile', 'open', 'input', 'breakpoint', '__import__', 'globals', 'locals'}
+
+# Builtins that change objects the scene didn't create (setattr(np, ...), vars(manim)[...] = ...)
+STATE_CALLS = {'setattr', 'delattr', 'vars'}
+# Imported names a scene may change: tempconfig restores Manim's config after every render
+RESTORED_NAMES = {'config'}
+
+# Iterators that never end
+UNBOUNDED_ITERATORS = {'count', 'cycle', 'repeat'}
+
+# Scene bases, mobjects and camera calls that make a scene 3D (and several times slower to render)
+THREE_D_NAMES = {'ThreeDScene', 'SpecialThreeDScene', 'ThreeDAxes', 'Surface', 'Sphere', 'Cube', 'Prism', 'Cone',
+                 'Cylinder', 'Torus', 'Dot3D', 'Line3D', 'Arrow3D', 'set_camera_orientation', 'move_camera',
+                 'begin_ambient_camera_rotation'}
+
+# Manim's defaults for self.play() and self.wait()
+DEFAULT_RUN_TIME = 1.0
+DEFAULT_WAIT_TIME = 1.0
+
+
+class ValidationResult:
+    """Outcome of validating a generated scene"""
+
+    def __init__(self):
+        self.errors = []
+        self.estimated_duration = 0.0
+        self.animation_count = 0
+        # Mobjects constructed in construct (loops multiply), and whether the scene is 3D
+        self.mobject_count = 0
+        self.three_d = False
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def to_dict(self):
+        return {
+            "ok": self.ok,
+            "errors": self.errors,
+            "estimated_duration": round(self.estimated_duration, 2),
+            "animation_count": self.animation_count,
+            "mobject_count": self.mobject_count,
+            "three_d": self.three_d,
+        }
+
+
+def validate_scene(code, max_duration=MAX_SCENE_SECONDS):
+    """
+    Statically check generated Manim code before spending render time on it.
+
+    Checks that the code parses, defines exactly one ManimScene class derived
+    from a Scene with a construct method, imports only allowed modules, calls
+    no forbidden builtins and contains no obviously unbounded loops. The total
+    run_time/wait duration of construct is estimated from the AST, along
+    with the number of mobjects it creates and whether it is a 3D scene.
+
+    Args:
+        code (str): Generated Manim code
+        max_duration (float): Longest acceptable estimated scene duration in seconds
+
+    Returns:
+        ValidationResult: Errors (if any) plus the duration and animation estimates
+    """
+    result = ValidationResult()
+
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        result.errors.append(f"Syntax error on line {e.lineno}: {e.msg}")
+        return result
+
+    _check_imports_and_calls(tree, result)
+    _check_loops(tree, result)
+
+    scene_classes = [node for node in tree.body if isinstance(node, ast.ClassDef) and node.name == 'ManimScene']
+    if len(scene_classes) != 1:
+        result.errors.append(f"Expected exactly one ManimScene class, found {len(scene_classes)}")
+        return result
+
+    scene = scene_classes[0]
+    if not any(_name_of(base).endswith('Scene') for base in scene.bases):
+        result.errors.append("ManimScene does not inherit from a Scene class")
+
+    methods = {node.name: node for node in scene.body if isinstance(node, ast.FunctionDef)}
+    if 'construct' not in methods:
+        result.errors.append("ManimScene has no construct method")
+        return result
+
+    estimator = _DurationEstimator(methods)
+    result.estimated_duration = estimator.estimate(methods['construct'].body)
+    result.animation_count = estimator.animation_count
+    result.mobject_count = estimator.mobject_count
+    result.three_d = any(_name_of(node).split('.')[-1] in THREE_D_NAMES
+                         for node in ast.walk(scene) if isinstance(node, (ast.Name, ast.Attribute)))
+    if result.estimated_duration > max_duration:
+        result.errors.append(
+            f"Estimated duration {result.estimated_duration:.0f}s exceeds the {max_duration:.0f}s limit"
+        )
+
+    return result
+
+
+def touches_shared_state(code):
+    """
+    Whether a scene may change state that outlives its render: module
+    globals of the modules it imports (manim, numpy...), builtins, or
+    classes it didn't define, by assigning to or deleting their attributes
+    or items, by `global` statements, or through setattr() and friends.
+
+    Scenes rendered in-process (backend/render_pool.py) share their worker
+    with later renders, so such a scene gets its worker recycled. Changing
+    objects bound in the scene itself (self, locals, its own classes) is fine.
+
+    Returns:
+        bool: True if it may (or if the code doesn't parse)
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return True
+
+    bound = set(RESTORED_NAMES)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            bound.add(node.id)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.add(node.name)
+
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Global, ast.Nonlocal)):
+            return True
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in STATE_CALLS:
+            return True
+        if isinstance(node, (ast.Attribute, ast.Subscript)) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            root = node.value
+            while isinstance(root, (ast.Attribute, ast.Subscript, ast.Call)):
+                root = root.func if isinstance(root, ast.Call) else root.value
+            if not isinstance(root, ast.Name) or root.id not in bound:
+                return True
+    return False
+
+
+def _name_of(node):
+    """Dotted name of a Name/Attribute node ('' for anything else)"""
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        parent = _name_of(node.value)
+        return f"{parent}.{node.attr}" if parent else node.attr
+    return ''
+
+
+def _constant_number(node):
+    """Value of a numeric literal (including simple negations and products), else None"""
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return float(node.value)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        value = _constant_number(node.operand)
+        return -value if value is not None else None
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Mult, ast.Add, ast.Div)):
+        left, right = _constant_number(node.left), _constant_number(node.right)
+        if left is None or right is None:
+            return None
+        if isinstance(node.op, ast.Mult):
+            return left * right
+        if isinstance(node.op, ast.Add):
+            return left + right
+        return left / right if right else None
+    return None
+
+
+def _check_imports_and_calls(tree, result):
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.name.split('.')[0] not in ALLOWED_IMPORTS:
+                    result.errors.append(f"Forbidden import '{alias.name}' on line {node.lineno}")
+        elif isinstance(node, ast.ImportFrom):
+            module = (node.module or '').split('.')[0]
+            if node.level or module not in ALLOWED_IMPORTS:
+                result.errors.append(f"Forbidden import from '{node.module}' on line {node.lineno}")
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FORBIDDEN_CALLS:
+            result.errors.append(f"Forbidden call to {node.func.id}() on line {node.lineno}")
+
+
+def _check_loops(tree, result):
+    for node in ast.walk(tree):
+        if isinstance(node, ast.While):
+            test = node.test
+            always_true = isinstance(test, ast.Constant) and bool(test.value)
+            has_exit = any(isinstance(n, (ast.Break, ast.Return, ast.Raise)) for n in ast.walk(node))
+            if always_true and not has_exit:
+                result.errors.append(f"Unbounded while loop on line {node.lineno}")
+        elif isinstance(node, ast.For) and isinstance(node.iter, ast.Call):
+            name = _name_of(node.iter.func).split('.')[-1]
+            if name in UNBOUNDED_ITERATORS and not any(isinstance(n, ast.Break) for n in ast.walk(node)):
+                result.errors.append(f"Unbounded for loop over {name}() on line {node.lineno}")
+
+
+class _DurationEstimator:
+    """
+    Sum self.play/self.wait durations over a method body.
+
+    Loops over range() or literal sequences multiply their body (and the
+    animation and mobject counts); other loops count once. A mobject is
+    any call of a capitalized name that isn't itself passed to self.play
+    (those are animations). Branches contribute their
+    longest arm. Calls to other methods of the scene are followed once
+    each, so recursion can't blow up.
+    """
+
+    def __init__(self, methods):
+        self.methods = methods
+        self.animation_count = 0
+        self.mobject_count = 0
+        self._multiplier = 1
+        # Calls passed straight to self.play, i.e. animations
+        self._animations = set()
+        self._visiting = set()
+
+    def estimate(self, statements):
+        return sum(self._statement(stmt) for stmt in statements)
+
+    def _statement(self, stmt):
+        if isinstance(stmt, ast.For):
+            iterations = self._iterations(stmt.iter)
+            outer = self._multiplier
+            self._multiplier *= iterations
+            body = self.estimate(stmt.body)
+            self._multiplier = outer
+            return body * iterations + self.estimate(stmt.orelse)
+        if isinstance(stmt, ast.While):
+            return self.estimate(stmt.body) + self.estimate(stmt.orelse)
+        if isinstance(stmt, ast.If):
+            return max(self.estimate(stmt.body), self.estimate(stmt.orelse))
+        if isinstance(stmt, (ast.With, ast.Try)):
+            return sum(self.estimate(getattr(stmt, field, [])) for field in ('body', 'orelse', 'finalbody'))
+        if isinstance(stmt, (ast.FunctionDef, ast.ClassDef)):
+            return 0.0
+        return sum(self._call(node) for node in ast.walk(stmt) if isinstance(node, ast.Call))
+
+    def _call(self, call):
+        func = call.func
+        if isinstance(func, ast.Name) and func.id[:1].isupper() and id(call) not in self._animations:
+            self.mobject_count += self._multiplier
+            return 0.0
+        if not (isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name) and func.value.id == 'self'):
+            return 0.0
+
+        if func.attr == 'play':
+            self.animation_count += self._multiplier
+            # ast.walk reaches the arguments after the call itself
+            self._animations.update(id(arg) for arg in call.args)
+            return self._play_duration(call)
+        if func.attr == 'wait':
+            self.animation_count += self._multiplier
+            arg = call.args[0] if call.args else self._keyword(call, 'duration')
+            value = _constant_number(arg) if arg is not None else DEFAULT_WAIT_TIME
+            return value if value is not None else DEFAULT_WAIT_TIME
+        if func.attr in self.methods and func.attr not in self._visiting:
+            self._visiting.add(func.attr)
+            return self.estimate(self.methods[func.attr].body)
+        return 0.0
+
+    def _play_duration(self, call):
+        run_time = self._keyword(call, 'run_time')
+        if run_time is not None:
+            value = _constant_number(run_time)
+            return value if value is not None else DEFAULT_RUN_TIME
+
+        # Without a play-level run_time, the longest animation decides
+        durations = []
+        for arg in call.args:
+            if isinstance(arg, ast.Call):
+                inner = self._keyword(arg, 'run_time')
+                value = _constant_number(inner) if inner is not None else None
+                durations.append(value if value is not None else DEFAULT_RUN_TIME)
+        return max(durations, default=DEFAULT_RUN_TIME)
+
+    def _iterations(self, iterable):
+        if isinstance(iterable, (ast.List, ast.Tuple, ast.Set)):
+            return len(iterable.elts)
+        if isinstance(iterable, ast.Call) and _name_of(iterable.func) == 'range':
+            args = [_constant_number(a) for a in iterable.args]
+            if args and all(a is not None for a in args):
+                start, stop, step = (0.0, args[0], 1.0) if len(args) == 1 else (args + [1.0])[:3]
+                if step:
+                    # Same as len(range(...)) for integers: a partial last step still runs
+                    return max(0, math.ceil((stop - start) / step))
+        return 1
+
+    @staticmethod
+    def _keyword(call, name):
+        for keyword in call.keywords:
+            if keyword.arg == name:
+                return keyword.value
+        return None
@@ -8,6 +8,10 @@ document.addEventListener('DOMContentLoaded', function() {
     const loadingStatus = document.getElementById('loading-status');
     const statusText = document.getElementById('status-text');
     const errorMessage = document.getElementById('error-message');
+    const previewContainer = document.getElementById('preview-container');
+    const previewImage = document.getElementById('preview-image');
+    const previewCaption = document.getElementById('preview-caption');
+    const previewCaptionText = previewCaption.textContent;
     const videoContainer = document.getElementById('video-container');
     const animationVideo = document.getElementById('animation-video');
     const codeContainer = document.getElementById('code-container');
@@ -52,25 +56,17 @@ document.addEventListener('DOMContentLoaded', function() {
         loadingStatus.style.display = 'block';
         generateBtn.disabled = true;
         
-        // Update status messages during generation
-        let statusMessages = [
-            'Analyzing your description...',
-            'Generating Manim code...',
-            'Running animation...',
-            'Rendering video...'
-        ];
+        // Status messages for each job state reported by the backend
+        const statusMessages = {
+            queued: 'Waiting for a render worker...',
+            generating_code: 'Generating Manim code...',
+            rendering: 'Rendering video...'
+        };
         
-        let messageIndex = 0;
-        statusText.textContent = statusMessages[messageIndex];
+        statusText.textContent = statusMessages.generating_code;
         
-        // Cycle through status messages to show progress
-        const messageInterval = setInterval(() => {
-            messageIndex = (messageIndex + 1) % statusMessages.length;
-            statusText.textContent = statusMessages[messageIndex];
-        }, 3000);
-        
-        // Send request to backend
-        fetch('/api/generate', {
+        // Send request to backend; the code streams in while Gemini writes it
+        fetch('/api/generate/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
@@ -78,21 +74,38 @@ document.addEventListener('DOMContentLoaded', function() {
             body: JSON.stringify({ description })
         })
         .then(response => {
-            clearInterval(messageInterval);
-            
             if (!response.ok) {
                 return response.json().then(data => {
                     throw new Error(data.error || 'Failed to generate animation');
                 });
             }
-            return response.json();
+            return readCodeStream(response);
         })
+        .then(job => job.status === 'completed' ? job : waitForJob(job.job_id, statusMessages))
         .then(data => {
+            // Display code
+            generatedCode.textContent = data.code || '';
+            codeContainer.style.display = 'block';
+            
+            if (!data.video_url) {
+                // Only the final frame was rendered, to make the deadline (see data.degradations)
+                if (!data.preview_url) {
+                    throw new Error('The animation has neither a video nor a preview.');
+                }
+                showPreview(data.preview_url);
+                previewCaption.textContent = data.rerender_job_id
+                    ? 'Only the final frame could be rendered in time; the full video is still rendering'
+                    : 'Only the final frame could be rendered in time';
+                loadingStatus.style.display = 'none';
+                return;
+            }
+            
             // Update status
             statusText.textContent = 'Animation generated successfully!';
             
-            // Display video
+            // Display video in place of the preview
             animationVideo.src = data.video_url;
+            previewContainer.style.display = 'none';
             videoContainer.style.display = 'block';
             
             // Add event listener for video loaded
@@ -101,17 +114,12 @@ document.addEventListener('DOMContentLoaded', function() {
                 loadingStatus.style.display = 'none';
             };
             
-            // Display code
-            generatedCode.textContent = data.code;
-            codeContainer.style.display = 'block';
-            
             // Handle video loading error
             animationVideo.onerror = function() {
                 showError('Error loading the video. Please try again.');
             };
         })
         .catch(error => {
-            clearInterval(messageInterval);
             showError(error.message || 'An error occurred while generating the animation.');
         })
         .finally(() => {
@@ -119,6 +127,137 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
     
+    // Read the server-sent events from /api/generate/stream, showing the
+    // code as it arrives; resolves with the queued job
+    function readCodeStream(response) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let job = null;
+        
+        const handleEvent = (rawEvent) => {
+            let event = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) {
+                    event = line.slice(7);
+                } else if (line.startsWith('data: ')) {
+                    data += line.slice(6);
+                }
+            });
+            const payload = JSON.parse(data);
+            
+            if (event === 'code') {
+                generatedCode.textContent = payload.code;
+                codeContainer.style.display = 'block';
+            } else if (event === 'aborted') {
+                statusText.textContent = 'Generated code was invalid, using a template instead...';
+            } else if (event === 'error') {
+                throw new Error(payload.error);
+            } else if (event === 'job') {
+                job = payload;
+            }
+        };
+        
+        const read = () => reader.read().then(({ done, value }) => {
+            if (done) {
+                if (!job) {
+                    throw new Error('Failed to generate animation');
+                }
+                return job;
+            }
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+            events.forEach(handleEvent);
+            return read();
+        });
+        
+        return read();
+    }
+    
+    // Follow the job's event stream until it completes or fails,
+    // falling back to polling where server-sent events aren't available
+    function waitForJob(jobId, statusMessages) {
+        if (!window.EventSource) {
+            return pollJob(jobId, statusMessages);
+        }
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(`/api/events/${jobId}`);
+            let progress = null;
+            
+            source.addEventListener('status', event => {
+                const data = JSON.parse(event.data);
+                if (data.status === 'completed') {
+                    source.close();
+                    resolve(data);
+                } else if (data.status === 'failed') {
+                    source.close();
+                    reject(new Error(data.error || 'Failed to generate animation'));
+                } else {
+                    showJobStatus(data, statusMessages, progress);
+                }
+            });
+            
+            source.addEventListener('progress', event => {
+                progress = JSON.parse(event.data);
+                statusText.textContent = progressMessage(progress);
+            });
+            
+            source.onerror = () => {
+                // The stream dropped or isn't supported by a proxy in between
+                source.close();
+                pollJob(jobId, statusMessages).then(resolve, reject);
+            };
+        });
+    }
+    
+    // Poll the status endpoint until the job completes or fails
+    function pollJob(jobId, statusMessages) {
+        return new Promise((resolve, reject) => {
+            const poll = () => {
+                fetch(`/api/status/${jobId}`)
+                    .then(response => response.json())
+                    .then(data => {
+                        if (data.status === 'completed') {
+                            resolve(data);
+                        } else if (data.status === 'failed' || data.status === 'not_found') {
+                            reject(new Error(data.error || 'Failed to generate animation'));
+                        } else {
+                            showJobStatus(data, statusMessages, data.progress);
+                            setTimeout(poll, 1000);
+                        }
+                    })
+                    .catch(reject);
+            };
+            poll();
+        });
+    }
+    
+    // Show the status text (and preview, once there is one) of a running job
+    function showJobStatus(data, statusMessages, progress) {
+        if (data.preview_url && !previewImage.src) {
+            showPreview(data.preview_url);
+        }
+        if (data.status === 'rendering' && progress) {
+            statusText.textContent = progressMessage(progress);
+        } else {
+            statusText.textContent = previewImage.src
+                ? 'Preview ready, rendering the full video...'
+                : statusMessages[data.status] || 'Processing...';
+        }
+    }
+    
+    function progressMessage(progress) {
+        return `Rendering animation ${progress.animation} of ${progress.total}...`;
+    }
+    
+    // Show the last-frame preview while the full video renders
+    function showPreview(url) {
+        previewImage.src = url;
+        previewContainer.style.display = 'block';
+    }
+    
     // Show error message
     function showError(message) {
         errorMessage.textContent = message;
@@ -129,6 +268,9 @@ document.addEventListener('DOMContentLoaded', function() {
     // Reset UI elements
     function resetUI() {
         errorMessage.style.display = 'none';
+        previewContainer.style.display = 'none';
+        previewImage.removeAttribute('src');
+        previewCaption.textContent = previewCaptionText;
         videoContainer.style.display = 'none';
         codeContainer.style.display = 'none';
         animationVideo.src = '';
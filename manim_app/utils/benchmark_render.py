@@ -0,0 +1,112 @@
+"""
+Compare cold-subprocess and warm-pool render latency.
+
+Renders the scenes used by utils/test_api.py with both backends and prints
+per-scene and overall timings. Code is generated with the template-based
+converter so the benchmark needs no network access.
+
+Usage:
+    python3 utils/benchmark_render.py --iterations 3 --json bench.json
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import time
+import uuid
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.renderer import MEDIA_FOLDER, TEMP_FOLDER, run_manim_subprocess, run_manim_warm, get_render_pool
+from backend.text_to_manim import template_based_text_to_manim_code
+from utils.test_api import SIMPLE_DESCRIPTIONS, COMPLEX_DESCRIPTIONS
+
+BACKENDS = {
+    "cold_subprocess": run_manim_subprocess,
+    "warm_pool": run_manim_warm,
+}
+
+
+def write_script(description):
+    """Write the scene to a uniquely named script so Manim's own cache never kicks in"""
+    job_id = f"bench-{uuid.uuid4()}"
+    script_path = os.path.join(TEMP_FOLDER, f"{job_id}.py")
+    with open(script_path, 'w') as f:
+        f.write(template_based_text_to_manim_code(description, job_id))
+    return job_id, script_path
+
+
+def cleanup(job_id, script_path):
+    os.remove(script_path)
+    shutil.rmtree(os.path.join(MEDIA_FOLDER, 'videos', job_id), ignore_errors=True)
+
+
+def time_render(render, description):
+    job_id, script_path = write_script(description)
+    try:
+        start = time.perf_counter()
+        render(script_path, job_id)
+        return time.perf_counter() - start
+    finally:
+        cleanup(job_id, script_path)
+
+
+def summarize(samples):
+    return {
+        "runs": len(samples),
+        "mean_s": round(statistics.mean(samples), 3),
+        "median_s": round(statistics.median(samples), 3),
+        "min_s": round(min(samples), 3),
+        "max_s": round(max(samples), 3),
+    }
+
+
+def run_benchmark(iterations):
+    descriptions = SIMPLE_DESCRIPTIONS + COMPLEX_DESCRIPTIONS
+
+    # Start the pool up front: worker start-up is a one-off cost, not per-job latency
+    get_render_pool().start()
+
+    results = {}
+    for name, render in BACKENDS.items():
+        per_scene = {}
+        for description in descriptions:
+            samples = [time_render(render, description) for _ in range(iterations)]
+            per_scene[description] = summarize(samples)
+        all_samples = [s["mean_s"] for s in per_scene.values()]
+        results[name] = {"scenes": per_scene, "overall_mean_s": round(statistics.mean(all_samples), 3)}
+
+    get_render_pool().shutdown()
+    return results
+
+
+def print_report(results):
+    cold = results["cold_subprocess"]
+    warm = results["warm_pool"]
+
+    print(f"\n{'Scene':<70} {'cold (s)':>10} {'warm (s)':>10} {'speedup':>8}")
+    for description in cold["scenes"]:
+        c = cold["scenes"][description]["median_s"]
+        w = warm["scenes"][description]["median_s"]
+        print(f"{description[:70]:<70} {c:>10.3f} {w:>10.3f} {c / w:>7.2f}x")
+
+    print(f"\nOverall mean: cold {cold['overall_mean_s']:.3f}s, warm {warm['overall_mean_s']:.3f}s "
+          f"({cold['overall_mean_s'] / warm['overall_mean_s']:.2f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark cold-subprocess vs warm-pool Manim rendering')
+    parser.add_argument('--iterations', type=int, default=3, help='Renders per scene and backend')
+    parser.add_argument('--json', type=str, help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.iterations)
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
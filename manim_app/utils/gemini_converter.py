@@ -1,16 +1,73 @@
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+import ast
 import os
 import logging
+import time
+
+from backend.codegen import CodeBackend
+from backend.metrics import time_stage, stage_seconds
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class GeminiTextToManimConverter:
+# How many new complete lines to wait for between syntax checks while streaming
+STREAM_CHECK_EVERY_LINES = 5
+
+# Provider errors worth retrying: timeouts, rate limits and transient server failures
+_RETRYABLE_ERRORS = (
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    TimeoutError,
+    ConnectionError,
+)
+
+# SyntaxError messages that only mean the program isn't finished yet
+_INCOMPLETE_CODE_MESSAGES = (
+    'was never closed',
+    'unexpected EOF',
+    'unterminated triple-quoted string',
+    'expected an indented block',
+)
+
+def find_partial_syntax_error(partial_code):
+    """
+    Check a prefix of a program for errors that no continuation can fix.
+    
+    Args:
+        partial_code (str): Code generated so far, cut at a line boundary
+        
+    Returns:
+        SyntaxError or None: The error if the code is already broken, None if it may still be valid
+    """
+    try:
+        ast.parse(partial_code)
+        return None
+    except SyntaxError as e:
+        if any(message in (e.msg or '') for message in _INCOMPLETE_CODE_MESSAGES):
+            return None
+        # An error on the last line or two may be resolved by the lines still to come
+        last_line = partial_code.rstrip('\n').count('\n') + 1
+        if e.lineno is None or e.lineno >= last_line - 1:
+            return None
+        return e
+
+class GeminiTextToManimConverter(CodeBackend):
     """
     A class to convert natural language descriptions to Manim code using Google's Gemini 1.5 Pro API.
+    
+    The model (and the client connections behind it) is created once and
+    reused for every call made through the converter.
     """
     
+    # Model and prompt revision; both are part of the generated-code cache key,
+    # so bump PROMPT_VERSION whenever _create_prompt changes
+    MODEL_NAME = 'gemini-1.5-pro'
+    PROMPT_VERSION = 1
+    
     def __init__(self, api_key):
         """
         Initialize the converter with the Google API key.
@@ -25,41 +82,109 @@ class GeminiTextToManimConverter:
         """Configure the Gemini API with the provided key."""
         try:
             genai.configure(api_key=self.api_key)
-            self.model = genai.GenerativeModel('gemini-1.5-pro')
+            self.model = genai.GenerativeModel(self.MODEL_NAME)
             logger.info("Gemini API configured successfully")
         except Exception as e:
             logger.error(f"Error configuring Gemini API: {str(e)}")
             raise
     
-    def convert_to_manim_code(self, description, job_id=None):
+    def convert_to_manim_code(self, description, job_id=None, use_fallback=True, timeout=None):
         """
         Convert a natural language description to Manim code using Gemini.
         
         Args:
             description (str): Natural language description of the animation
             job_id (str, optional): Unique identifier for the job
+            use_fallback (bool): Return a simple template instead of raising if Gemini fails
+            timeout (float, optional): Seconds the API call may take
             
         Returns:
             str: Generated Manim code
         """
         try:
             # Create a prompt that instructs Gemini to generate Manim code
-            prompt = self._create_prompt(description)
+            with time_stage('prompt_build'):
+                prompt = self._create_prompt(description)
             
             # Generate the code using Gemini
-            response = self.model.generate_content(prompt)
+            with time_stage('gemini_call'):
+                response = self.model.generate_content(prompt, request_options=self._request_options(timeout))
+                response_text = response.text
             
             # Extract and format the Manim code
-            manim_code = self._extract_code(response.text)
+            with time_stage('code_extraction'):
+                manim_code = self._extract_code(response_text)
             
             logger.info(f"Successfully generated Manim code for description: '{description}'")
             return manim_code
             
         except Exception as e:
             logger.error(f"Error generating Manim code: {str(e)}")
+            if not use_fallback:
+                raise
             # Fall back to a simple template if Gemini fails
             return self._fallback_template(description)
     
+    def stream_manim_code(self, description, job_id=None, timeout=None):
+        """
+        Stream Manim code from Gemini as it is generated.
+        
+        The partial code is syntax-checked every few lines, and generation is
+        abandoned as soon as it can no longer become a valid program.
+        
+        Args:
+            description (str): Natural language description of the animation
+            job_id (str, optional): Unique identifier for the job
+            timeout (float, optional): Seconds the API call may take
+            
+        Yields:
+            tuple: (code, done) - the cleaned code so far, with done=True on the
+            final item, which carries the complete extracted code
+            
+        Raises:
+            SyntaxError: If the partial code is clearly broken, or the final code doesn't parse
+        """
+        with time_stage('prompt_build'):
+            prompt = self._create_prompt(description)
+        started = time.perf_counter()
+        response = self.model.generate_content(prompt, stream=True, request_options=self._request_options(timeout))
+        
+        text = ''
+        checked_lines = 0
+        for chunk in response:
+            if not text:
+                stage_seconds.observe(time.perf_counter() - started, stage='gemini_first_chunk')
+            text += chunk.text
+            code = self._strip_fences(text)
+            yield code, False
+            
+            # Only check complete lines; the last one may still be mid-token
+            complete = code[:code.rfind('\n') + 1]
+            lines = complete.count('\n')
+            if lines - checked_lines >= STREAM_CHECK_EVERY_LINES:
+                checked_lines = lines
+                error = find_partial_syntax_error(complete)
+                if error is not None:
+                    logger.warning(f"Aborting generation for job {job_id} at line {lines}: {error.msg} (line {error.lineno})")
+                    raise error
+        
+        stage_seconds.observe(time.perf_counter() - started, stage='gemini_call')
+        
+        with time_stage('code_extraction'):
+            manim_code = self._extract_code(text)
+        # The stream has ended, so nothing can complete the code any more: it must parse as it is
+        ast.parse(manim_code)
+        
+        logger.info(f"Successfully streamed Manim code for description: '{description}'")
+        yield manim_code, True
+    
+    def is_retryable(self, error):
+        """Retry timeouts, rate limits and transient server errors, not bad requests or broken code"""
+        return isinstance(error, _RETRYABLE_ERRORS)
+    
+    def _request_options(self, timeout):
+        return {"timeout": timeout} if timeout is not None else None
+    
     def _create_prompt(self, description):
         """
         Create a detailed prompt for Gemini to generate Manim code.
@@ -101,7 +226,7 @@ class GeminiTextToManimConverter:
             str: Cleaned Manim code
         """
         # Remove any markdown code block indicators if present
-        code = response_text.replace("```python", "").replace("```", "").strip()
+        code = self._strip_fences(response_text)
         
         # Ensure the code has the necessary imports
         if "from manim import" not in code:
@@ -114,6 +239,10 @@ class GeminiTextToManimConverter:
         
         return code
     
+    def _strip_fences(self, response_text):
+        """Remove markdown code block indicators from (possibly partial) response text"""
+        return response_text.replace("```python", "").replace("```", "").strip()
+    
     def _fallback_template(self, description):
         """
         Provide a simple fallback template if Gemini fails.
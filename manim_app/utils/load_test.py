@@ -0,0 +1,402 @@
+"""
+Load-test the running API and report latency, throughput and error rates.
+
+Submits descriptions from utils/test_api.py at a configurable arrival rate
+(open loop: new requests arrive on schedule whether or not earlier ones have
+finished) and follows each job to a final state. End-to-end latency is
+measured by the client; per-stage latency comes from the server's
+/api/metrics histograms, scraped before and after the run.
+
+Start the server with CODE_GENERATOR=stub to replace Gemini with a
+deterministic local stub so runs need no network:
+
+    CODE_GENERATOR=stub STUB_LATENCY_SECONDS=0.5 python3 app.py
+
+Usage:
+    python3 utils/load_test.py --rate 0.5 --duration 60 --mix simple=3,complex=1 --json run.json
+    python3 utils/load_test.py --rate 0.5 --duration 60 --json new.json --compare run.json
+"""
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import requests
+
+# Add the project root to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.test_api import BASE_URL, SIMPLE_DESCRIPTIONS, COMPLEX_DESCRIPTIONS
+
+PROMPT_SETS = {
+    "simple": SIMPLE_DESCRIPTIONS,
+    "complex": COMPLEX_DESCRIPTIONS,
+}
+
+PERCENTILES = (50, 95, 99)
+
+# Outcomes other than "completed" count as errors
+COMPLETED = 'completed'
+FAILED = 'failed'          # the job reached the failed state
+REJECTED = 'rejected'      # 429 from /api/generate (queue full)
+TIMED_OUT = 'timeout'      # no final state within --job-timeout
+HTTP_ERROR = 'http_error'  # any other unexpected response or connection error
+
+HISTOGRAM_SAMPLE = re.compile(r'^manim_app_(\w+)_bucket\{(.*)\} (\S+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_mix(spec):
+    """Parse 'simple=3,complex=1' into {prompt set: weight}"""
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in PROMPT_SETS:
+            raise argparse.ArgumentTypeError(f"Unknown prompt set '{name}', expected one of {sorted(PROMPT_SETS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(samples, pct):
+    """Linearly interpolated percentile of a list of numbers, or None if it is empty"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def summarize(samples):
+    summary = {"count": len(samples)}
+    if samples:
+        summary["mean_s"] = round(sum(samples) / len(samples), 3)
+        summary["max_s"] = round(max(samples), 3)
+        for pct in PERCENTILES:
+            summary[f"p{pct}_s"] = round(percentile(samples, pct), 3)
+    return summary
+
+
+def scrape_histograms(base_url):
+    """
+    Read the cumulative bucket counts of every histogram from /api/metrics.
+
+    Returns:
+        dict: {(metric, label value): {upper bound: cumulative count}}, or {} if unavailable
+    """
+    try:
+        response = requests.get(f"{base_url}/api/metrics", timeout=10)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        print(f"Could not scrape metrics: {e}")
+        return {}
+
+    histograms = {}
+    for line in response.text.splitlines():
+        match = HISTOGRAM_SAMPLE.match(line)
+        if not match:
+            continue
+        metric, labels, value = match.groups()
+        labels = dict(LABEL.findall(labels))
+        bound = float(labels.pop('le'))
+        # stage_seconds has one label (stage), job_seconds one (state)
+        key = (metric, next(iter(labels.values()), ''))
+        histograms.setdefault(key, {})[bound] = float(value)
+    return histograms
+
+
+def histogram_quantile(buckets, pct):
+    """Estimate a percentile from cumulative buckets, interpolating within the bucket (as Prometheus does)"""
+    bounds = sorted(buckets)
+    total = buckets[bounds[-1]]
+    if total <= 0:
+        return None
+    rank = total * pct / 100
+    previous_bound, previous_count = 0.0, 0.0
+    for bound in bounds:
+        count = buckets[bound]
+        if count >= rank:
+            if bound == float('inf'):
+                return previous_bound
+            return previous_bound + (bound - previous_bound) * (rank - previous_count) / (count - previous_count)
+        previous_bound, previous_count = bound, count
+    return previous_bound
+
+
+def stage_latencies(before, after):
+    """
+    Per-stage and per-state percentiles of the observations made during the run.
+
+    Returns:
+        dict: {"stages": {stage: summary}, "jobs": {state: summary}}
+    """
+    sections = {"stage_seconds": "stages", "job_seconds": "jobs"}
+    result = {"stages": {}, "jobs": {}}
+    for (metric, label), buckets in after.items():
+        if metric not in sections:
+            continue
+        baseline = before.get((metric, label), {})
+        delta = {bound: count - baseline.get(bound, 0) for bound, count in buckets.items()}
+        count = int(delta[float('inf')])
+        if count <= 0:
+            continue
+        summary = {"count": count}
+        for pct in PERCENTILES:
+            summary[f"p{pct}_s"] = round(histogram_quantile(delta, pct), 3)
+        result[sections[metric]][label] = summary
+    return result
+
+
+class LoadTest:
+    """Open-loop load generator following each job to completion"""
+
+    def __init__(self, base_url, rate, mix, quality=None, unique=False, arrival='poisson',
+                 job_timeout=300, poll_interval=0.25, seed=None):
+        self.base_url = base_url.rstrip('/')
+        self.rate = rate
+        self.mix = mix
+        self.quality = quality
+        self.unique = unique
+        self.arrival = arrival
+        self.job_timeout = job_timeout
+        self.poll_interval = poll_interval
+        self.random = random.Random(seed)
+        self.run_id = uuid.uuid4().hex[:8]
+        self.results = []
+        # Seconds between the first and the last arrival
+        self.submit_window = 0.0
+        self._lock = threading.Lock()
+
+    def pick_description(self, index):
+        names = list(self.mix)
+        prompt_set = self.random.choices(names, weights=[self.mix[name] for name in names])[0]
+        description = self.random.choice(PROMPT_SETS[prompt_set])
+        if self.unique:
+            # A distinct description defeats the code and video caches
+            description = f"{description} (load test {self.run_id}-{index})"
+        return prompt_set, description
+
+    def next_gap(self):
+        if self.arrival == 'constant':
+            return 1 / self.rate
+        return self.random.expovariate(self.rate)
+
+    def run(self, duration=None, total_requests=None):
+        """Submit requests until `duration` seconds have passed or `total_requests` were sent"""
+        threads = []
+        start = time.perf_counter()
+        next_arrival = start
+        index = 0
+        while True:
+            if total_requests is not None and index >= total_requests:
+                break
+            if duration is not None and next_arrival - start >= duration:
+                break
+            time.sleep(max(0, next_arrival - time.perf_counter()))
+            self.submit_window = time.perf_counter() - start
+
+            prompt_set, description = self.pick_description(index)
+            thread = threading.Thread(target=self.one_request, args=(prompt_set, description), daemon=True)
+            thread.start()
+            threads.append(thread)
+
+            index += 1
+            next_arrival += self.next_gap()
+
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+    def one_request(self, prompt_set, description):
+        result = {"prompt_set": prompt_set, "description": description}
+        payload = {"description": description}
+        if self.quality:
+            payload["quality"] = self.quality
+
+        start = time.perf_counter()
+        try:
+            response = requests.post(f"{self.base_url}/api/generate", json=payload, timeout=30)
+            result["submit_s"] = round(time.perf_counter() - start, 3)
+            result["http_status"] = response.status_code
+
+            if response.status_code == 429:
+                result["outcome"] = REJECTED
+            elif response.status_code != 202:
+                result["outcome"] = HTTP_ERROR
+                result["error"] = response.text[:200]
+            else:
+                result["job_id"] = response.json()["job_id"]
+                self.follow_job(result, start)
+        except requests.RequestException as e:
+            result["outcome"] = HTTP_ERROR
+            result["error"] = str(e)
+
+        with self._lock:
+            self.results.append(result)
+
+    def follow_job(self, result, start):
+        """Poll the job's status until it completes, fails or --job-timeout passes"""
+        deadline = start + self.job_timeout
+        while time.perf_counter() < deadline:
+            status = requests.get(f"{self.base_url}/api/status/{result['job_id']}", timeout=10).json()
+            state = status.get('status')
+            if state == COMPLETED:
+                result["outcome"] = COMPLETED
+                result["end_to_end_s"] = round(time.perf_counter() - start, 3)
+                result["cached"] = status.get('cached', False)
+                return
+            if state in (FAILED, 'not_found'):
+                result["outcome"] = FAILED
+                result["error"] = status.get('error')
+                return
+            time.sleep(self.poll_interval)
+        result["outcome"] = TIMED_OUT
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_report(load_test, elapsed, stages, args):
+    results = load_test.results
+    outcomes = {}
+    for result in results:
+        outcomes[result["outcome"]] = outcomes.get(result["outcome"], 0) + 1
+    completed = [r for r in results if r["outcome"] == COMPLETED]
+    errors = len(results) - len(completed)
+
+    return {
+        "run": {
+            "git_revision": git_revision(),
+            "started_at": time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(time.time() - elapsed)),
+            "base_url": load_test.base_url,
+            "rate": args.rate,
+            "arrival": args.arrival,
+            "mix": load_test.mix,
+            "quality": args.quality,
+            "unique": args.unique,
+            "seed": args.seed,
+        },
+        "requests": len(results),
+        "elapsed_s": round(elapsed, 3),
+        # Arrivals per second actually achieved, which --rate only sets on average
+        "offered_rps": round((len(results) - 1) / load_test.submit_window, 3) if load_test.submit_window else None,
+        "throughput_rps": round(len(completed) / elapsed, 3) if elapsed else None,
+        "outcomes": outcomes,
+        "error_rate": round(errors / len(results), 4) if results else None,
+        "cache_hits": sum(1 for r in completed if r.get("cached")),
+        "submit": summarize([r["submit_s"] for r in results if "submit_s" in r]),
+        "end_to_end": summarize([r["end_to_end_s"] for r in completed]),
+        "end_to_end_by_prompt_set": {
+            name: summarize([r["end_to_end_s"] for r in completed if r["prompt_set"] == name])
+            for name in load_test.mix
+        },
+        "stages": stages["stages"],
+        "jobs": stages["jobs"],
+        "results": results,
+    }
+
+
+def _fmt(value, unit='s'):
+    return '-' if value is None else f"{value:.3f}{unit}"
+
+
+def print_report(report):
+    print(f"\n{report['requests']} requests in {report['elapsed_s']:.1f}s "
+          f"(offered {report['offered_rps']} req/s, completed {report['throughput_rps']} req/s)")
+    print(f"Outcomes: {report['outcomes']}  error rate: {report['error_rate']:.2%}  "
+          f"cache hits: {report['cache_hits']}")
+
+    rows = [("submit", report["submit"]), ("end_to_end", report["end_to_end"])]
+    rows += [(f"  {name}", summary) for name, summary in report["end_to_end_by_prompt_set"].items()]
+    rows += [(f"stage:{name}", summary) for name, summary in sorted(report["stages"].items())]
+    rows += [(f"job:{name}", summary) for name, summary in sorted(report["jobs"].items())]
+
+    print(f"\n{'Latency':<28} {'count':>6} " + ' '.join(f"{f'p{pct}':>9}" for pct in PERCENTILES))
+    for name, summary in rows:
+        values = ' '.join(f"{_fmt(summary.get(f'p{pct}_s')):>9}" for pct in PERCENTILES)
+        print(f"{name:<28} {summary['count']:>6} {values}")
+
+
+def compare_reports(baseline, current):
+    """Print the change in headline numbers from a baseline report to the current one"""
+    def change(old, new):
+        if old is None or new is None:
+            return '-'
+        if old == 0:
+            return 'n/a'
+        return f"{(new - old) / old:+.1%}"
+
+    rows = [
+        ("throughput_rps", baseline.get("throughput_rps"), current.get("throughput_rps")),
+        ("error_rate", baseline.get("error_rate"), current.get("error_rate")),
+    ]
+    for pct in PERCENTILES:
+        key = f"p{pct}_s"
+        rows.append((f"end_to_end {key}", baseline["end_to_end"].get(key), current["end_to_end"].get(key)))
+    for stage in sorted(set(baseline.get("stages", {})) | set(current.get("stages", {}))):
+        rows.append((f"stage:{stage} p95_s",
+                     baseline.get("stages", {}).get(stage, {}).get("p95_s"),
+                     current.get("stages", {}).get(stage, {}).get("p95_s")))
+
+    print(f"\nCompared with {baseline['run'].get('git_revision') or 'baseline'} "
+          f"({baseline['run'].get('started_at')}):")
+    print(f"{'Metric':<40} {'baseline':>10} {'current':>10} {'change':>9}")
+    for name, old, new in rows:
+        print(f"{name:<40} {'-' if old is None else old:>10} {'-' if new is None else new:>10} {change(old, new):>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load-test the Manim app API')
+    parser.add_argument('--base-url', default=BASE_URL, help='Server to test')
+    parser.add_argument('--rate', type=float, default=0.5, help='Mean arrival rate in requests per second')
+    parser.add_argument('--arrival', choices=['poisson', 'constant'], default='poisson',
+                        help='Exponential (poisson) or fixed gaps between arrivals')
+    parser.add_argument('--duration', type=float, help='Seconds to keep submitting requests')
+    parser.add_argument('--requests', type=int, help='Number of requests to submit')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('simple=1,complex=1'),
+                        help='Weighted prompt sets, e.g. simple=3,complex=1')
+    parser.add_argument('--quality', choices=['l', 'm', 'h', 'k'], help='Render quality to request')
+    parser.add_argument('--unique', action='store_true',
+                        help='Make every description unique so the result cache is bypassed')
+    parser.add_argument('--job-timeout', type=float, default=300, help='Seconds to wait for each job')
+    parser.add_argument('--poll-interval', type=float, default=0.25, help='Seconds between status polls')
+    parser.add_argument('--seed', type=int, help='Seed for arrivals and prompt choice, for repeatable runs')
+    parser.add_argument('--json', type=str, help='Write the results to this JSON file')
+    parser.add_argument('--compare', type=str, help='Baseline JSON file from an earlier run to compare with')
+    args = parser.parse_args()
+
+    if args.duration is None and args.requests is None:
+        args.requests = 20
+
+    load_test = LoadTest(args.base_url, args.rate, args.mix, quality=args.quality, unique=args.unique,
+                         arrival=args.arrival, job_timeout=args.job_timeout,
+                         poll_interval=args.poll_interval, seed=args.seed)
+
+    before = scrape_histograms(load_test.base_url)
+    elapsed = load_test.run(duration=args.duration, total_requests=args.requests)
+    after = scrape_histograms(load_test.base_url)
+
+    report = build_report(load_test, elapsed, stage_latencies(before, after), args)
+    print_report(report)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_reports(json.load(f), report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.json}")
@@ -0,0 +1,55 @@
+import json
+import os
+import time
+
+from backend.codegen import CodeBackend, check_latency, recording_path, stream_lines
+from backend.metrics import time_stage
+
+# Multiplier on the recorded latency: 1 replays it as recorded, 0 answers instantly
+REPLAY_SPEED = float(os.environ.get('CODEGEN_REPLAY_SPEED', '1'))
+
+class ReplayTextToManimConverter(CodeBackend):
+    """
+    Serves Gemini responses recorded with CODEGEN_RECORD=1, offline.
+
+    Each response is replayed after the latency it originally took (scaled
+    by REPLAY_SPEED), so throughput can be tuned against realistic code and
+    timings without the network. Selected with CODE_GENERATOR=replay.
+    """
+
+    MODEL_NAME = 'replay'
+    PROMPT_VERSION = 1
+
+    def __init__(self, directory, speed=REPLAY_SPEED):
+        self.directory = directory
+        self.speed = speed
+
+    def convert_to_manim_code(self, description, job_id=None, use_fallback=True, timeout=None):
+        """
+        Return the recorded Manim code for a description.
+
+        Raises:
+            LookupError: If nothing was recorded for the description
+            CodeGenerationTimeout: If the recorded latency is longer than `timeout`
+        """
+        recording = self._load(description)
+        with time_stage('gemini_call'):
+            latency = recording.get("seconds", 0) * self.speed
+            check_latency(latency, timeout)
+            time.sleep(latency)
+        return recording["code"]
+
+    def stream_manim_code(self, description, job_id=None, timeout=None):
+        """Yield the recorded code one line at a time over its recorded latency"""
+        recording = self._load(description)
+        latency = recording.get("seconds", 0) * self.speed
+        check_latency(latency, timeout)
+        yield from stream_lines(recording["code"], latency)
+
+    def _load(self, description):
+        path = recording_path(description, self.directory)
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise LookupError(f"No recorded response for '{description}' in {self.directory}")
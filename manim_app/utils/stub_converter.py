@@ -0,0 +1,51 @@
+import os
+import time
+
+from backend.codegen import CodeBackend, check_latency, stream_lines
+from backend.metrics import time_stage
+from backend.text_to_manim import template_based_text_to_manim_code
+
+# Simulated generation latency, standing in for the Gemini round trip
+STUB_LATENCY_SECONDS = float(os.environ.get('STUB_LATENCY_SECONDS', '0.5'))
+
+class StubTextToManimConverter(CodeBackend):
+    """
+    Deterministic, offline stand-in for GeminiTextToManimConverter.
+
+    Returns the template-based scene for a description after a fixed delay,
+    so load tests exercise the whole pipeline without network access or API
+    quota. Selected with CODE_GENERATOR=stub.
+    """
+
+    # Part of the generated-code cache key, kept apart from Gemini's entries
+    MODEL_NAME = 'stub'
+    PROMPT_VERSION = 1
+
+    def __init__(self, latency=STUB_LATENCY_SECONDS):
+        self.latency = latency
+
+    def convert_to_manim_code(self, description, job_id=None, use_fallback=True, timeout=None):
+        """
+        Return the template-based Manim code for a description.
+
+        Args:
+            description (str): Natural language description of the animation
+            job_id (str, optional): Unique identifier for the job
+            use_fallback (bool): Accepted for compatibility; the stub never fails
+            timeout (float, optional): Raise CodeGenerationTimeout if the delay is longer
+
+        Returns:
+            str: Generated Manim code
+        """
+        with time_stage('gemini_call'):
+            check_latency(self.latency, timeout)
+            time.sleep(self.latency)
+            return self._template(description, job_id)
+
+    def stream_manim_code(self, description, job_id=None, timeout=None):
+        """Yield the template-based code one line at a time, spreading the delay over the lines"""
+        check_latency(self.latency, timeout)
+        yield from stream_lines(self._template(description, job_id), self.latency)
+
+    def _template(self, description, job_id):
+        return template_based_text_to_manim_code(description, job_id)
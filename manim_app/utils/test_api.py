@@ -8,6 +8,19 @@ import sys
 BASE_URL = "http://localhost:8000"
 API_URL = f"{BASE_URL}/api"
 
+# Descriptions exercised by the tests (also used by utils/benchmark_render.py)
+SIMPLE_DESCRIPTIONS = [
+    "Create a blue circle",
+    "Draw a red square",
+    "Write the text \"Hello, Manim!\"",
+]
+
+COMPLEX_DESCRIPTIONS = [
+    "Create a blue circle and transform it into a red square",
+    "Write the text \"Animation\" and fade in a green triangle below it",
+    "Draw a square, rotate it, and then fade it out"
+]
+
 def test_health_endpoint():
     """Test the health check endpoint"""
     print("Testing health endpoint...")
@@ -22,6 +35,25 @@ def test_health_endpoint():
         print(f"Response: {response.text}")
         return False
 
+def wait_for_job(job_id, timeout=180):
+    """Poll the status endpoint until the job finishes"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = requests.get(f"{API_URL}/status/{job_id}")
+        result = response.json()
+        status = result.get('status')
+        
+        if status == 'completed':
+            return result
+        if status in ('failed', 'not_found'):
+            print(f"❌ Job {job_id} {status}: {result.get('error')}")
+            return None
+        
+        time.sleep(1)
+    
+    print(f"❌ Job {job_id} did not finish within {timeout} seconds")
+    return None
+
 def test_generate_animation(description):
     """Test the animation generation endpoint"""
     print(f"\nTesting animation generation with description: '{description}'")
@@ -35,10 +67,14 @@ def test_generate_animation(description):
             timeout=60  # 60-second timeout for animation generation
         )
         
-        if response.status_code == 200:
-            result = response.json()
+        if response.status_code == 202:
+            job_id = response.json().get('job_id')
+            print(f"Job ID: {job_id}")
+            result = wait_for_job(job_id)
+            if not result:
+                return None
+            
             print("✅ Animation generation successful")
-            print(f"Job ID: {result.get('job_id')}")
             print(f"Video URL: {result.get('video_url')}")
             
             # Check if the video is accessible
@@ -74,26 +110,14 @@ def run_tests():
         return
     
     # Test simple animation generation
-    simple_descriptions = [
-        "Create a blue circle",
-        "Draw a red square",
-        "Write the text \"Hello, Manim!\"",
-    ]
-    
-    for description in simple_descriptions:
+    for description in SIMPLE_DESCRIPTIONS:
         result = test_generate_animation(description)
         if not result:
             print(f"\n❌ Simple animation test failed for: '{description}'")
         time.sleep(1)  # Brief pause between tests
     
     # Test more complex animation generation
-    complex_descriptions = [
-        "Create a blue circle and transform it into a red square",
-        "Write the text \"Animation\" and fade in a green triangle below it",
-        "Draw a square, rotate it, and then fade it out"
-    ]
-    
-    for description in complex_descriptions:
+    for description in COMPLEX_DESCRIPTIONS:
         result = test_generate_animation(description)
         if not result:
             print(f"\n❌ Complex animation test failed for: '{description}'")
@@ -0,0 +1,265 @@
+"""
+Tests that need neither a running server nor Manim:
+
+    python -m pytest utils/test_offline.py
+"""
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the job store (created on import) out of the data folder of a real deployment
+os.environ.setdefault('JOB_DB_PATH', os.path.join(tempfile.mkdtemp(prefix='manim_app_test_'), 'jobs.db'))
+
+from backend.batches import Batch
+from backend.farm import LeaseQueue, render_tasks
+from backend.manim_output import ManimOutputParser, ANIMATION_STARTED, PARTIAL_MOVIE_WRITTEN
+from backend.scene_templates import plan_scene, render_scene_code
+from backend.janitor import janitor
+from backend.jobs import COMPLETED, Job, JobQueue, job_queue
+from backend.scheduler import BATCH, INTERACTIVE, JobScheduler, plan_degradations, render_rank
+
+# Manim 0.18.1 log lines as Rich prints them with COLUMNS=1000 (see renderer.run_manim_subprocess):
+# timestamp and level first, the message padded out, then the source location column
+PARTIAL_MOVIE_LOG = (
+    "[10/18/26 14:02:11] INFO     Animation 0 : Partial movie file written in "
+    "'/app/media/videos/3f1c/480p15/partial_movie_files/ManimScene/1185818338_2425887466_223132457.mp4'"
+    + " " * 40 + "scene_file_writer.py:527"
+)
+FILE_READY_LOG = (
+    "                    INFO     File ready at "
+    "'/app/media/videos/3f1c/480p15/ManimScene.mp4'"
+    + " " * 60 + "scene_file_writer.py:737"
+)
+
+
+def test_output_parser_reads_rich_log_lines():
+    events = []
+    parser = ManimOutputParser(on_event=events.append, stall_seconds=0)
+    parser.feed("Animation 0: Create(Circle):  50%|#####     | 8/15 [00:00<00:00, 50.0it/s]\n")
+    parser.feed(PARTIAL_MOVIE_LOG + "\n")
+    parser.feed(FILE_READY_LOG + "\n")
+
+    assert [event["event"] for event in events] == [ANIMATION_STARTED, PARTIAL_MOVIE_WRITTEN]
+    assert events[0]["name"] == "Create(Circle)"
+    assert events[1]["path"].endswith("/ManimScene/1185818338_2425887466_223132457.mp4")
+    assert parser.output_path == "/app/media/videos/3f1c/480p15/ManimScene.mp4"
+
+
+def test_output_parser_reads_unquoted_paths():
+    parser = ManimOutputParser(stall_seconds=0)
+    parser.feed("File ready at /app/media/videos/3f1c/480p15/ManimScene.mp4\n")
+    assert parser.output_path == "/app/media/videos/3f1c/480p15/ManimScene.mp4"
+
+
+# Descriptions the template planner must understand fully -> animations its scene must play, in order
+SCENE_PLANS = {
+    "Create a blue circle and transform it into a red square": [
+        "Create(circle)", "ReplacementTransform(circle, square)"],
+    "Transform a circle into a square": [
+        "Create(circle)", "ReplacementTransform(circle, square)"],
+    "Transform a circle into a square, then rotate the circle": [
+        "Create(circle)", "ReplacementTransform(circle, square)", "Rotate(square"],
+    "Create a red circle and a blue square, then transform the red circle into a triangle": [
+        "Create(circle)", "Create(square)", "ReplacementTransform(circle, triangle)"],
+    "The circle turns into a square": [
+        "Create(circle)", "ReplacementTransform(circle, square)"],
+    "Draw a square, rotate it, and then fade it out": [
+        "Create(square)", "Rotate(square", "FadeOut(square)"],
+    "Create a circle and move it to the left": [
+        "Create(circle)", "circle.animate.shift(LEFT * 2)"],
+    "Move the circle up": [
+        "Create(circle)", "circle.animate.shift(UP * 2)"],
+}
+
+# Descriptions the planner must leave to Gemini: it can't honour all of them
+INCOMPLETE_PLANS = [
+    "Transform a circle",
+    "Create a circle and transform it",
+    "Draw 3 squares",
+    "Draw two circles",
+    "Create a circle on the left",
+    "Write the text \"Animation\" and fade in a green triangle below it",
+]
+
+
+def test_scene_plans():
+    for description, animations in SCENE_PLANS.items():
+        plan = plan_scene(description)
+        assert plan.complete, (description, plan.unknown_words, plan.dropped_actions, plan.unhandled_words)
+        assert len(plan.steps) == len(animations), (description, plan.steps)
+        for step, animation in zip(plan.steps, animations):
+            assert animation in step, (description, step, animation)
+
+
+def test_incomplete_scene_plans():
+    for description in INCOMPLETE_PLANS:
+        assert not plan_scene(description).complete, description
+
+
+def test_scene_code_compiles():
+    for description in list(SCENE_PLANS) + INCOMPLETE_PLANS:
+        compile(render_scene_code(description), description, 'exec')
+
+
+SHORT_SCENE = """
+from manim import *
+
+class ManimScene(Scene):
+    def construct(self):
+        self.play(Create(Circle()))
+"""
+
+
+def _job(job_id, priority=INTERACTIVE, client=None):
+    return SimpleNamespace(job_id=job_id, priority=priority, client=client)
+
+
+def test_render_rank_orders_short_interactive_renders_first():
+    now = time.time()
+    assert render_rank(5.0, INTERACTIVE, now) < render_rank(50.0, INTERACTIVE, now)
+    assert render_rank(5.0, INTERACTIVE, now) < render_rank(5.0, BATCH, now)
+    # A long wait ages a render ahead of a shorter one that came later
+    assert render_rank(50.0, INTERACTIVE, now - 600) < render_rank(5.0, INTERACTIVE, now)
+    assert render_rank(5.0, INTERACTIVE, now, policy='fifo') == now
+
+
+def test_scheduler_hands_out_cheapest_interactive_render_first():
+    costs = {'long': 30.0, 'short': 3.0, 'batch': 1.0}
+    scheduler = JobScheduler(estimate=lambda job, quality: costs[job.job_id])
+    for job in (_job('long'), _job('batch', priority=BATCH), _job('short')):
+        scheduler.put((job, 'l'))
+
+    # The batch render is cheapest, but its class penalty puts it behind both interactive ones
+    assert [scheduler.get()[0].job_id for _ in range(3)] == ['short', 'long', 'batch']
+
+
+def test_scheduler_shares_workers_between_clients():
+    scheduler = JobScheduler()
+    scheduler.put((_job('running', client='busy'), 'l'))
+    scheduler.get()
+
+    scheduler.put((_job('waiting', client='busy'), 'l'))
+    scheduler.put((_job('other', client='other'), 'l'))
+    assert scheduler.get()[0].job_id == 'other'
+
+
+def test_plan_degradations():
+    assert plan_degradations(SHORT_SCENE, 3600) == {}
+    assert plan_degradations(SHORT_SCENE, 3600, preview=True) == {}
+    assert plan_degradations(SHORT_SCENE, 0.1) == {"last_frame": True}
+
+    # A dry run's measured duration replaces the static estimate
+    long_run = {"duration": 100.0}
+    assert plan_degradations(SHORT_SCENE, 3600, dry_run=long_run) == {}
+    degraded = plan_degradations(SHORT_SCENE, 20, dry_run=long_run, preview=True)
+    assert degraded["skipped_preview"] and degraded["frame_rate"] == 10 and "last_frame" not in degraded
+
+
+def test_lease_queue_lease_renew_complete(tmp_path):
+    tasks = LeaseQueue(path=str(tmp_path / 'tasks.db'), lease_seconds=60)
+    tasks.put('late', 'l', rank=2.0)
+    tasks.put('early', 'l', rank=1.0)
+    tasks.put('early', 'l', rank=0.0)  # Already queued: a no-op
+    assert tasks.counts() == {"waiting": 2, "leased": 0}
+
+    task = tasks.lease('node-a')
+    assert (task.job_id, task.quality, task.deliveries) == ('early', 'l', 1)
+    assert tasks.counts() == {"waiting": 1, "leased": 1}
+    assert tasks.renew(task, 'node-a')
+    assert not tasks.renew(task, 'node-b')
+
+    # Another node's complete doesn't remove the task
+    tasks.complete(task, 'node-b')
+    assert tasks.has('early', 'l')
+    tasks.complete(task, 'node-a')
+    assert not tasks.has('early')
+    assert tasks.lease('node-a').job_id == 'late'
+    assert tasks.lease('node-a') is None
+
+
+def test_lease_queue_redelivers_expired_leases(tmp_path):
+    tasks = LeaseQueue(path=str(tmp_path / 'tasks.db'), lease_seconds=0)
+    tasks.put('job', 'l')
+    first = tasks.lease('node-a')
+    time.sleep(0.01)
+    second = tasks.lease('node-b')
+    assert (second.job_id, second.deliveries) == ('job', 2)
+    # The lease went to node-b: node-a can neither renew nor remove the task
+    assert not tasks.renew(first, 'node-a')
+    tasks.complete(first, 'node-a')
+    assert tasks.has('job', 'l')
+
+
+def test_media_route_serves_only_videos_and_images(tmp_path, monkeypatch):
+    import app as app_module
+    monkeypatch.setattr(app_module, 'MEDIA_FOLDER', str(tmp_path))
+    for name in ('jobs.db', 'jobs.db-wal', 'pins/job', 'recordings/abc.json', 'videos/job/480p15/ManimScene.mp4',
+                 'images/job/ManimScene.png'):
+        os.makedirs(os.path.dirname(tmp_path / name), exist_ok=True)
+        (tmp_path / name).write_bytes(b'data')
+    client = app_module.app.test_client()
+
+    for name in ('jobs.db', 'jobs.db-wal', 'pins/job', 'recordings/abc.json', 'videos/../jobs.db',
+                 'videos/missing.mp4'):
+        assert client.get(f'/media/{name}').status_code == 404, name
+    assert client.get('/media/videos/job/480p15/ManimScene.mp4').status_code == 200
+    assert client.get('/media/images/job/ManimScene.png').status_code == 200
+
+
+def test_batch_is_done_when_its_summary_is_published():
+    batch = Batch([("Draw a circle", 'l'), ("Draw a square", 'l')])
+    done_at_event = []
+    publish = batch.publish
+    batch.publish = lambda event, data: (done_at_event.append((event, batch.done)), publish(event, data))
+
+    batch.finish_items([0], COMPLETED)
+    batch.finish_items([1], COMPLETED)
+
+    assert done_at_event == [('item', False), ('item', False), ('batch', True)]
+
+
+def test_render_node_queues_quality_renders_without_local_workers():
+    job = Job("Draw a circle", quality='m')
+    job.code = SHORT_SCENE
+    job.state = COMPLETED
+    job.save()
+    node_queue = JobQueue(render_node=True)
+
+    node_queue.request_quality(job.job_id, 'm')
+
+    assert render_tasks.has(job.job_id, 'm')
+    assert node_queue._workers == [] and node_queue._codegen_workers == []
+    assert not node_queue._recovered and janitor._thread is None
+
+
+def test_last_frame_job_has_a_preview_and_no_video(tmp_path):
+    import app as app_module
+    client = app_module.app.test_client()
+    job = Job("Draw a circle", deadline_ms=100)
+    job.code = SHORT_SCENE
+    # As a render worker leaves a job that only had time for its final frame
+    job.degradations = {"last_frame": True}
+    job.preview_path = str(tmp_path / 'ManimScene.png')
+    (tmp_path / 'ManimScene.png').write_bytes(b'png')
+    job.state = COMPLETED
+    job.save()
+
+    status = client.get(f'/api/status/{job.job_id}').get_json()
+    assert status["status"] == COMPLETED and status["degradations"] == {"last_frame": True}
+    assert "video_url" not in status and status["preview_url"].startswith(f'/api/preview/{job.job_id}')
+
+    video = client.get(f'/api/video/{job.job_id}')
+    assert video.status_code == 404 and video.get_json()["preview_url"] == status["preview_url"]
+    assert client.get(status["preview_url"]).status_code == 200
+
+
+def test_planned_degradations():
+    job = Job("Draw a circle", deadline_ms=100)
+    assert job_queue.planned_degradations(job) is None
+    job.code = SHORT_SCENE
+    assert job_queue.planned_degradations(job) == {"last_frame": True}
+    assert job_queue.planned_degradations(Job("Draw a circle")) is None